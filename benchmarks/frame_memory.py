@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+Frame allocations and memory use of guest calls,
+with and without the frame free list of the virtual machine.
+
+    python -m benchmarks.frame_memory
+"""
+import builtins
+import time
+import tracemalloc
+
+from modules import virtual_machine
+from modules.frame import Frame
+from modules.inline_cache import Namespace
+from modules.virtual_machine import VirtualMachine
+
+SOURCE = """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+result = fib(20)
+"""
+
+
+class CountingFrame(Frame):
+    """
+    a Frame that counts how many times one was allocated
+    """
+    __slots__ = []
+    allocated = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingFrame.allocated += 1
+        super(CountingFrame, self).__init__(*args, **kwargs)
+
+
+def measure(max_free_frames):
+    """
+    run SOURCE and report the best time, the frames allocated and the peak traced memory
+    :param max_free_frames:
+    """
+    code = compile(SOURCE, "<frame_memory>", "exec")
+    times = []
+    for _ in range(3):
+        names = Namespace({'__builtins__': builtins, '__name__': '__main__'})
+        vm = VirtualMachine(max_free_frames=max_free_frames)
+        start = time.perf_counter()
+        vm.run_code(code, global_names=names, local_names=names)
+        times.append(time.perf_counter() - start)
+
+    names = Namespace({'__builtins__': builtins, '__name__': '__main__'})
+    vm = VirtualMachine(max_free_frames=max_free_frames)
+    CountingFrame.allocated = 0
+    virtual_machine.Frame = CountingFrame
+    tracemalloc.start()
+    try:
+        vm.run_code(code, global_names=names, local_names=names)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        virtual_machine.Frame = Frame
+    return {
+        'seconds': min(times),
+        'frames_allocated': CountingFrame.allocated,
+        'peak_bytes': peak,
+    }
+
+
+def main():
+    for label, max_free_frames in [('without free list', 0), ('with free list', 32)]:
+        result = measure(max_free_frames)
+        print('%-18s %7.3fs  %6d frames allocated  %8d peak bytes' % (
+            label, result['seconds'], result['frames_allocated'], result['peak_bytes']))
+
+
+if __name__ == '__main__':
+    main()
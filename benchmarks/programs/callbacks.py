@@ -0,0 +1,43 @@
+import functools
+
+
+def key(record):
+    return record[1]
+
+
+def by_name(record):
+    return record[0]
+
+
+def is_even(record):
+    return record[1] % 2 == 0
+
+
+def size(record):
+    return record[1] * 3 + 1
+
+
+def add(total, record):
+    return total + record[1]
+
+
+def records(count):
+    data = []
+    for i in range(count):
+        data.append(('item%d' % (i * 7919 % count), i * 104729 % count))
+    return data
+
+
+def callbacks(count):
+    data = records(count)
+    ordered = sorted(data, key=key)
+    named = sorted(data, key=by_name, reverse=True)
+    evens = list(filter(is_even, data))
+    sizes = list(map(size, data))
+    smallest = min(data, key=key)
+    largest = max(data, key=by_name)
+    total = functools.reduce(add, data, 0)
+    return ordered[0], named[0], len(evens), sum(sizes), smallest, largest, total
+
+
+result = [callbacks(5000) for _ in range(4)][-1]
@@ -0,0 +1,31 @@
+def word_counts(count):
+    counts = {}
+    for i in range(count):
+        key = 'w%d' % (i % 97)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def invert(mapping):
+    inverted = {}
+    for key, value in mapping.items():
+        inverted.setdefault(value, []).append(key)
+    return inverted
+
+
+def histogram(count):
+    buckets = {}
+    for i in range(count):
+        bucket = (i * 7919) % 101
+        if bucket in buckets:
+            buckets[bucket] += 1
+        else:
+            buckets[bucket] = 1
+    for bucket in list(buckets):
+        if buckets[bucket] < 100:
+            del buckets[bucket]
+    return {bucket: total * 2 for bucket, total in buckets.items()}
+
+
+counts = word_counts(30000)
+result = (len(invert(counts)), sum(histogram(30000).values()))
@@ -0,0 +1,40 @@
+class ValidationError(Exception):
+    pass
+
+
+def validate(value):
+    if value % 3 == 0:
+        raise ValidationError(value)
+    if value % 5 == 0:
+        raise KeyError(value)
+    return value
+
+
+def count_failures(count):
+    failures = 0
+    cleanups = 0
+    for i in range(count):
+        try:
+            try:
+                validate(i)
+            finally:
+                cleanups += 1
+        except ValidationError:
+            failures += 1
+        except KeyError:
+            failures += 2
+    return failures, cleanups
+
+
+def lookup_with_default(count):
+    table = {}
+    total = 0
+    for i in range(count):
+        try:
+            total += table[i % 50]
+        except KeyError:
+            table[i % 50] = i
+    return total
+
+
+result = (count_failures(20000), lookup_with_default(20000))
@@ -0,0 +1,34 @@
+def numbers(count):
+    for i in range(count):
+        yield i
+
+
+def evens(values):
+    for value in values:
+        if value % 2 == 0:
+            yield value
+
+
+def squares(values):
+    for value in values:
+        yield value * value
+
+
+def chunks(values, size):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def flatten(groups):
+    for group in groups:
+        yield from group
+
+
+pipeline = chunks(squares(evens(numbers(30000))), 7)
+result = (sum(flatten(pipeline)), sum(x for x in squares(range(10000))))
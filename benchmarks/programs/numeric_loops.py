@@ -0,0 +1,29 @@
+def sieve(limit):
+    is_prime = [True] * (limit + 1)
+    is_prime[0] = is_prime[1] = False
+    i = 2
+    while i * i <= limit:
+        if is_prime[i]:
+            for multiple in range(i * i, limit + 1, i):
+                is_prime[multiple] = False
+        i += 1
+    return sum(is_prime)
+
+
+def mandelbrot(size, iterations):
+    inside = 0
+    for y in range(size):
+        for x in range(size):
+            c_re = 3.0 * x / size - 2.0
+            c_im = 2.0 * y / size - 1.0
+            z_re = z_im = 0.0
+            for _ in range(iterations):
+                z_re, z_im = z_re * z_re - z_im * z_im + c_re, 2.0 * z_re * z_im + c_im
+                if z_re * z_re + z_im * z_im > 4.0:
+                    break
+            else:
+                inside += 1
+    return inside
+
+
+result = (sieve(60000), mandelbrot(32, 40))
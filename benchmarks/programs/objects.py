@@ -0,0 +1,75 @@
+class Shape(object):
+    def __init__(self, name):
+        self.name = name
+
+    def area(self):
+        raise NotImplementedError
+
+    def describe(self):
+        return '%s with area %.1f' % (self.name, self.area())
+
+
+class Rectangle(Shape):
+    def __init__(self, width, height):
+        Shape.__init__(self, 'rectangle')
+        self.width = width
+        self.height = height
+
+    def area(self):
+        return self.width * self.height
+
+
+class Square(Rectangle):
+    def __init__(self, side):
+        Rectangle.__init__(self, side, side)
+        self.name = 'square'
+
+
+class Circle(Shape):
+    def __init__(self, radius):
+        Shape.__init__(self, 'circle')
+        self.radius = radius
+
+    def area(self):
+        return 3.14159 * self.radius * self.radius
+
+
+class Vector(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __add__(self, other):
+        return Vector(self.x + other.x, self.y + other.y)
+
+    def scaled(self, factor):
+        return Vector(self.x * factor, self.y * factor)
+
+
+def shapes(count):
+    total = 0.0
+    longest = ''
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            shape = Rectangle(i % 7 + 1, i % 5 + 1)
+        elif kind == 1:
+            shape = Square(i % 9 + 1)
+        else:
+            shape = Circle(i % 4 + 1)
+        total += shape.area()
+        description = shape.describe()
+        if len(description) > len(longest):
+            longest = description
+    return round(total, 2), longest
+
+
+def walk(steps):
+    position = Vector(0, 0)
+    step = Vector(1, 2)
+    for i in range(steps):
+        position = position + step.scaled(i % 3)
+    return position.x, position.y
+
+
+result = (shapes(8000), walk(10000))
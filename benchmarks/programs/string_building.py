@@ -0,0 +1,29 @@
+def render_rows(count):
+    lines = []
+    for i in range(count):
+        name = 'item%d' % i
+        lines.append(f'{i:5d} | {name:<10} | {i * 1.5:8.2f} | {name!r}')
+    return '\n'.join(lines)
+
+
+def words(text):
+    found = []
+    for line in text.splitlines():
+        for word in line.split('|'):
+            word = word.strip()
+            if word:
+                found.append(word.upper())
+    return found
+
+
+def concatenate(count):
+    text = ''
+    for i in range(count):
+        text += str(i)
+        if len(text) > 200:
+            text = text[100:]
+    return text
+
+
+table = render_rows(3000)
+result = (len(table), len(words(table)), concatenate(20000))
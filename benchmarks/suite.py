@@ -0,0 +1,239 @@
+# coding=utf-8
+"""
+Run the guest programs in benchmarks/programs under chenab, with its
+classic and threaded engines, and under CPython, and compare chenab
+against a stored baseline.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --update-baseline
+
+Every program runs in a fresh process per engine, so peak RSS is its own.
+Wall time is the best of `--repeat` runs. Instructions per second divide
+the number of instructions chenab executes for a program by the wall time
+of each engine. A program regresses when the chenab/CPython time ratio of
+either engine grows more than `--threshold` over the baseline's; the
+ratio, unlike wall time, carries over between machines. The speedup is the classic engine's
+time over the threaded engine's.
+"""
+import builtins
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import click
+
+from modules.inline_cache import Namespace
+from modules.virtual_machine import VirtualMachine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAMS = os.path.join(ROOT, 'benchmarks', 'programs')
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+ENGINES = ('chenab', 'threaded', 'cpython')
+
+
+class CountingVirtualMachine(VirtualMachine):
+    """
+    a VirtualMachine that counts the instructions it runs
+    """
+
+    def __init__(self, **kwargs):
+        super(CountingVirtualMachine, self).__init__(**kwargs)
+        self.instructions = 0
+
+    def dispatch(self, bytecode_fn, argument):
+        self.instructions += 1
+        return super(CountingVirtualMachine, self).dispatch(bytecode_fn, argument)
+
+
+def programs(only=()):
+    """
+    names of the benchmark programs, sorted
+    :param only: names to keep, all of them if empty
+    """
+    names = sorted(name[:-3] for name in os.listdir(PROGRAMS) if name.endswith('.py'))
+    if only:
+        names = [name for name in names if name in only]
+    return names
+
+
+def execute(engine, code, vm_class=VirtualMachine):
+    """
+    run compiled program `code` once
+    :param engine: 'chenab', 'threaded' or 'cpython'
+    :param code:
+    :param vm_class: VirtualMachine class used for 'chenab' and 'threaded'
+    :return: the global names of the program, and the virtual machine if any
+    """
+    names = {'__builtins__': builtins, '__name__': '__main__'}
+    vm = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'chenab':
+            names = Namespace(names)
+            vm = vm_class()
+            vm.run_code(code, global_names=names)
+        elif engine == 'threaded':
+            names = Namespace(names)
+            vm = vm_class(engine='threaded')
+            vm.run_code(code, global_names=names)
+        else:
+            exec(code, names)
+    return names, vm
+
+
+def measure_here(engine, name, repeat):
+    """
+    measure one program in this process
+    :param engine:
+    :param name:
+    :param repeat:
+    :return: dict of results
+    """
+    path = os.path.join(PROGRAMS, name + '.py')
+    with open(path) as f:
+        code = compile(f.read(), path, 'exec')
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        names, _ = execute(engine, code)
+        times.append(time.perf_counter() - start)
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024  # bytes there, kilobytes elsewhere
+    result = {
+        'seconds': min(times),
+        'peak_rss_kb': maxrss,
+        'result': repr(names.get('result')),
+    }
+    if engine == 'chenab':
+        _, vm = execute(engine, code, CountingVirtualMachine)
+        result['instructions'] = vm.instructions
+    return result
+
+
+def measure(engine, name, repeat):
+    """
+    measure one program in a new process
+    :param engine:
+    :param name:
+    :param repeat:
+    :return: dict of results
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.suite', '--child', engine, '--repeat', str(repeat), name],
+        cwd=ROOT,
+    )
+    return json.loads(output.decode())
+
+
+def run_suite(names, repeat):
+    """
+    measure every program under all engines
+    :param names:
+    :param repeat:
+    :return: dict of results by program name
+    """
+    results = {}
+    for name in names:
+        chenab = measure('chenab', name, repeat)
+        threaded = measure('threaded', name, repeat)
+        cpython = measure('cpython', name, repeat)
+        for engine, other in (('threaded', threaded), ('CPython', cpython)):
+            if chenab['result'] != other['result']:
+                raise click.ClickException('%s: chenab computed %s, %s %s' % (
+                    name, chenab['result'], engine, other['result']))
+        instructions = chenab.pop('instructions')
+        for engine in (chenab, threaded, cpython):
+            engine.pop('result')
+            engine['instructions_per_second'] = instructions / engine['seconds']
+        results[name] = {
+            'instructions': instructions,
+            'chenab': chenab,
+            'threaded': threaded,
+            'cpython': cpython,
+            'ratio': chenab['seconds'] / cpython['seconds'],
+            'threaded_ratio': threaded['seconds'] / cpython['seconds'],
+            'speedup': chenab['seconds'] / threaded['seconds'],
+        }
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    programs whose chenab/CPython time ratio, on either engine, grew beyond
+    `threshold` over the baseline
+    :param results: results of run_suite
+    :param baseline: results of an earlier run_suite
+    :param threshold: allowed relative growth, 0.1 for 10%
+    :return: list of (name, engine, baseline ratio, ratio)
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        for engine, key in (('classic', 'ratio'), ('threaded', 'threaded_ratio')):
+            before = baseline.get(name, {}).get(key)
+            if before is not None and result[key] > before * (1 + threshold):
+                regressions.append((name, engine, before, result[key]))
+    return regressions
+
+
+def report(results, stream=sys.stdout):
+    """
+    print a table of results
+    :param results:
+    :param stream:
+    """
+    stream.write('%-22s %10s %10s %10s %8s %8s %12s %12s %10s\n' % (
+        'program', 'chenab s', 'threaded s', 'cpython s', 'ratio', 'speedup', 'chenab ips', 'cpython ips',
+        'rss kB'))
+    for name, result in sorted(results.items()):
+        chenab, threaded, cpython = result['chenab'], result['threaded'], result['cpython']
+        stream.write('%-22s %10.4f %10.4f %10.4f %8.1f %8.2f %12.0f %12.0f %10d\n' % (
+            name, chenab['seconds'], threaded['seconds'], cpython['seconds'], result['ratio'],
+            result['speedup'], chenab['instructions_per_second'], cpython['instructions_per_second'],
+            chenab['peak_rss_kb']))
+
+
+@click.command()
+@click.argument('only', nargs=-1)
+@click.option('--repeat', default=3, show_default=True, help='Runs of each program; the best one counts.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+@click.option('--baseline', default=BASELINE, show_default=True, type=click.Path(dir_okay=False),
+              help='Results to compare against.')
+@click.option('--threshold', default=0.25, show_default=True,
+              help='Allowed growth of the chenab/CPython time ratio over the baseline.')
+@click.option('--update-baseline', is_flag=True, help='Store the results as the new baseline.')
+@click.option('--child', type=click.Choice(ENGINES), hidden=True)
+def main(only, repeat, output, baseline, threshold, update_baseline, child):
+    if child:
+        name, = only
+        click.echo(json.dumps(measure_here(child, name, repeat)))
+        return
+
+    results = run_suite(programs(only), repeat)
+    report(results)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if update_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return
+
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            regressions = find_regressions(results, json.load(f), threshold)
+        for name, engine, before, after in regressions:
+            click.echo('%s regressed on the %s engine: %.1fx CPython, was %.1fx' % (name, engine, after, before),
+                       err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
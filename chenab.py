@@ -1,14 +1,194 @@
+import io
+import json
+import sys
+
 import click
 
 from modules import __main__
+from modules.batch import expand_paths, run_many as run_batch
+from modules.code_cache import CodeCache
+from modules.guest_traceback import format_exception
+from modules.profiler import Profiler
+from modules.sampler import SamplingProfiler
+from modules.scheduler import POLICIES, QUOTA, Scheduler
+from modules.server import run_client, serve as serve_forever
+from modules.virtual_machine import VirtualMachine
 
 
-@click.group(invoke_without_command=True)
-@click.argument('file_name', nargs=1)
-def cli(file_name):
+class Chenab(click.Group):
+    """
+    `chenab FILE` runs FILE, anything else is a subcommand
+    """
+
+    def resolve_command(self, ctx, args):
+        if args and self.get_command(ctx, args[0]) is None:
+            return 'run', self.get_command(ctx, 'run'), args
+        return super(Chenab, self).resolve_command(ctx, args)
+
+
+def print_quickening_stats(stats):
+    """
+    print a table of quickening statistics to stderr
+    :param stats: result of VirtualMachine.quickening_stats
+    """
+    click.echo('%-18s %7s %12s %8s %16s %16s' % ('opcode', 'sites', 'specialized', 'generic',
+                                                 'specializations', 'deoptimizations'), err=True)
+    for name, row in sorted(stats.items()):
+        click.echo('%-18s %7d %12d %8d %16d %16d' % ((name,) + tuple(row)), err=True)
+
+
+@click.group(cls=Chenab)
+@click.option('--optimize', is_flag=True, help='Fuse and thread instructions before running them.')
+@click.option('--engine', type=click.Choice(VirtualMachine.ENGINES), default='classic', show_default=True,
+              help='Run instructions in the classic dispatch loop, or as threaded closures.')
+@click.option('--hot-threshold', type=click.IntRange(1), metavar='CALLS',
+              help='Run functions called this many times as native CPython functions. Functions '
+                   'recursing through one another then reach about half the host recursion limit.')
+@click.option('--quicken', is_flag=True,
+              help='Specialize arithmetic and comparisons for the operand types they run on.')
+@click.option('--quicken-stats', is_flag=True, help='Print what --quicken specialized to stderr.')
+@click.option('--profile', is_flag=True, help='Print opcode and function timings to stderr.')
+@click.option('--profile-output', type=click.Path(dir_okay=False),
+              help='Write function timings to this file, in the pstats format.')
+@click.option('--sample', type=click.Path(dir_okay=False),
+              help='Sample the guest call stack, writing collapsed stacks for flame graphs to this file.')
+@click.option('--sample-interval', type=float, default=0.005, show_default=True,
+              help='Seconds between two samples.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), envvar='CHENAB_CACHE_DIR',
+              help='Keep compiled and decoded code in this directory between runs.')
+@click.option('--cache-size', type=int, default=64, show_default=True,
+              help='Megabytes the code cache may take up.')
+@click.option('--client', type=click.Path(dir_okay=False), metavar='SOCKET',
+              help='Have the `chenab serve` server listening on SOCKET run the file.')
+@click.pass_context
+def cli(ctx, **options):
     """
     Simple Python interpreter written in Python 3.5
 
     Implementation based on content from the book "500 lines or less"
+
+    Run a file with `chenab [OPTIONS] FILE_NAME`.
+    """
+    ctx.obj = options
+
+
+@cli.command(context_settings={'ignore_unknown_options': True, 'allow_interspersed_args': False})
+@click.argument('file_name', nargs=1)
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.pass_obj
+def run(options, file_name, args):
+    """
+    Run one python file, with ARGS as its sys.argv[1:].
+    """
+    if options['client']:
+        sys.exit(run_client(options['client'], file_name, args))
+
+    old_argv, sys.argv = sys.argv, [file_name] + list(args)
+    profile, profile_output, sample = options['profile'], options['profile_output'], options['sample']
+    profiler = Profiler() if profile or profile_output else None
+    sampler = SamplingProfiler(options['sample_interval']) if sample else None
+    code_cache = None
+    if options['cache_dir']:
+        code_cache = CodeCache(options['cache_dir'], options['cache_size'] * 1024 * 1024)
+    vm = __main__.make_vm(options['optimize'], profiler, options['engine'], options['hot_threshold'],
+                          options['quicken'] or options['quicken_stats'])
+    try:
+        __main__.run_python_file(file_name, sampler=sampler, code_cache=code_cache, vm=vm)
+    except Exception as error:
+        click.echo(''.join(format_exception(error)), err=True, nl=False)
+        sys.exit(1)
+    finally:
+        sys.argv = old_argv
+        if sample:
+            sampler.dump_stacks(sample)
+        if profile:
+            profiler.print_stats()
+        if profile_output:
+            profiler.dump_stats(profile_output)
+        if options['quicken_stats']:
+            print_quickening_stats(vm.quickening_stats())
+
+
+@cli.command('run-many')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--workers', type=int, help='Worker processes, one per core by default.')
+@click.option('--timeout', type=float, help='Seconds each file may run.')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write the JSON report here instead of stdout.')
+@click.pass_obj
+def run_many(options, paths, workers, timeout, report):
+    """
+    Run many python files in parallel.
+
+    PATHS are files or glob patterns. The report lists the output, exit
+    status and run time of every file, in the order they were given.
+    """
+    files = expand_paths(paths)
+    cache_size = options['cache_size'] * 1024 * 1024
+    results = run_batch(files, workers=workers, timeout=timeout, optimize=options['optimize'],
+                        cache_dir=options['cache_dir'], cache_size=cache_size)
+    text = json.dumps(results, indent=2)
+    if report:
+        with open(report, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+    if any(result['exit_status'] != 0 for result in results):
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--policy', type=click.Choice(POLICIES), default='round-robin', show_default=True,
+              help='How the next file to run is picked when a slice is used up.')
+@click.option('--quota', type=click.IntRange(1), default=QUOTA, show_default=True,
+              help='Instructions a file runs before the next one gets its turn.')
+@click.option('--limit', type=click.IntRange(1), help='Instructions after which a file is stopped.')
+@click.option('--weight', 'weights', multiple=True, metavar='FILE=WEIGHT',
+              help='Share of the instructions FILE gets under weighted-fair, 1 by default.')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write the JSON report here instead of stdout.')
+@click.pass_obj
+def schedule(options, paths, policy, quota, limit, weights, report):
+    """
+    Run many python files in one process, taking turns.
+
+    PATHS are files or glob patterns. The report lists the output, exit
+    status, instructions run and longest wait of every file, in the order
+    they were given.
+    """
+    shares = {}
+    for weight in weights:
+        file_name, _, share = weight.rpartition('=')
+        try:
+            shares[file_name] = float(share)
+        except ValueError:
+            raise click.BadParameter('expected FILE=WEIGHT, got %r' % weight, param_hint='--weight')
+    scheduler = Scheduler(policy, quota, limit, optimize=options['optimize'], engine=options['engine'],
+                          quicken=options['quicken'])
+    for file_name in expand_paths(paths):
+        scheduler.submit(file_name, weight=shares.get(file_name, 1), stdout=io.StringIO())
+    results = scheduler.run()
+    text = json.dumps(results, indent=2)
+    if report:
+        with open(report, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+    if any(result['exit_status'] != 0 for result in results):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', required=True, type=click.Path(dir_okay=False),
+              help='Unix socket to listen on.')
+@click.option('--workers', type=int, help='Worker processes, one per core by default.')
+@click.pass_obj
+def serve(options, socket_path, workers):
+    """
+    Keep warm workers running files for `chenab --client`.
     """
-    __main__.run_python_file(file_name)
+    cache_size = options['cache_size'] * 1024 * 1024
+    try:
+        serve_forever(socket_path, workers=workers, optimize=options['optimize'],
+                      cache_dir=options['cache_dir'], cache_size=cache_size)
+    except KeyboardInterrupt:
+        pass
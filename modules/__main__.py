@@ -1,25 +1,128 @@
 # coding=utf-8
+import ast
 import imp
 import sys
 
+from modules.inline_cache import Namespace
+from modules.profiler import ProfilingVirtualMachine
 from modules.virtual_machine import VirtualMachine
 
 
-def run_python_file(filename):
+# lets `await` be used outside of functions, where the compiler supports it
+ALLOW_TOP_LEVEL_AWAIT = getattr(ast, 'PyCF_ALLOW_TOP_LEVEL_AWAIT', 0)
+
+
+class MainModule(object):
+    """
+    Stands in for the `__main__` module while a file runs. A module cannot
+    take a `Namespace` for its dict, so this object's attributes are the
+    guest's globals themselves: `import __main__`, pickle and anything else
+    going through `sys.modules['__main__']` see what the guest assigned.
+    """
+
+    def __init__(self, global_names):
+        """
+        :param global_names: the Namespace the file runs in
+        """
+        object.__setattr__(self, '__dict__', global_names)
+
+    # attribute assignments go through the Namespace, so cached lookups see them
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+
+    def __delattr__(self, name):
+        if name not in self.__dict__:
+            raise AttributeError(name)
+        del self.__dict__[name]
+
+    def __repr__(self):
+        return "<module '__main__' from %r>" % self.__dict__.get('__file__')
+
+
+def read_source(filename):
+    """
+    read the source of a python file
+    :param filename:
+    """
+    with open(filename, 'r') as f:
+        source = f.read()
+
+    if not source or source[-1] != '\n':
+        source += '\n'  # `compile` needs the last line to be clean
+    return source
+
+
+def compile_file(filename, flags=0):
+    """
+    read and compile a python file
+    :param filename:
+    :param flags: compiler flags
+    """
+    return compile(read_source(filename), filename, "exec", flags)
+
+
+def make_vm(optimize=False, profiler=None, engine='classic', hot_threshold=None, quicken=False):
+    """
+    make the virtual machine to run a file on, with the options of run_python_file
+    """
+    if profiler is not None:
+        return ProfilingVirtualMachine(profiler, optimize=optimize, quicken=quicken)
+    return VirtualMachine(optimize=optimize, engine=engine, hot_threshold=hot_threshold, quicken=quicken)
+
+
+def run_python_file(filename, optimize=False, profiler=None, sampler=None, code_cache=None, vm=None,
+                    source=None, engine='classic', hot_threshold=None, quicken=False):
     """Run a python file as if it were the main program on the command line.
     `filename` is the path to the file to execute.
+    `optimize` runs the bytecode optimizer over the code before executing it.
+    `profiler`, a `Profiler`, records opcode and function timings while it runs.
+    `sampler`, a `SamplingProfiler`, samples the guest call stack while it runs.
+    `code_cache`, a `CodeCache`, keeps the compiled and decoded code between runs.
+    `vm` is the `VirtualMachine` to run the file on, to reuse its caches across files;
+    by default a new one is made.
+    `source` is run instead of the contents of the file, when given.
+    `engine` names the execution engine of a new `VirtualMachine`; the profiler has its own loop.
+    `hot_threshold` is the number of calls after which a function of a new `VirtualMachine`
+    may run as a native function.
+    `quicken` specializes the arithmetic and comparisons of a new `VirtualMachine` as it runs.
     """
     old_main_mod = sys.modules['__main__']
     main_mod = imp.new_module('__main__')  # Create a module to serve as __main__
-    sys.modules['__main__'] = main_mod
     main_mod.__builtins__ = sys.modules['builtins']
 
-    with open(filename, 'r') as f:
-        source = f.read()
+    # a versioned namespace lets global lookups be cached; it serves as __main__
+    global_names = Namespace(main_mod.__dict__)
+    sys.modules['__main__'] = MainModule(global_names)
+    if vm is None:
+        vm = make_vm(optimize, profiler, engine, hot_threshold, quicken)
 
-    if not source or source[-1] != '\n':
-        source += '\n'  # `compile` needs the last line to be clean
-    code = compile(source, filename, "exec")
+    if source is None:
+        source = read_source(filename)
+    if code_cache is not None:
+        code = code_cache.load(source, filename, vm)
+    else:
+        code = compile(source, filename, "exec")
+    if sampler is not None:
+        sampler.start(vm)
+    try:
+        vm.run_code(code, global_names=global_names)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+
+
+async def run_python_file_async(filename, optimize=False, main='main'):
+    """Run a python file on the running asyncio event loop.
+    Unlike `run_python_file`, `sys.modules['__main__']` is left alone, so
+    several files can run at once as tasks of the same loop.
+    `main` names the coroutine function of the file to await after its module code ran.
+    """
+    module = imp.new_module('__main__')
+    module.__builtins__ = sys.modules['builtins']
+    code = compile_file(filename, ALLOW_TOP_LEVEL_AWAIT)
 
-    vm = VirtualMachine()
-    vm.run_code(code, global_names=main_mod.__dict__)
+    global_names = Namespace(module.__dict__)
+    global_names['__file__'] = filename
+    vm = VirtualMachine(optimize=optimize)
+    return await vm.run_code_async(code, global_names=global_names, main=main)
@@ -0,0 +1,204 @@
+# coding=utf-8
+import collections
+import contextlib
+import glob
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+
+from modules.__main__ import run_python_file
+from modules.code_cache import CodeCache
+from modules.guest_traceback import format_exception
+from modules.virtual_machine import VirtualMachine
+
+# exit status of a file stopped for running too long, as given by timeout(1)
+TIMEOUT_STATUS = 124
+
+# the VirtualMachine and CodeCache of a worker process, reused by all its jobs
+worker_vm = None
+worker_code_cache = None
+
+
+def expand_paths(paths):
+    """
+    the files named by `paths`; glob patterns are expanded, in sorted order
+    :param paths:
+    """
+    files = []
+    for path in paths:
+        if glob.has_magic(path):
+            files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def init_worker(optimize, cache_dir, cache_size):
+    """
+    set up the VirtualMachine and code cache of a worker process
+    :param optimize:
+    :param cache_dir:
+    :param cache_size:
+    """
+    global worker_vm, worker_code_cache
+    worker_vm = VirtualMachine(optimize=optimize)
+    worker_code_cache = CodeCache(cache_dir, cache_size) if cache_dir else None
+
+
+def serve_jobs(connection, optimize, cache_dir, cache_size):
+    """
+    main loop of a worker process: run the files received on `connection`
+    and send back their results, until the connection is closed
+    :param connection:
+    :param optimize:
+    :param cache_dir:
+    :param cache_size:
+    """
+    init_worker(optimize, cache_dir, cache_size)
+    while True:
+        try:
+            filename = connection.recv()
+        except EOFError:
+            return
+        connection.send(run_job(filename))
+
+
+def run_job(filename):
+    """
+    run one file in a worker
+    :param filename:
+    :return: dict with the file's output, exit status and run time
+    """
+    vm = worker_vm
+    vm.frames.clear()
+    vm.current_frame = None
+    output = io.StringIO()
+    result = {'file': filename, 'exit_status': 0, 'error': None, 'timed_out': False}
+
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            run_python_file(filename, code_cache=worker_code_cache, vm=vm)
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            result['exit_status'] = exit.code or 0
+        else:
+            result.update(exit_status=1, error=str(exit.code))
+    except BaseException as error:
+        result.update(exit_status=1, error=''.join(format_exception(error)))
+    result['seconds'] = time.perf_counter() - start
+    result['stdout'] = output.getvalue()
+    return result
+
+
+class Worker(object):
+    """
+    A worker process of run_many, sent one file at a time over a pipe.
+    The deadline of its job is kept here, in the parent: a file that runs
+    too long is stopped by terminating the whole process, so nothing the
+    file does can delay or swallow its timeout.
+    """
+
+    def __init__(self, optimize, cache_dir, cache_size):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_jobs, args=(child, optimize, cache_dir, cache_size),
+                                               daemon=True)
+        self.process.start()
+        child.close()
+        self.index = None  # position of the file it runs in the files of run_many
+        self.filename = None
+        self.started = None
+        self.deadline = None
+
+    def start(self, index, filename, timeout=None):
+        """
+        send the worker a file to run
+        :param index:
+        :param filename:
+        :param timeout: seconds after which the job is stopped
+        """
+        self.index = index
+        self.filename = filename
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.connection.send(os.path.abspath(filename))
+
+    def result(self):
+        """
+        the result of the finished job; one of a worker that died is made up
+        """
+        try:
+            result = self.connection.recv()
+        except EOFError:
+            self.process.join()
+            result = self.failed('worker exited with status %s' % self.process.exitcode)
+        result['file'] = self.filename
+        return result
+
+    def failed(self, error, exit_status=1, timed_out=False):
+        """
+        the result of a job that did not finish in the worker
+        """
+        self.stop()
+        return {'file': self.filename, 'exit_status': exit_status, 'error': error, 'timed_out': timed_out,
+                'seconds': time.monotonic() - self.started, 'stdout': ''}
+
+    def stop(self):
+        """
+        terminate the worker process
+        """
+        self.connection.close()
+        self.process.terminate()
+        self.process.join()
+
+
+def run_many(files, workers=None, timeout=None, optimize=False, cache_dir=None, cache_size=64 * 1024 * 1024):
+    """
+    Run `files` in parallel on long lived worker processes.
+    A worker keeps one VirtualMachine, and with it the decoded
+    instructions of what it ran before, for all the files it runs.
+    A worker whose file runs past the timeout is terminated and
+    replaced by a new one; what the file printed is lost.
+    :param files:
+    :param workers: number of worker processes, one per core by default
+    :param timeout: seconds each file may run
+    :param optimize: run the bytecode optimizer
+    :param cache_dir: directory of a CodeCache shared by the workers
+    :param cache_size:
+    :return: the result of run_job for each file, in the order of `files`
+    """
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    pending = collections.deque(enumerate(files))
+    results = [None] * len(files)
+    idle = [Worker(optimize, cache_dir, cache_size) for _ in range(workers)]
+    busy = {}  # workers running a file, by their connection
+    try:
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                worker.start(*pending.popleft(), timeout=timeout)
+                busy[worker.connection] = worker
+
+            deadlines = [worker.deadline for worker in busy.values() if worker.deadline is not None]
+            wait = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            for connection in multiprocessing.connection.wait(list(busy), wait):
+                worker = busy.pop(connection)
+                results[worker.index] = worker.result()
+                if worker.process.is_alive():
+                    idle.append(worker)
+                elif pending:
+                    idle.append(Worker(optimize, cache_dir, cache_size))
+
+            now = time.monotonic()
+            late = [worker for worker in busy.values() if worker.deadline is not None and worker.deadline <= now]
+            for worker in late:
+                del busy[worker.connection]
+                results[worker.index] = worker.failed('timed out after %gs' % timeout, TIMEOUT_STATUS, timed_out=True)
+                if pending:
+                    idle.append(Worker(optimize, cache_dir, cache_size))
+    finally:
+        for worker in idle + list(busy.values()):
+            worker.stop()
+    return results
@@ -0,0 +1,125 @@
+# coding=utf-8
+import inspect
+
+from modules.frame import UNBOUND
+
+
+class ArgumentBinder(object):
+    """
+    Binds call arguments straight into the fast locals of a new frame.
+    Everything that only depends on the code object (parameter counts,
+    parameter positions, * and ** slots) is worked out once, when the
+    binder is made, following the rules of CPython's own argument parsing.
+    """
+    __slots__ = [
+        'name',
+        'nlocals',
+        'argcount',
+        'kwonlyargcount',
+        'parameters',
+        'positions',
+        'varargs',
+        'varkw',
+        'simple',
+        'padding',
+    ]
+
+    def __init__(self, code):
+        self.name = code.co_name
+        self.nlocals = code.co_nlocals
+        self.argcount = code.co_argcount
+        self.kwonlyargcount = code.co_kwonlyargcount
+        total = self.argcount + self.kwonlyargcount
+        self.parameters = code.co_varnames[:total]
+        self.positions = dict((name, index) for index, name in enumerate(self.parameters))
+
+        index = total
+        self.varargs = self.varkw = None
+        if code.co_flags & inspect.CO_VARARGS:
+            self.varargs = index
+            index += 1
+        if code.co_flags & inspect.CO_VARKEYWORDS:
+            self.varkw = index
+
+        self.simple = self.varargs is None and self.varkw is None and not self.kwonlyargcount
+        self.padding = [UNBOUND] * (self.nlocals - self.argcount)
+
+    def bind(self, args, kwargs, defaults, kwdefaults):
+        """
+        bind the arguments of a call
+        :param args: positional arguments, as a tuple or list
+        :param kwargs: keyword arguments, as a dict or None
+        :param defaults: tuple of defaults of the last positional parameters
+        :param kwdefaults: dict of defaults of keyword only parameters, or None
+        :return: list of fast locals for the new frame
+        """
+        argcount = self.argcount
+        count = len(args)
+        if count == argcount and self.simple and not kwargs:
+            # the common case: exactly the positional parameters
+            return [*args, *self.padding]
+
+        fast_locals = [UNBOUND] * self.nlocals
+        if count > argcount:
+            if self.varargs is None:
+                raise TypeError("%s() takes %d positional argument%s but %d %s given" % (
+                    self.name, argcount, '' if argcount == 1 else 's', count, 'was' if count == 1 else 'were'))
+            fast_locals[self.varargs] = tuple(args[argcount:])
+            fast_locals[:argcount] = args[:argcount]
+        else:
+            fast_locals[:count] = args
+            if self.varargs is not None:
+                fast_locals[self.varargs] = ()
+
+        if self.varkw is not None:
+            extra = fast_locals[self.varkw] = {}
+        if kwargs:
+            positions = self.positions
+            for name, value in kwargs.items():
+                index = positions.get(name)
+                if index is None:
+                    if self.varkw is None:
+                        raise TypeError("%s() got an unexpected keyword argument '%s'" % (self.name, name))
+                    extra[name] = value
+                elif fast_locals[index] is not UNBOUND:
+                    raise TypeError("%s() got multiple values for argument '%s'" % (self.name, name))
+                else:
+                    fast_locals[index] = value
+
+        if count < argcount:
+            first_default = argcount - len(defaults)
+            missing = []
+            for index in range(count, argcount):
+                if fast_locals[index] is UNBOUND:
+                    if index >= first_default:
+                        fast_locals[index] = defaults[index - first_default]
+                    else:
+                        missing.append(self.parameters[index])
+            if missing:
+                self.raise_missing(missing, 'positional')
+
+        if self.kwonlyargcount:
+            missing = []
+            for index in range(argcount, argcount + self.kwonlyargcount):
+                if fast_locals[index] is UNBOUND:
+                    name = self.parameters[index]
+                    if kwdefaults and name in kwdefaults:
+                        fast_locals[index] = kwdefaults[name]
+                    else:
+                        missing.append(name)
+            if missing:
+                self.raise_missing(missing, 'keyword-only')
+
+        return fast_locals
+
+    def raise_missing(self, missing, kind):
+        """
+        raise the TypeError of a call without some required arguments
+        :param missing: names of the parameters without a value
+        :param kind: 'positional' or 'keyword-only'
+        """
+        names = ["'%s'" % name for name in missing]
+        if len(names) > 1:
+            names = [', '.join(names[:-1]) + ' and ' + names[-1]]
+        raise TypeError("%s() missing %d required %s argument%s: %s" % (
+            self.name, len(missing), kind, '' if len(missing) == 1 else 's', names[0]))
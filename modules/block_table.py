@@ -0,0 +1,80 @@
+# coding=utf-8
+import collections
+import dis
+
+from modules.optimizer import JUMPS, NO_FALL_THROUGH
+from modules.virtual_machine_error import VirtualMachineError
+
+# A block set up by a SETUP_* instruction: its type, the index of its
+# handler, and the index of the SETUP_* instruction, under which the frame
+# records the height of the data stack when the block is entered.
+Block = collections.namedtuple("Block", "type, handler, setup")
+
+SETUP_BLOCKS = {
+    'SETUP_LOOP': 'loop',
+    'SETUP_EXCEPT': 'setup-except',
+    'SETUP_FINALLY': 'finally',
+    'SETUP_WITH': 'finally',
+    'SETUP_ASYNC_WITH': 'finally',
+}
+
+# superinstructions do not fall through either
+STOPS = NO_FALL_THROUGH | frozenset(['RETURN_CONST'])
+
+
+def jump_target(instruction):
+    """
+    the index `instruction` may jump to, or None
+    `CONTINUE_LOOP` does not count: it reaches its loop by unwinding blocks.
+    :param instruction:
+    """
+    if instruction.opcode is None:
+        # a superinstruction jumps if its last part does, to its last argument
+        last = dis.opmap.get(instruction.name.rpartition('__')[2])
+        return instruction.arguments[-1] if last in JUMPS else None
+    if instruction.opcode in JUMPS and instruction.name != 'CONTINUE_LOOP':
+        return instruction.arguments[0]
+    return None
+
+
+def block_table(instructions):
+    """
+    find the blocks around every instruction, once per code object.
+    The blocks of an instruction do not depend on how it was reached, so
+    they are followed along jumps and fall through from SETUP_* to POP_BLOCK
+    instead of being pushed and popped while the code runs. A handler runs
+    outside of its own block.
+    :param instructions: decoded instructions of a code object
+    :return: tuple with the blocks around each instruction, outermost first,
+        or None when the code sets up no blocks
+    """
+    if not any(instruction.name in SETUP_BLOCKS for instruction in instructions):
+        return None
+
+    chains = [None] * len(instructions)
+    pending = [(0, ())]
+    while pending:
+        index, chain = pending.pop()
+        while index < len(instructions):
+            known = chains[index]
+            if known is not None:
+                if known != chain:
+                    raise VirtualMachineError("inconsistent blocks at instruction %d" % index)
+                break
+            chains[index] = chain
+            instruction = instructions[index]
+            kind = SETUP_BLOCKS.get(instruction.name)
+            if kind is not None:
+                handler = instruction.arguments[0]
+                pending.append((handler, chain))
+                chain += (Block(kind, handler, index),)
+            elif instruction.name == 'POP_BLOCK':
+                chain = chain[:-1]
+            else:
+                target = jump_target(instruction)
+                if target is not None:
+                    pending.append((target, chain))
+            if instruction.name in STOPS:
+                break
+            index += 1
+    return tuple(chains)
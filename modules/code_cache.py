@@ -0,0 +1,207 @@
+# coding=utf-8
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import types
+
+from modules.decoder import Instruction
+
+# bump when the layout of cache files changes
+FORMAT = 1
+SUFFIX = '.chenab'
+
+
+def code_objects(code):
+    """
+    `code` and every code object nested in its constants, depth first
+    :param code:
+    """
+    found = [code]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            found.extend(code_objects(const))
+    return found
+
+
+def encode_instructions(code, instructions):
+    """
+    turn decoded instructions into marshallable tuples
+    Handlers are left out, and so are inline caches; code object arguments
+    are recorded by their index in `code.co_consts` so loading keeps their identity.
+    (The instruction cache is keyed by equality, so the code objects in
+    `instructions` may be equal copies of those in `code.co_consts`.)
+    :param code:
+    :param instructions:
+    """
+    encoded = []
+    for instruction in instructions:
+        arguments = instruction.arguments
+        has_cache = getattr(instruction.handler, 'inline_cache', None) is not None
+        if has_cache:
+            arguments = arguments[:-1]
+        code_arguments = []
+        for position, argument in enumerate(arguments):
+            if isinstance(argument, types.CodeType):
+                index = next(index for index, const in enumerate(code.co_consts)
+                             if isinstance(const, types.CodeType) and const == argument)
+                code_arguments.append((position, index))
+        if code_arguments:
+            arguments = list(arguments)
+            for position, _ in code_arguments:
+                arguments[position] = None
+            arguments = tuple(arguments)
+        encoded.append((instruction.opcode, instruction.name, arguments, instruction.offset,
+                        has_cache, tuple(code_arguments)))
+    return tuple(encoded)
+
+
+def decode_instructions(code, encoded, vm):
+    """
+    rebuild the decoded instructions of `code` for `vm`
+    :param code:
+    :param encoded: result of encode_instructions
+    :param vm:
+    """
+    table = vm.dispatch_table()
+    superinstructions = dict(vm.superinstruction_table().values())
+    instructions = []
+    for opcode, name, arguments, offset, has_cache, code_arguments in encoded:
+        handler = table[opcode] if opcode is not None else superinstructions[name]
+        if code_arguments:
+            arguments = list(arguments)
+            for position, index in code_arguments:
+                arguments[position] = code.co_consts[index]
+            arguments = tuple(arguments)
+        if has_cache:
+            arguments += (handler.inline_cache(),)
+        instructions.append(Instruction(opcode, name, arguments, offset, handler))
+    return tuple(instructions)
+
+
+class CodeCache(object):
+    """
+    Compiled code objects of source files, with the instructions a
+    VirtualMachine decoded (and optimized) from them, kept in a directory.
+    Entries are keyed by a hash of the source, file name, interpreter
+    version and virtual machine setup. Files are written atomically, and the
+    least recently used ones are removed once they take up more than `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source, filename, vm):
+        """
+        name of the cache file of `source` run by `vm`
+        :param source:
+        :param filename:
+        :param vm:
+        """
+        digest = hashlib.sha256()
+        for part in (str(FORMAT), sys.implementation.cache_tag, sys.version, type(vm).__module__,
+                     type(vm).__qualname__, str(vm.optimize), filename):
+            digest.update(part.encode('utf-8', 'surrogateescape'))
+            digest.update(b'\0')
+        digest.update(source.encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest() + SUFFIX
+
+    def load(self, source, filename, vm):
+        """
+        the code object of `source`, with its instructions put in the instruction cache of `vm`
+        Compiles, decodes and stores the code when it is not cached yet.
+        :param source:
+        :param filename:
+        :param vm:
+        """
+        path = os.path.join(self.directory, self.key(source, filename, vm))
+        code = self.read(path, vm)
+        if code is not None:
+            self.hits += 1
+            return code
+
+        self.misses += 1
+        code = compile(source, filename, "exec")
+        tables = []
+        for nested in code_objects(code):
+            tables.append(encode_instructions(nested, vm.instruction_cache[nested]))
+        try:
+            data = marshal.dumps((code, tuple(tables)))
+        except ValueError:
+            return code  # a constant marshal cannot store
+        self.write(path, data)
+        return code
+
+    def read(self, path, vm):
+        """
+        load a cache file, or None when it is missing or unusable
+        :param path:
+        :param vm:
+        """
+        try:
+            with open(path, 'rb') as f:
+                code, tables = marshal.load(f)
+            nested = code_objects(code)
+            if len(nested) != len(tables):
+                return None
+            decoded = [decode_instructions(c, table, vm) for c, table in zip(nested, tables)]
+        except (OSError, EOFError, ValueError, TypeError, KeyError, IndexError):
+            return None
+
+        for c, instructions in zip(nested, decoded):
+            vm.instruction_cache[c] = instructions
+        try:
+            os.utime(path)  # recently used
+        except OSError:
+            pass
+        return code
+
+    def write(self, path, data):
+        """
+        atomically write a cache file, then keep the directory within `max_bytes`
+        :param path:
+        :param data:
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    f.write(data)
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+        except OSError:
+            return  # the cache is only an optimization
+        self.evict()
+
+    def evict(self):
+        """
+        remove the least recently used cache files until they fit in `max_bytes`
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
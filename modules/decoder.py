@@ -0,0 +1,161 @@
+# coding=utf-8
+import collections
+import dis
+import sys
+
+from modules.virtual_machine_error import VirtualMachineError
+
+# Python 3.6 switched from variable length (1 or 3 byte) instructions to
+# fixed 2 byte "wordcode"; 3.10 started counting jump offsets in instructions.
+WORDCODE = sys.version_info >= (3, 6)
+JUMP_UNIT = 2 if sys.version_info >= (3, 10) else 1
+
+EXTENDED_ARG = dis.opmap['EXTENDED_ARG']
+
+HASCONST = frozenset(dis.hasconst)
+HASNAME = frozenset(dis.hasname)
+HASJREL = frozenset(dis.hasjrel)
+HASJABS = frozenset(dis.hasjabs)
+
+Instruction = collections.namedtuple("Instruction", "opcode, name, arguments, offset, handler")
+
+
+def _raw_instructions(code_bytes, wordcode):
+    """
+    split raw bytecode into (opcode, oparg, start offset, next offset) tuples,
+    folding EXTENDED_ARG prefixes into the instruction they extend
+    :param code_bytes:
+    :param wordcode:
+    """
+    offset = 0
+    extended = 0
+    start = 0
+    end = len(code_bytes)
+    while offset < end:
+        opcode = code_bytes[offset]
+        if wordcode:
+            oparg = code_bytes[offset + 1] | extended
+            next_offset = offset + 2
+            shift = 8
+        elif opcode >= dis.HAVE_ARGUMENT:
+            oparg = (code_bytes[offset + 1] | (code_bytes[offset + 2] << 8)) | extended
+            next_offset = offset + 3
+            shift = 16
+        else:
+            oparg = None
+            next_offset = offset + 1
+            shift = 0
+
+        if opcode == EXTENDED_ARG:
+            extended = oparg << shift
+        else:
+            if opcode < dis.HAVE_ARGUMENT:
+                oparg = None
+            yield opcode, oparg, start, next_offset
+            extended = 0
+            start = next_offset
+        offset = next_offset
+
+
+def decode(code, wordcode=WORDCODE, handlers=None):
+    """Turn a code object into a tuple of `Instruction`s.
+    Arguments are resolved up front: constants and names are looked up, and
+    jump targets become indexes into the returned tuple. Local variable
+    opcodes keep their raw index into the frame's fast locals.
+    :param code: code object to decode
+    :param wordcode: whether `co_code` uses 2 byte instructions
+    :param handlers: opcode indexed table of handlers; opcodes without one are rejected
+    Handlers with an `inline_cache` type get a new cache as their last argument.
+    """
+    raw = list(_raw_instructions(code.co_code, wordcode))
+    index_of = {}
+    for index, (_, _, start, _) in enumerate(raw):
+        index_of[start] = index
+    index_of[len(code.co_code)] = len(raw)
+
+    jump_unit = JUMP_UNIT if wordcode else 1
+    instructions = []
+    for opcode, oparg, start, next_offset in raw:
+        if oparg is None:
+            arguments = ()
+        elif opcode in HASCONST:
+            arguments = (code.co_consts[oparg],)
+        elif opcode in HASNAME:
+            arguments = (code.co_names[oparg],)
+        elif opcode in HASJREL:
+            arguments = (index_of[next_offset + oparg * jump_unit],)
+        elif opcode in HASJABS:
+            arguments = (index_of[oparg * jump_unit],)
+        else:
+            arguments = (oparg,)
+        handler = None
+        if handlers is not None:
+            handler = handlers[opcode]
+            if handler is None:
+                raise VirtualMachineError(
+                    "unsupported bytecode type: %s" % dis.opname[opcode]
+                )
+            make_cache = getattr(handler, 'inline_cache', None)
+            if make_cache is not None:
+                arguments += (make_cache(),)
+        instructions.append(Instruction(opcode, dis.opname[opcode], arguments, start, handler))
+    return tuple(instructions)
+
+
+class InstructionCache(object):
+    """
+    decoded instructions of every code object seen so far, keyed by code object
+    `optimizer`, when given, rewrites the instructions of each code object once after decoding
+    """
+
+    def __init__(self, handlers=None, wordcode=WORDCODE, optimizer=None):
+        self.handlers = handlers
+        self.wordcode = wordcode
+        self.optimizer = optimizer
+        self.decoded = {}
+
+    def __getitem__(self, code):
+        """
+        get the decoded instructions of `code`, decoding it on first use
+        :param code:
+        """
+        try:
+            return self.decoded[code]
+        except KeyError:
+            instructions = decode(code, self.wordcode, self.handlers)
+            if self.optimizer is not None:
+                instructions = self.optimizer(instructions)
+            self.decoded[code] = instructions
+            return instructions
+
+    def __setitem__(self, code, instructions):
+        """
+        use already decoded instructions for `code`, such as ones loaded from disk
+        :param code:
+        :param instructions:
+        """
+        self.decoded[code] = instructions
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def cache_stats(self):
+        """
+        sum up the hits and misses of the inline caches of all decoded instructions
+        :return: dict mapping opcode names to (hits, misses)
+        """
+        stats = {}
+        for instructions in self.decoded.values():
+            for instruction in instructions:
+                if getattr(instruction.handler, 'inline_cache', None) is None:
+                    continue
+                cache = instruction.arguments[-1]
+                hits, misses = stats.get(instruction.name, (0, 0))
+                stats[instruction.name] = (hits + cache.hits, misses + cache.misses)
+        return stats
+
+    def clear(self):
+        """
+        forget every decoded code object
+        """
+        self.decoded.clear()
@@ -1,6 +1,47 @@
 import collections
+import inspect
 
-Block = collections.namedtuple("Block", "type, handler, stack_height")
+# An except handler running in a frame: `level` is the number of blocks of
+# the block table around it, `stack_height` the height of the data stack
+# below the exception it replaced.
+Handler = collections.namedtuple("Handler", "level, stack_height")
+# makes a Handler without going through the Python level __new__ of namedtuple
+make_handler = tuple.__new__
+
+# marks a fast local that has not been assigned yet
+UNBOUND = object()
+
+
+class Cell(object):
+    """
+    a variable of a function that the functions nested in it share:
+    one of its `co_cellvars`, or for a nested function, one of its `co_freevars`
+    """
+    __slots__ = ['cell_contents']
+
+    def __init__(self, value=UNBOUND):
+        self.cell_contents = value
+
+
+def make_cells(code, fast_locals, closure):
+    """
+    the cells of a frame running `code`: a new one for each of its
+    `co_cellvars`, then those of `closure` for its `co_freevars`, indexed
+    like the argument of LOAD_DEREF and friends
+    :param code:
+    :param fast_locals: the bound fast locals; an argument an inner function uses starts its cell
+    :param closure: tuple of cells, or None
+    """
+    varnames = code.co_varnames
+    cells = []
+    for name in code.co_cellvars:
+        if name in varnames:
+            cells.append(Cell(fast_locals[varnames.index(name)]))
+        else:
+            cells.append(Cell())
+    if closure:
+        cells += closure
+    return cells
 
 
 class Frame(object):
@@ -8,25 +49,116 @@ class Frame(object):
     collection of attributes with no methods
     the attributes include the code object created by the compiler;
     the local, global, and builtin namespaces; a reference to the previous frame;
-    a data stack; a block stack; and the last instruction executed
+    a data stack; the except handlers running, and the exception the
+    innermost of them handles; and the last instruction executed
+
+    the blocks around each instruction come from the block table of the code
+    object; the frame only records the stack height each block was entered
+    at, in `block_heights`, keyed by the index of its SETUP_* instruction
+
+    local variables of functions live in `fast_locals`, a list indexed the
+    same way as `co_varnames`; `f_locals` merges them into a dict on demand.
+    Those shared with nested functions live in the Cells of `cells`, which
+    is None for code that shares none
+
+    frames are recycled by the virtual machine: `clear` drops what a finished
+    frame refers to and `reset` sets it up again for another code object
     """
+    __slots__ = [
+        'code_obj',
+        'global_names',
+        'local_names',
+        'fast_locals',
+        'cells',
+        'prev_frame',
+        'stack',
+        'builtin_names',
+        'last_instruction',
+        'block_stack',
+        'block_heights',
+        'handled_exception',
+        'suspended',
+    ]
+
+    def __init__(self, code_object, global_names, local_names, previous_frame, fast_locals=None, closure=None):
+        self.stack = []
+        self.block_stack = []
+        self.block_heights = {}
+        self.reset(code_object, global_names, local_names, previous_frame, fast_locals, closure)
 
-    def __init__(self, code_object, global_names, local_names, previous_frame):
+    def reset(self, code_object, global_names, local_names, previous_frame, fast_locals=None, closure=None):
+        """
+        set the frame up to run `code_object`
+        :param code_object:
+        :param global_names:
+        :param local_names:
+        :param previous_frame:
+        :param fast_locals: list of local variable values, when already bound
+        :param closure: tuple of the cells of the free variables of `code_object`
+        """
         self.code_obj = code_object
         self.global_names = global_names
         self.local_names = local_names
+        if fast_locals is None:
+            fast_locals = [UNBOUND] * code_object.co_nlocals
+        self.fast_locals = fast_locals
+        if closure or code_object.co_cellvars:
+            self.cells = make_cells(code_object, fast_locals, closure)
+        else:
+            self.cells = None
         self.prev_frame = previous_frame
-        self.stack = []
 
         if previous_frame:
             self.builtin_names = previous_frame.builtin_names
         else:
-            self.builtin_names = local_names['__builtins__']
+            self.builtin_names = global_names['__builtins__']
             if hasattr(self.builtin_names, '__dict__'):
                 self.builtin_names = self.builtin_names.__dict__
 
         self.last_instruction = 0
-        self.block_stack = []
+        self.handled_exception = None  # as (type, value, traceback), see VirtualMachine.handled_exception
+        self.suspended = False  # stopped at a yield, to be resumed later
+
+    def clear(self):
+        """
+        drop the references of a finished frame, keeping its stacks for reuse
+        """
+        self.code_obj = self.global_names = self.local_names = None
+        self.fast_locals = self.cells = self.prev_frame = self.builtin_names = None
+        self.handled_exception = None
+        self.stack.clear()
+        self.block_stack.clear()
+        self.block_heights.clear()
+
+    @property
+    def f_locals(self):
+        """
+        dict of the local variables, with the current fast locals and cells
+        copied in; what `locals()` returns
+        :return:
+        """
+        if self.fast_locals:
+            self.copy_locals(self.code_obj.co_varnames, self.fast_locals)
+        if self.cells:
+            code = self.code_obj
+            names = code.co_cellvars
+            if code.co_flags & inspect.CO_OPTIMIZED:  # like CPython, free variables only for functions
+                names += code.co_freevars
+            self.copy_locals(names, [cell.cell_contents for cell in self.cells])
+        return self.local_names
+
+    def copy_locals(self, names, values):
+        """
+        put `values` in the local names, removing the unbound ones
+        :param names:
+        :param values:
+        """
+        local_names = self.local_names
+        for name, value in zip(names, values):
+            if value is UNBOUND:
+                local_names.pop(name, None)
+            else:
+                local_names[name] = value
 
     """
     Data stack manipulation
@@ -46,51 +178,56 @@ class Frame(object):
         """
         return self.stack.pop()
 
-    def push(self, *values):
+    def push(self, value):
         """
         push
-        :param values:
+        :param value:
         """
-        self.stack.extend(values)
+        self.stack.append(value)
+
+    def pop_two(self):
+        """
+        pop the two values on top of the stack, the deepest first
+        """
+        stack = self.stack
+        y = stack.pop()
+        return stack.pop(), y
+
+    def pop_three(self):
+        """
+        pop the three values on top of the stack, the deepest first
+        """
+        stack = self.stack
+        z = stack.pop()
+        y = stack.pop()
+        return stack.pop(), y, z
 
     def pop_n(self, n):
-        """Pop a number of values from the value stack.
+        """Pop a variable number of values from the value stack.
         A list of `n` values is returned, the deepest value first.
+        Fixed numbers of values are popped with pop, pop_two and pop_three,
+        which do not make a list.
         """
         if n:
-            ret = self.stack[-n:]
-            self.stack[-n:] = []
+            stack = self.stack
+            ret = stack[-n:]
+            del stack[-n:]
             return ret
         else:
             return []
 
-    # Block stack manipulation
-    def push_block(self, b_type, handler=None):
+    # Except handlers
+    def push_handler(self, level):
         """
-        push block
-        :param b_type:
-        :param handler:
+        start running an except handler, over the current data stack
+        :param level: number of blocks around the handler
         """
-        stack_height = len(self.stack)
-        self.block_stack.append(Block(b_type, handler, stack_height))
+        self.block_stack.append(make_handler(Handler, (level, len(self.stack))))
 
-    def pop_block(self):
-        """
-        pop block
-        :return:
+    def unwind_handler(self, handler):
+        """Unwind the values on the data stack when an except handler is finished.
+        :return: the exception it replaced, as (type, value, traceback)
         """
-        return self.block_stack.pop()
-
-    def unwind_block(self, block):
-        """Unwind the values on the data stack when a given block is finished."""
-        if block.type == 'except-handler':
-            offset = 3
-        else:
-            offset = 0
-
-        while len(self.stack) > block.stack_height + offset:
-            self.pop()
-
-        if block.type == 'except-handler':
-            traceback, value, exctype = self.pop_n(3)
-            return exctype, value, traceback
+        del self.stack[handler.stack_height + 3:]
+        traceback, value, exctype = self.pop_three()
+        return exctype, value, traceback
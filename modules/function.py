@@ -1,14 +1,21 @@
 # coding=utf-8
-import inspect
+import dis
 import types
 
+from modules.generator import GENERATOR_FLAGS, make_generator
 
-def make_cell(value):
+# opcodes that change module globals behind the back of their Namespace when run natively
+GLOBAL_WRITES = frozenset([dis.opmap['STORE_GLOBAL'], dis.opmap['DELETE_GLOBAL']])
+
+
+def writes_globals(code):
     """
-        Create a real Python closure and grab a cell.
+    whether `code`, or code nested in it, assigns or deletes global names
+    :param code:
     """
-    fn = (lambda x: lambda: x)(value)
-    return fn.__closure__[0]
+    if any(instruction.opcode in GLOBAL_WRITES for instruction in dis.get_instructions(code)):
+        return True
+    return any(isinstance(const, types.CodeType) and writes_globals(const) for const in code.co_consts)
 
 
 class Function(object):
@@ -20,44 +27,139 @@ class Function(object):
         'func_code',
         'func_name',
         'func_defaults',
+        'func_kwdefaults',
         'func_globals',
-        'func_locals',
         'func_dict',
         'func_closure',
         '__name__',
         '__dict__',
         '_vm',
         '_func',
+        '_binder',
+        '_native',
+        '_arity',
+        '_frame',
+        '_calls',
     ]
 
-    def __init__(self, name, code, globs, defaults, closure, vm):
+    def __init__(self, name, code, globs, defaults, closure, vm, kwdefaults=None, annotations=None):
         self._vm = vm
         self.func_code = code
         self.func_name = self.__name__ = name or code.co_name
         self.func_defaults = tuple(defaults)
+        self.func_kwdefaults = kwdefaults
         self.func_globals = globs
-        self.func_locals = self._vm.frame.f_locals
         self.__dict__ = {}
         self.func_closure = closure
         self.__doc__ = code.co_consts[0] if code.co_consts else None
+        self.__annotations__ = annotations or {}
+        self._binder = vm.binder(code)
+        self._func = None
+        self._native = None  # the native function, once hot enough to run on it
+        # number of arguments of the calls that may run on `_frame`: those
+        # binding exactly the positional parameters; None if no call may,
+        # like those of generators and of code needing new cells every call
+        binder = self._binder
+        self._arity = None
+        if binder.simple and not (code.co_flags & GENERATOR_FLAGS or code.co_cellvars):
+            self._arity = binder.argcount
+        self._frame = None  # frame kept between calls from native code, while none runs on it
+        self._calls = 0
+
+    def native_function(self):
+        """
+        Sometimes, we need a real Python function.  This is for that.
+        It is only built the first time it is asked for, and never for a
+        closure: its cells belong to the virtual machine.
+        """
+        if self._func is None:
+            self._func = types.FunctionType(self.func_code, self.func_globals, argdefs=self.func_defaults)
+            self._func.__kwdefaults__ = self.func_kwdefaults
+        return self._func
+
+    def __get__(self, instance, owner):
+        """
+        bind to `instance` when looked up as a method
+        :param instance:
+        :param owner:
+        """
+        if instance is None:
+            return self
+        return types.MethodType(self, instance)
+
+    def call_frame(self, args, kwargs):
+        """
+        Start a call: bind its arguments into the fast locals of a new frame.
+        Once called `hot_threshold` times, a function the virtual machine
+        allows runs on its native function instead, and no frame is made.
+        :param args:
+        :param kwargs: dict or None
+        :return: the frame, or None when the call is to go to `_native`
+        """
+        vm = self._vm
+        if self._native is not None and not vm.instrumented:
+            return None
+        self._calls += 1
+        if self._calls == vm.hot_threshold and vm.may_run_natively(self):
+            self._native = self.native_function()
+            self._frame = None
+            return None
 
-        # Sometimes, we need a real Python function.  This is for that.
-        kw = {
-            'argdefs': self.func_defaults,
-        }
-        if closure:
-            kw['closure'] = tuple(make_cell(0) for _ in closure)
-        self._func = types.FunctionType(code, globs, **kw)
+        # The binder fills the fast locals of the new frame directly.
+        fast_locals = self._binder.bind(args, kwargs, self.func_defaults, self.func_kwdefaults)
+        return vm.make_frame(
+            self.func_code, global_names=self.func_globals, local_names={}, fast_locals=fast_locals,
+            closure=self.func_closure,
+        )
 
     def __call__(self, *args, **kwargs):
         """
-        when calling a new function, create and return a Frame object
+        when calling a new function, create a Frame object and run it
+        Guest code calling a guest function does not come through here, see
+        VirtualMachine.call_function; native code calling back into it, like
+        a sort key or a function given to map, does. Such calls mostly pass
+        the same number of positional arguments over and over, so once one
+        of them ran, its frame is kept, still set up for the code and globals
+        of the function, and the next one with exactly the positional
+        parameters puts its arguments straight in, without the binder.
         :param args:
         :param kwargs:
         """
-        calling_arguments = inspect.getcallargs(self._func, *args, **kwargs)
-        # Use callargs to provide a mapping of arguments: values to pass into the new frame.
-        frame = self._vm.make_frame(
-            self.func_code, calling_arguments, self.func_globals, {}
-        )
-        return self._vm.run_frame(frame)
+        vm = self._vm
+        frame = self._frame
+        if frame is not None and len(args) == self._arity and not kwargs and self._calls + 1 != vm.hot_threshold:
+            self._frame = None  # taken until the call returns, calls it makes get frames of their own
+            self._calls += 1
+            frame.fast_locals = [*args, *self._binder.padding]
+            frame.local_names = {}
+            frame.prev_frame = vm.current_frame
+            frame.last_instruction = 0
+            try:
+                return vm.run_frame(frame)
+            finally:
+                self.keep_frame(frame)
+
+        frame = self.call_frame(args, kwargs)
+        if frame is None:
+            return self._native(*args, **kwargs)
+        if self.func_code.co_flags & GENERATOR_FLAGS:
+            # the generator owns the frame, and runs it when asked for values
+            return make_generator(frame, vm)
+        try:
+            return vm.run_frame(frame)
+        finally:
+            if self._frame is None and self._arity is not None and self._native is None:
+                self.keep_frame(frame)
+            else:
+                vm.release_frame(frame)
+
+    def keep_frame(self, frame):
+        """
+        keep the frame of a finished call for the next call from native code,
+        dropping what it refers to but its code, namespaces and closure
+        :param frame:
+        """
+        frame.fast_locals = frame.local_names = frame.prev_frame = None
+        frame.stack.clear()
+        frame.block_stack.clear()
+        self._frame = frame
@@ -0,0 +1,348 @@
+# coding=utf-8
+import inspect
+import types
+
+# code flags of functions that return a generator or coroutine instead of running
+GENERATOR_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+
+class Generator(object):
+    """
+    An interpreted generator: a suspended Frame that resumes
+    where it stopped every time a value is sent into it.
+    """
+
+    def __init__(self, frame, vm):
+        self.gi_frame = frame
+        self.gi_code = frame.code_obj
+        self.gi_running = False
+        self.started = False
+        self.finished = False
+        self.vm = vm
+        self.__name__ = frame.code_obj.co_name
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def __repr__(self):
+        return '<interpreted generator object %s at %#x>' % (self.__name__, id(self))
+
+    def send(self, value):
+        """
+        resume the generator, making the suspended yield evaluate to `value`
+        :param value:
+        :return: the next value yielded
+        """
+        if self.finished:
+            raise StopIteration
+        if not self.started and value is not None:
+            raise TypeError("can't send non-None value to a just-started generator")
+        if self.started:
+            self.gi_frame.push(value)
+        return self.resume()
+
+    def throw(self, exc_type, value=None, traceback=None):
+        """
+        raise an exception where the generator is suspended
+        :param exc_type: exception class or instance
+        :param value:
+        :param traceback:
+        :return: the next value yielded, if the generator handles the exception
+        """
+        if isinstance(exc_type, BaseException):
+            exception = exc_type
+        elif isinstance(value, exc_type):
+            exception = value
+        else:
+            exception = exc_type() if value is None else exc_type(value)
+        if traceback is not None:
+            exception = exception.with_traceback(traceback)
+
+        if not self.started or self.finished:
+            self.finish()
+            raise exception
+
+        delegate = self.delegate()
+        if delegate is not None:
+            if isinstance(exception, GeneratorExit):
+                close = getattr(delegate, 'close', None)
+                if close is not None:
+                    close()
+            else:
+                throw = getattr(delegate, 'throw', None)
+                if throw is not None:
+                    return self.throw_into_delegate(throw, exception)
+        return self.resume(exception)
+
+    def throw_into_delegate(self, throw, exception):
+        """
+        pass an exception on to the iterator of a `yield from`
+        :param throw: the iterator's throw method
+        :param exception:
+        """
+        self.gi_running = True
+        try:
+            return throw(exception)
+        except StopIteration as stop:
+            result, exception = stop.value, None
+        except BaseException as error:
+            result, exception = None, error
+        finally:
+            self.gi_running = False
+
+        # the delegation is over: drop the iterator and move past YIELD_FROM
+        frame = self.gi_frame
+        frame.pop()
+        frame.last_instruction += 1
+        if exception is None:
+            frame.push(result)
+        return self.resume(exception)
+
+    def close(self):
+        """
+        raise GeneratorExit where the generator is suspended
+        """
+        if not self.started or self.finished:
+            self.finish()
+            return
+        try:
+            self.throw(GeneratorExit)
+        except (GeneratorExit, StopIteration):
+            return
+        raise RuntimeError("generator ignored GeneratorExit")
+
+    def __del__(self):
+        # like a native generator, one dropped while suspended is closed,
+        # so its finally blocks and with exits still run
+        if self.started and not self.finished:
+            # the last reference can go in the middle of an unwind, when
+            # release_frame clears the frame holding it: closing must leave
+            # the exception, return value and frame of the VM as they were
+            vm = self.vm
+            state = vm.last_exception, vm.return_value, vm.why, vm.current_frame
+            try:
+                self.close()
+            finally:
+                vm.last_exception, vm.return_value, vm.why, vm.current_frame = state
+
+    def delegate(self):
+        """
+        the iterator a suspended `yield from` is waiting on, if any
+        """
+        frame = self.gi_frame
+        instructions = self.vm.instruction_cache[frame.code_obj]
+        if instructions[frame.last_instruction].name == 'YIELD_FROM':
+            return frame.stack[-1]
+        return None
+
+    def resume(self, exception=None):
+        """
+        run the frame until it yields, returns or raises
+        :param exception: raised in the frame before anything else runs
+        """
+        if self.gi_running:
+            raise ValueError("generator already executing")
+        self.started = True
+        self.gi_running = True
+        frame = self.gi_frame
+        frame.prev_frame = self.vm.current_frame
+        try:
+            value = self.vm.run_frame(frame, exception)
+        except StopIteration as stop:
+            self.finish()
+            raise RuntimeError("generator raised StopIteration") from stop
+        except BaseException:
+            self.finish()
+            raise
+        finally:
+            self.gi_running = False
+
+        if frame.suspended:
+            return value
+        self.finish()
+        raise StopIteration(value)
+
+    def finish(self):
+        """
+        mark the generator as exhausted and let its frame go
+        """
+        self.finished = True
+        if self.gi_frame is not None:
+            self.vm.release_frame(self.gi_frame)
+            self.gi_frame = None
+
+
+class Coroutine(Generator):
+    """
+    An interpreted coroutine, made by calling an `async def` function.
+    It has the send/throw/close/__await__ protocol of native coroutines,
+    so an asyncio event loop can run it as a task.
+    """
+    __iter__ = None
+
+    def __repr__(self):
+        return '<interpreted coroutine object %s at %#x>' % (self.__name__, id(self))
+
+    def __await__(self):
+        return self
+
+    @property
+    def cr_frame(self):
+        return self.gi_frame
+
+    @property
+    def cr_running(self):
+        return self.gi_running
+
+
+class AsyncGeneratorValue(object):
+    """
+    wraps what an async generator yields, to tell it apart from what the
+    coroutines it awaits yield to the event loop
+    """
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+
+class AsyncGenerator(Generator):
+    """
+    An interpreted async generator, made by calling an `async def` function
+    that yields. Its steps are awaitables made by asend, athrow and __anext__.
+    """
+    __iter__ = None
+    __next__ = None
+
+    def __repr__(self):
+        return '<interpreted async_generator object %s at %#x>' % (self.__name__, id(self))
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return AsyncGeneratorStep(self, None)
+
+    def asend(self, value):
+        """
+        awaitable that resumes the generator with `value`
+        :param value:
+        """
+        return AsyncGeneratorStep(self, value)
+
+    def athrow(self, exc_type, value=None, traceback=None):
+        """
+        awaitable that raises an exception where the generator is suspended
+        :param exc_type:
+        :param value:
+        :param traceback:
+        """
+        return AsyncGeneratorStep(self, None, (exc_type, value, traceback))
+
+    def aclose(self):
+        """
+        awaitable that raises GeneratorExit where the generator is suspended
+        """
+        return AsyncGeneratorStep(self, None, (GeneratorExit, None, None), closing=True)
+
+
+class AsyncGeneratorStep(object):
+    """
+    The awaitable of one step of an async generator. Values the generator
+    yields finish the step; anything else was yielded by an awaited
+    coroutine and is passed on to the event loop.
+    """
+
+    def __init__(self, generator, value, exception=None, closing=False):
+        self.generator = generator
+        self.value = value
+        self.exception = exception
+        self.closing = closing
+        self.started = False
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        """
+        run the generator on until it yields
+        :param value:
+        """
+        if not self.started:
+            self.started = True
+            if self.exception is not None:
+                return self.step(Generator.throw, *self.exception)
+            value = self.value
+        return self.step(Generator.send, value)
+
+    def throw(self, exc_type, value=None, traceback=None):
+        """
+        raise an exception in the generator while this step is awaited
+        """
+        self.started = True
+        return self.step(Generator.throw, exc_type, value, traceback)
+
+    def close(self):
+        pass
+
+    def step(self, method, *args):
+        """
+        call Generator.send or Generator.throw on the generator and sort out the result
+        :param method:
+        :param args:
+        """
+        generator = self.generator
+        try:
+            result = method(generator, *args)
+        except StopIteration:
+            if self.closing:
+                raise StopIteration(None)
+            raise StopAsyncIteration
+        except (GeneratorExit, StopAsyncIteration):
+            if self.closing:
+                raise StopIteration(None)
+            raise
+        if isinstance(result, AsyncGeneratorValue):
+            if self.closing:
+                raise RuntimeError("async generator ignored GeneratorExit")
+            raise StopIteration(result.value)
+        return result
+
+
+def awaitable_iterator(obj):
+    """
+    the iterator `await obj` runs, like CPython's _PyCoro_GetAwaitableIter
+    :param obj:
+    """
+    if isinstance(obj, (Coroutine, types.CoroutineType)):
+        return obj
+    if isinstance(obj, (Generator, types.GeneratorType)) and \
+            getattr(obj, 'gi_code', None) is not None and obj.gi_code.co_flags & inspect.CO_ITERABLE_COROUTINE:
+        return obj
+    await_method = getattr(type(obj), '__await__', None)
+    if await_method is None:
+        raise TypeError("object %s can't be used in 'await' expression" % type(obj).__name__)
+    return await_method(obj)
+
+
+def make_generator(frame, vm):
+    """
+    the generator, coroutine or async generator that runs `frame`
+    :param frame: frame of a code object with one of GENERATOR_FLAGS
+    :param vm:
+    """
+    flags = frame.code_obj.co_flags
+    if flags & inspect.CO_COROUTINE:
+        return Coroutine(frame, vm)
+    if flags & inspect.CO_ASYNC_GENERATOR:
+        return AsyncGenerator(frame, vm)
+    return Generator(frame, vm)
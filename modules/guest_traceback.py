@@ -0,0 +1,53 @@
+# coding=utf-8
+import traceback
+
+from modules.sampler import LineTable
+
+
+def extract(exception):
+    """
+    the guest frames `exception` was raised through, outermost first
+    :param exception:
+    :return: traceback.StackSummary
+    """
+    line_tables = {}
+    frames = []
+    for code, offset in reversed(getattr(exception, '__guest_traceback__', ())):
+        table = line_tables.get(code)
+        if table is None:
+            table = line_tables[code] = LineTable(code)
+        frames.append(traceback.FrameSummary(code.co_filename, table.line_of(offset), code.co_name))
+    return traceback.StackSummary.from_list(frames)
+
+
+# printed between chained exceptions
+CAUSE_MESSAGE = '\nThe above exception was the direct cause of the following exception:\n\n'
+CONTEXT_MESSAGE = '\nDuring handling of the above exception, another exception occurred:\n\n'
+
+
+def format_exception(exception, seen=None):
+    """
+    format an exception raised in guest code the way Python prints it, with
+    the guest traceback, after the exceptions it is chained to; exceptions
+    of the interpreter itself get their own
+    :param exception:
+    :param seen: ids of the exceptions of the chain already formatted
+    :return: list of lines
+    """
+    if not getattr(exception, '__guest_traceback__', None):
+        return traceback.format_exception(type(exception), exception, exception.__traceback__)
+    if seen is None:
+        seen = set()
+    seen.add(id(exception))
+    lines = []
+    cause, context = exception.__cause__, exception.__context__
+    if cause is not None and id(cause) not in seen:
+        lines.extend(format_exception(cause, seen))
+        lines.append(CAUSE_MESSAGE)
+    elif context is not None and not exception.__suppress_context__ and id(context) not in seen:
+        lines.extend(format_exception(context, seen))
+        lines.append(CONTEXT_MESSAGE)
+    lines.append('Traceback (most recent call last):\n')
+    lines.extend(extract(exception).format())
+    lines.extend(traceback.format_exception_only(type(exception), exception))
+    return lines
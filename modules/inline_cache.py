@@ -0,0 +1,220 @@
+# coding=utf-8
+import types
+
+from modules.function import Function
+
+# returned by lookups that found nothing
+MISSING = object()
+
+
+def inline_cache(cache_type):
+    """
+    Decorate an opcode handler that wants a cache of its own at every
+    instruction using it. The decoder creates a `cache_type()` per
+    instruction and passes it to the handler after the other arguments.
+    :param cache_type:
+    """
+
+    def decorate(handler):
+        handler.inline_cache = cache_type
+        return handler
+
+    return decorate
+
+
+class Namespace(dict):
+    """
+    A dict that counts its modifications, so caches of what it contained
+    can tell when they go stale. `version` changes on every modification,
+    `keys_version` only when keys may have been added or removed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Namespace, self).__init__(*args, **kwargs)
+        self.version = 0
+        self.keys_version = 0
+
+    def changed(self):
+        """
+        record a modification that may have added or removed keys
+        """
+        self.version += 1
+        self.keys_version += 1
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.keys_version += 1
+        self.version += 1
+        super(Namespace, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.changed()
+        super(Namespace, self).__delitem__(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, *args):
+        self.changed()
+        return super(Namespace, self).pop(*args)
+
+    def popitem(self):
+        self.changed()
+        return super(Namespace, self).popitem()
+
+    def setdefault(self, key, default=None):
+        self.changed()
+        return super(Namespace, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.changed()
+        super(Namespace, self).update(*args, **kwargs)
+
+    def clear(self):
+        self.changed()
+        super(Namespace, self).clear()
+
+
+class NameCache(object):
+    """
+    Remembers where a global name was found by one instruction.
+    A value found in the globals is reused while the global `Namespace` is
+    unchanged. A name found in the builtins stays absent from the globals
+    while their keys are unchanged, and then costs a single lookup.
+    Plain dict namespaces are looked up without caching.
+    """
+    __slots__ = ['namespace', 'version', 'in_builtins', 'value', 'hits', 'misses']
+
+    def __init__(self):
+        self.namespace = None
+        self.version = None
+        self.in_builtins = False
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, name, global_names, builtin_names):
+        """
+        look `name` up in `global_names`, then `builtin_names`
+        :param name:
+        :param global_names:
+        :param builtin_names:
+        :return: the value, or MISSING
+        """
+        if self.namespace is global_names:
+            if not self.in_builtins:
+                if self.version == global_names.version:
+                    self.hits += 1
+                    return self.value
+            elif self.version == global_names.keys_version:
+                value = builtin_names.get(name, MISSING)
+                if value is not MISSING:
+                    self.hits += 1
+                    return value
+
+        self.misses += 1
+        value = global_names.get(name, MISSING)
+        in_builtins = value is MISSING
+        if in_builtins:
+            value = builtin_names.get(name, MISSING)
+
+        if isinstance(global_names, Namespace) and value is not MISSING:
+            self.namespace = global_names
+            self.version = global_names.keys_version if in_builtins else global_names.version
+            self.in_builtins = in_builtins
+            self.value = None if in_builtins else value
+        else:
+            self.namespace = None
+        return value
+
+
+# Py_TPFLAGS_HEAPTYPE: set on classes created at runtime, which can be modified
+HEAPTYPE = 1 << 9
+
+
+class AttributeCache(object):
+    """
+    Remembers, for the last receiver type seen by one instruction, the
+    plain function an attribute name resolves to when getting it would
+    only bind that function to the receiver.
+    Builtin types cannot change, so their entries are checked by type alone.
+    For classes, the dicts along the MRO up to the class defining the
+    function are checked for shadowing names, and so is the instance dict.
+    A `__getattribute__` added to a class after its entry was made is not noticed.
+    """
+    __slots__ = ['type', 'method', 'owner_dict', 'earlier_dicts', 'instance_dict', 'hits', 'misses']
+
+    # descriptors whose binding can be replaced by passing the receiver as first argument
+    method_types = (
+        Function,
+        types.FunctionType,
+        type(str.join),  # types.MethodDescriptorType, which Python 3.6 lacks
+        type(object.__init__),  # types.WrapperDescriptorType
+    )
+
+    def __init__(self):
+        self.type = None
+        self.method = None
+        self.owner_dict = None
+        self.earlier_dicts = ()
+        self.instance_dict = False
+        self.hits = 0
+        self.misses = 0
+
+    def find_method(self, obj, name):
+        """
+        find the function that getting `name` from `obj` would bind to `obj`
+        :param obj:
+        :param name:
+        :return: the unbound function, or None when the attribute is not such a method
+        """
+        if type(obj) is self.type:
+            method = self.method
+            if method is None:
+                self.hits += 1
+                return None
+            owner_dict = self.owner_dict
+            if owner_dict is None or owner_dict.get(name) is method:
+                for namespace in self.earlier_dicts:
+                    if name in namespace:
+                        break
+                else:
+                    if not self.instance_dict or name not in obj.__dict__:
+                        self.hits += 1
+                        return method
+
+        self.misses += 1
+        self.fill(type(obj), name)
+        if self.instance_dict and name in obj.__dict__:
+            return None
+        return self.method
+
+    def fill(self, obj_type, name):
+        """
+        resolve `name` on `obj_type` the way attribute lookup would
+        :param obj_type:
+        :param name:
+        """
+        self.type = obj_type
+        self.method = None
+        self.owner_dict = None
+        self.earlier_dicts = ()
+        self.instance_dict = False
+        if obj_type.__getattribute__ is not object.__getattribute__:
+            return
+
+        mutable = obj_type.__flags__ & HEAPTYPE
+        earlier_dicts = []
+        for klass in obj_type.__mro__:
+            namespace = klass.__dict__
+            if name in namespace:
+                descr = namespace[name]
+                if isinstance(descr, self.method_types):
+                    self.method = descr
+                    self.instance_dict = obj_type.__dictoffset__ != 0
+                    if mutable:
+                        self.owner_dict = namespace
+                        self.earlier_dicts = tuple(earlier_dicts)
+                return
+            earlier_dicts.append(namespace)
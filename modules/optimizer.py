@@ -0,0 +1,121 @@
+# coding=utf-8
+from modules.decoder import HASJABS, HASJREL, Instruction
+
+JUMPS = HASJREL | HASJABS
+
+UNCONDITIONAL_JUMPS = frozenset(['JUMP_FORWARD', 'JUMP_ABSOLUTE'])
+
+# jumps that may be retargeted past an unconditional jump they land on
+THREADABLE_JUMPS = UNCONDITIONAL_JUMPS | frozenset([
+    'POP_JUMP_IF_TRUE',
+    'POP_JUMP_IF_FALSE',
+    'JUMP_IF_TRUE_OR_POP',
+    'JUMP_IF_FALSE_OR_POP',
+    'FOR_ITER',
+])
+
+# instructions after which execution never falls through to the next one
+NO_FALL_THROUGH = UNCONDITIONAL_JUMPS | frozenset([
+    'RETURN_VALUE',
+    'RAISE_VARARGS',
+    'BREAK_LOOP',
+    'CONTINUE_LOOP',
+])
+
+
+def is_jump(instruction):
+    """
+    whether the first argument of `instruction` is a jump target
+    :param instruction:
+    """
+    return instruction.opcode in JUMPS
+
+
+def thread_jumps(instructions):
+    """
+    Retarget jumps that land on an unconditional jump to where that jump goes.
+    :param instructions: list of instructions, modified in place
+    """
+    for index, instruction in enumerate(instructions):
+        if instruction.name not in THREADABLE_JUMPS:
+            continue
+        target = instruction.arguments[0]
+        seen = set()
+        while target < len(instructions) and target not in seen and \
+                instructions[target].name in UNCONDITIONAL_JUMPS:
+            seen.add(target)
+            target = instructions[target].arguments[0]
+        if target != instruction.arguments[0]:
+            instructions[index] = instruction._replace(arguments=(target,) + instruction.arguments[1:])
+
+
+def reachable(instructions):
+    """
+    indexes of the instructions that can run, following fall through and jump targets
+    :param instructions:
+    """
+    seen = set()
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        while index < len(instructions) and index not in seen:
+            seen.add(index)
+            instruction = instructions[index]
+            if is_jump(instruction):
+                pending.append(instruction.arguments[0])
+            if instruction.name in NO_FALL_THROUGH:
+                break
+            index += 1
+    return sorted(seen)
+
+
+def optimize(instructions, superinstructions):
+    """Optimize decoded instructions.
+    Jump chains are threaded, unreachable instructions dropped, and
+    adjacent pairs listed in `superinstructions` fused into one instruction
+    whose arguments are those of both parts.
+    :param instructions: decoded instructions of a code object
+    :param superinstructions: dict mapping pairs of opcode names to (name, handler) of the fused instruction
+    :return: tuple of instructions
+    """
+    instructions = list(instructions)
+    thread_jumps(instructions)
+    kept = reachable(instructions)
+    targets = set(instructions[index].arguments[0] for index in kept if is_jump(instructions[index]))
+
+    groups = []
+    position = 0
+    while position < len(kept):
+        index = kept[position]
+        if position + 1 < len(kept) and kept[position + 1] not in targets:
+            pair = (instructions[index].name, instructions[kept[position + 1]].name)
+            if pair in superinstructions:
+                groups.append((index, kept[position + 1]))
+                position += 2
+                continue
+        groups.append((index,))
+        position += 1
+
+    new_index = {}
+    for new, group in enumerate(groups):
+        for index in group:
+            new_index[index] = new
+    new_index[len(instructions)] = len(groups)
+
+    optimized = []
+    for group in groups:
+        parts = []
+        for index in group:
+            instruction = instructions[index]
+            if is_jump(instruction):
+                instruction = instruction._replace(
+                    arguments=(new_index[instruction.arguments[0]],) + instruction.arguments[1:]
+                )
+            parts.append(instruction)
+        if len(parts) == 1:
+            optimized.append(parts[0])
+        else:
+            name, handler = superinstructions[tuple(part.name for part in parts)]
+            arguments = tuple(argument for part in parts for argument in part.arguments)
+            optimized.append(Instruction(None, name, arguments, parts[0].offset, handler))
+    return tuple(optimized)
@@ -0,0 +1,214 @@
+# coding=utf-8
+import marshal
+import sys
+import time
+
+from modules.virtual_machine import VirtualMachine, run_budgeted
+
+
+def code_key(code):
+    """
+    the (filename, first line, name) key of a code object in pstats files
+    :param code:
+    """
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class FunctionStats(object):
+    """
+    Calls and host time of one guest code object. Self time leaves out the
+    time of the guest functions it called, cumulative time includes it but
+    counts recursive calls only once.
+    """
+    __slots__ = ['calls', 'primitive_calls', 'self_time', 'cumulative_time', 'callers']
+
+    def __init__(self):
+        self.calls = 0
+        self.primitive_calls = 0
+        self.self_time = 0.0
+        self.cumulative_time = 0.0
+        self.callers = {}  # [primitive calls, calls, self time, cumulative time] by calling code object
+
+    def as_pstats(self):
+        """
+        the (cc, nc, tt, ct, callers) tuple pstats expects
+        """
+        callers = dict((code_key(code), tuple(edge)) for code, edge in self.callers.items())
+        return self.primitive_calls, self.calls, self.self_time, self.cumulative_time, callers
+
+
+class Profiler(object):
+    """
+    Deterministic profile of guest code: count and total host time of
+    every opcode, and calls, self and cumulative time of every code object.
+    The time of an opcode leaves out that of the guest frames it runs.
+    Filled in by a ProfilingVirtualMachine.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.opcodes = {}  # [count, total time] by opcode name
+        self.functions = {}  # FunctionStats by code object
+        self.running = []  # [code, caller, start, time of callees, counted call] of every running frame
+        self.depth = {}  # number of running frames of each code object
+
+    def enter(self, frame, caller, call):
+        """
+        start timing a frame
+        :param frame:
+        :param caller: frame that runs `frame`, or None
+        :param call: whether this starts a call, rather than resuming a generator
+        """
+        code = frame.code_obj
+        stats = self.functions.get(code)
+        if stats is None:
+            stats = self.functions[code] = FunctionStats()
+        caller_code = caller.code_obj if caller is not None else None
+        if call:
+            stats.calls += 1
+            if not self.depth.get(code):
+                stats.primitive_calls += 1
+        self.depth[code] = self.depth.get(code, 0) + 1
+        self.running.append([code, caller_code, self.clock(), 0.0, call])
+
+    def leave(self):
+        """
+        stop timing the innermost running frame
+        """
+        code, caller_code, start, callee_time, call = self.running.pop()
+        elapsed = self.clock() - start
+        self.depth[code] -= 1
+        outermost = not self.depth[code]
+
+        stats = self.functions[code]
+        self_time = elapsed - callee_time
+        stats.self_time += self_time
+        if outermost:
+            stats.cumulative_time += elapsed
+        if self.running:
+            self.running[-1][3] += elapsed
+
+        if caller_code is not None:
+            edge = stats.callers.get(caller_code)
+            if edge is None:
+                edge = stats.callers[caller_code] = [0, 0, 0.0, 0.0]
+            if call:
+                edge[1] += 1
+                if outermost:
+                    edge[0] += 1
+            edge[2] += self_time
+            if outermost:
+                edge[3] += elapsed
+
+    def pstats(self):
+        """
+        the statistics in the format of pstats.Stats.stats
+        :return: dict mapping (filename, line, name) to (cc, nc, tt, ct, callers)
+        """
+        return dict((code_key(code), stats.as_pstats()) for code, stats in self.functions.items())
+
+    def dump_stats(self, filename):
+        """
+        write the function statistics to a file pstats.Stats can load
+        :param filename:
+        """
+        with open(filename, 'wb') as f:
+            marshal.dump(self.pstats(), f)
+
+    def print_stats(self, stream=None, limit=20):
+        """
+        print the opcode and function tables, most expensive first
+        :param stream: defaults to sys.stderr
+        :param limit: number of rows of each table
+        """
+        stream = stream or sys.stderr
+        opcodes = sorted(self.opcodes.items(), key=lambda item: item[1][1], reverse=True)
+        stream.write('%-32s %12s %12s %12s\n' % ('opcode', 'count', 'tottime', 'percall(us)'))
+        for name, (count, total) in opcodes[:limit]:
+            stream.write('%-32s %12d %12.6f %12.3f\n' % (name, count, total, total / count * 1e6))
+
+        stream.write('\n%-56s %10s %12s %12s\n' % ('function', 'ncalls', 'tottime', 'cumtime'))
+        functions = sorted(self.functions.items(), key=lambda item: item[1].cumulative_time, reverse=True)
+        for code, stats in functions[:limit]:
+            calls = str(stats.calls)
+            if stats.primitive_calls != stats.calls:
+                calls = '%d/%d' % (stats.calls, stats.primitive_calls)
+            stream.write('%-56s %10s %12.6f %12.6f\n' % (
+                '%s:%d(%s)' % code_key(code), calls, stats.self_time, stats.cumulative_time))
+
+
+class ProfilingVirtualMachine(VirtualMachine):
+    """
+    A VirtualMachine whose frames run in an instrumented copy of the
+    classic run_frame loop, recording into a Profiler, whatever the engine.
+    The plain VirtualMachine loop is left as it is, so code that is not
+    profiled pays nothing. A budget is counted down as run_frame_budgeted does.
+    """
+
+    def __init__(self, profiler=None, **kwargs):
+        """
+        :param profiler: Profiler to record into, a new one by default
+        """
+        super(ProfilingVirtualMachine, self).__init__(**kwargs)
+        self.profiler = profiler or Profiler()
+        self.instrumented += 1  # hot functions must stay where the profiler sees them
+
+    def run_frame(self, frame, exception=None):
+        """
+        run_frame, timing the frame and every instruction it runs
+        """
+        profiler = self.profiler
+        clock = profiler.clock
+        opcodes = profiler.opcodes
+        budget = self.budget
+        call = exception is None and frame.last_instruction == 0
+        profiler.enter(frame, self.current_frame, call)
+        try:
+            why = self.enter_frame(frame, exception)
+            instructions = self.instructions_of(frame.code_obj)
+            blocks = self.block_table(frame.code_obj)
+            callers = []  # instructions and blocks of the frames waiting for a call to return
+
+            while True:
+                running = profiler.running[-1]
+                while not why:
+                    index = frame.last_instruction
+                    instruction = instructions[index]
+                    frame.last_instruction = index + 1
+
+                    handler, arguments = instruction.handler, instruction.arguments
+                    if budget is not None:
+                        self.countdown -= 1
+                        if not self.countdown:
+                            handler, arguments = run_budgeted, (handler, arguments)
+
+                    # frames run by the instruction are timed by themselves
+                    start = clock()
+                    callee_time = running[3]
+                    why = self.dispatch(handler, arguments)
+                    elapsed = clock() - start - (running[3] - callee_time)
+                    counts = opcodes.get(instruction.name)
+                    if counts is None:
+                        counts = opcodes[instruction.name] = [0, 0.0]
+                    counts[0] += 1
+                    counts[1] += elapsed
+
+                    if why and why != 'yield' and why != 'call' and (blocks is not None or frame.block_stack):
+                        why = self.unwind(frame, why, index)
+
+                if why == 'call':
+                    callers.append((instructions, blocks))
+                    profiler.enter(self.current_frame, frame, True)
+                    frame = self.current_frame
+                    instructions = self.instructions_of(frame.code_obj)
+                    blocks = self.block_table(frame.code_obj)
+                    why = None
+                elif not callers:
+                    return self.leave_frame(frame, why)
+                else:
+                    profiler.leave()
+                    why = self.finish_call(frame, why)
+                    frame = self.current_frame
+                    instructions, blocks = callers.pop()
+        finally:
+            profiler.leave()
@@ -0,0 +1,350 @@
+# coding=utf-8
+import collections
+import operator
+
+from modules.decoder import Instruction
+from modules.threaded import step_of
+
+# runs of an adaptive site it watches operand types for, before the first
+# try at specializing it; every failed try doubles the number, and a site
+# that would have to wait more than MAX_WARMUP runs stays generic for good
+WARMUP = 8
+MAX_WARMUP = 1024
+
+# opcodes whose operation can be specialized, and the operation
+QUICKENABLE = {
+    'BINARY_ADD': 'ADD',
+    'BINARY_SUBTRACT': 'SUBTRACT',
+    'BINARY_MULTIPLY': 'MULTIPLY',
+    'BINARY_SUBSCR': 'SUBSCR',
+    'INPLACE_ADD': 'ADD',
+    'INPLACE_SUBTRACT': 'SUBTRACT',
+    'INPLACE_MULTIPLY': 'MULTIPLY',
+    'COMPARE_OP': None,  # named after its operator, see COMPARISONS
+}
+
+# the operations of the COMPARE_OP arguments that can be specialized
+COMPARISONS = ('<', '<=', '==', '!=', '>', '>=')
+
+# operand types each operation is specialized for: the type of both operands,
+# or for SUBSCR that of the container, indexed by an int. In-place
+# operations on these types make new values, so they are specialized the
+# same way, except for lists, which `+=` extends.
+KINDS = {
+    'ADD': (int, float, str, list),
+    'SUBTRACT': (int, float),
+    'MULTIPLY': (int, float),
+    'SUBSCR': (list, tuple, str),
+}
+for comparison in COMPARISONS:
+    KINDS[comparison] = (int, float, str)
+
+# per opcode name: sites, sites specialized now, sites left generic for good,
+# and the specializations and deoptimizations made so far
+QuickeningStats = collections.namedtuple(
+    "QuickeningStats", "sites, specialized, generic, specializations, deoptimizations"
+)
+
+
+def quickenable(handler):
+    """
+    Decorate the generic handler of an opcode in QUICKENABLE, letting
+    quicken replace it. A subclass overriding the handler without the
+    decorator keeps its own.
+    :param handler:
+    """
+    handler.quickenable = True
+    return handler
+
+
+class Site(object):
+    """
+    A quickened instruction. It starts adaptive, running the generic
+    operation while it watches the types of the operands. Once they were
+    of one kind it has a specialized handler for, it rewrites its
+    instruction, and its step of the threaded engine, to run that handler.
+    The specialized handler checks the type it was made for, and
+    deoptimizes the site back to adaptive when it changes.
+    """
+    __slots__ = ['vm', 'operation', 'fn', 'kinds', 'index', 'generic', 'adaptive', 'instructions', 'steps',
+                 'adaptive_step', 'kind', 'observed', 'counter', 'warmup', 'specializations', 'deoptimizations']
+
+    def __init__(self, vm, operation, fn, kinds, instructions, index):
+        """
+        :param vm:
+        :param operation: key of the operation in KINDS
+        :param fn: the generic operation, a function of both operands
+        :param kinds: operand types it may be specialized for
+        :param instructions: list of instructions the site rewrites
+        :param index: index of its instruction
+        """
+        self.vm = vm
+        self.operation = operation
+        self.fn = fn
+        self.kinds = kinds
+        self.index = index
+        self.generic = instruction = instructions[index]
+        self.adaptive = Instruction(instruction.opcode, instruction.name, (self,), instruction.offset,
+                                    adaptive_handler)
+        self.instructions = instructions
+        self.steps = None  # the steps of the threaded engine, once made
+        self.adaptive_step = None
+        self.kind = None  # the operand type specialized for
+        self.observed = None
+        self.warmup = self.counter = vm.quicken_warmup
+        self.specializations = 0
+        self.deoptimizations = 0
+        instructions[index] = self.adaptive
+
+    def kind_of(self, x, y):
+        """
+        the operand type of `x` and `y` the site could be specialized for, or None
+        """
+        kind = type(x)
+        if kind is type(y) or (self.operation == 'SUBSCR' and type(y) is int):
+            if kind in self.kinds:
+                return kind
+        return None
+
+    def observe(self, x, y):
+        """
+        watch the operands of one run of the adaptive site, specializing it
+        at the end of the warmup when they were all of the same kind
+        """
+        kind = self.kind_of(x, y)
+        if self.counter == self.warmup:
+            self.observed = kind
+        elif kind is not self.observed:
+            self.observed = None
+        self.counter -= 1
+        if self.counter:
+            return
+        if self.observed is None:
+            self.back_off()
+        else:
+            self.specialize(self.observed)
+
+    def specialize(self, kind):
+        """
+        run the specialized step of `kind` from now on
+        :param kind:
+        """
+        self.kind = kind
+        self.specializations += 1
+        handler = SPECIALIZED[self.operation, kind]
+        step = None
+        if self.steps is not None:
+            step = handler.make_step(self.vm, self.index + 1, self)
+        self.rewrite(self.adaptive._replace(handler=handler), step)
+
+    def deoptimize(self, x, y):
+        """
+        the operands of the specialized step are not of its kind: go back to
+        adaptive, or generic
+        :return: the result of the generic operation on them
+        """
+        self.kind = None
+        self.deoptimizations += 1
+        self.back_off()
+        return self.fn(x, y)
+
+    def back_off(self):
+        """
+        watch operands for twice as long before trying again, or give up
+        """
+        self.warmup *= 2
+        if self.warmup > MAX_WARMUP:
+            step = None
+            if self.steps is not None:
+                step = step_of(self.vm, self.generic, self.index + 1)
+            self.rewrite(self.generic, step)
+        else:
+            self.counter = self.warmup
+            self.rewrite(self.adaptive, self.adaptive_step)
+
+    def rewrite(self, instruction, step):
+        """
+        replace the instruction of the site, and its step when the threaded engine runs it
+        """
+        self.instructions[self.index] = instruction
+        if self.steps is not None:
+            self.steps[self.index] = step
+
+
+def quicken(vm, instructions):
+    """
+    make the quickenable instructions of a code object adaptive
+    :param vm:
+    :param instructions: decoded instructions, left as they are
+    :return: list of instructions, with a Site at each quickenable one, and the list of sites
+    """
+    quickened = list(instructions)
+    made = []
+    for index, instruction in enumerate(instructions):
+        if instruction.name not in QUICKENABLE or not getattr(instruction.handler, 'quickenable', False):
+            continue
+        operation = QUICKENABLE[instruction.name]
+        kinds = None
+        if operation is None:
+            opnum, = instruction.arguments
+            if opnum >= len(COMPARISONS):
+                continue
+            operation = COMPARISONS[opnum]
+            fn = vm.COMPARE_OPERATORS[opnum]
+        elif instruction.name.startswith('INPLACE_'):
+            fn = vm.INPLACE_OPERATORS[operation]
+            kinds = tuple(kind for kind in KINDS[operation] if kind is not list)
+        else:
+            fn = vm.BINARY_OPERATORS[operation]
+        made.append(Site(vm, operation, fn, kinds or KINDS[operation], quickened, index))
+    return quickened, made
+
+
+def thread_sites(sites, steps):
+    """
+    let sites rewrite the steps of the threaded engine made from their instructions too
+    :param sites:
+    :param steps: list of steps
+    """
+    for site in sites:
+        site.steps = steps
+        site.adaptive_step = adaptive_step(site.vm, site.index + 1, site)
+
+
+def stats(site_lists):
+    """
+    sum up sites by the name of their opcode
+    :param site_lists: lists of sites
+    :return: dict mapping opcode names to QuickeningStats
+    """
+    totals = {}
+    for sites in site_lists:
+        for site in sites:
+            total = totals.setdefault(site.generic.name, [0, 0, 0, 0, 0])
+            total[0] += 1
+            total[1] += site.kind is not None
+            total[2] += site.warmup > MAX_WARMUP
+            total[3] += site.specializations
+            total[4] += site.deoptimizations
+    return {name: QuickeningStats(*total) for name, total in totals.items()}
+
+
+# The adaptive instruction, whose only argument is its site
+
+def adaptive_handler(vm, site):
+    """
+    run the generic operation, watching its operands
+    """
+    stack = vm.current_frame.stack
+    y = stack.pop()
+    x = stack[-1]
+    stack[-1] = site.fn(x, y)
+    site.observe(x, y)
+
+
+def adaptive_step(vm, next_index, site):
+    def step(frame):
+        stack = frame.stack
+        y = stack.pop()
+        x = stack[-1]
+        stack[-1] = site.fn(x, y)
+        site.observe(x, y)
+        return next_index
+
+    return step
+
+
+adaptive_handler.make_step = adaptive_step
+
+
+# Specialized instructions, made by `specialize(kind)` for an operand type.
+# Their only argument is also their site, which they deoptimize when the
+# operands are not of that type. `__class__` is checked instead of calling
+# type(): it is cheaper, and a proxy lying about its class still gets the
+# right result, as the operator is applied the way the generic one would.
+
+def binary_specialization(fn):
+    """
+    the function making the specialized handler of a binary operation for
+    an operand type of both operands, with the `make_step` of the handler
+    :param fn: the operation, a function of both operands
+    """
+
+    def specialized(kind):
+        def handler(vm, site):
+            stack = vm.current_frame.stack
+            y = stack.pop()
+            x = stack[-1]
+            if x.__class__ is kind is y.__class__:
+                stack[-1] = fn(x, y)
+            else:
+                stack[-1] = site.deoptimize(x, y)
+
+        def make_step(vm, next_index, site):
+            def step(frame):
+                stack = frame.stack
+                y = stack.pop()
+                x = stack[-1]
+                if x.__class__ is kind is y.__class__:
+                    stack[-1] = fn(x, y)
+                else:
+                    stack[-1] = site.deoptimize(x, y)
+                return next_index
+
+            return step
+
+        handler.make_step = make_step
+        return handler
+
+    return specialized
+
+
+def subscr_specialization(kind):
+    """
+    the specialized handler of BINARY_SUBSCR for a container type, indexed by an int
+    """
+
+    def handler(vm, site):
+        stack = vm.current_frame.stack
+        y = stack.pop()
+        x = stack[-1]
+        if x.__class__ is kind and y.__class__ is int:
+            stack[-1] = x[y]
+        else:
+            stack[-1] = site.deoptimize(x, y)
+
+    def make_step(vm, next_index, site):
+        def step(frame):
+            stack = frame.stack
+            y = stack.pop()
+            x = stack[-1]
+            if x.__class__ is kind and y.__class__ is int:
+                stack[-1] = x[y]
+            else:
+                stack[-1] = site.deoptimize(x, y)
+            return next_index
+
+        return step
+
+    handler.make_step = make_step
+    return handler
+
+
+SPECIALIZE = {
+    'ADD': binary_specialization(operator.add),
+    'SUBTRACT': binary_specialization(operator.sub),
+    'MULTIPLY': binary_specialization(operator.mul),
+    'SUBSCR': subscr_specialization,
+    '<': binary_specialization(operator.lt),
+    '<=': binary_specialization(operator.le),
+    '==': binary_specialization(operator.eq),
+    '!=': binary_specialization(operator.ne),
+    '>': binary_specialization(operator.gt),
+    '>=': binary_specialization(operator.ge),
+}
+
+# the specialized handler of each operation and operand type
+SPECIALIZED = {}
+for operation, kinds in KINDS.items():
+    for kind in kinds:
+        SPECIALIZED[operation, kind] = SPECIALIZE[operation](kind)
@@ -0,0 +1,125 @@
+# coding=utf-8
+import bisect
+import collections
+import dis
+import threading
+
+
+class LineTable(object):
+    """
+    maps bytecode offsets of a code object to source lines
+    """
+    __slots__ = ['offsets', 'lines']
+
+    def __init__(self, code):
+        starts = list(dis.findlinestarts(code))
+        self.offsets = [offset for offset, _ in starts]
+        self.lines = [line for _, line in starts]
+
+    def line_of(self, offset):
+        """
+        the source line of the instruction at `offset`
+        :param offset:
+        """
+        index = bisect.bisect_right(self.offsets, offset) - 1
+        return self.lines[index] if index >= 0 else None
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profile of guest code: a background thread snapshots the
+    guest call stack of a VirtualMachine every `interval` seconds, and counts
+    how often each stack of (function, line) pairs was seen.
+    The interpreter itself runs unchanged; threads only switch every
+    sys.getswitchinterval() seconds, so shorter intervals gain nothing.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()  # samples of each stack of (filename, name, line), outermost first
+        self.line_tables = {}  # LineTable by code object
+        self.thread = None
+        self.vm = None
+        self.stopping = threading.Event()
+
+    def start(self, vm):
+        """
+        start sampling the frames of `vm`
+        :param vm:
+        """
+        self.stopping.clear()
+        self.vm = vm
+        vm.instrumented += 1
+        self.thread = threading.Thread(target=self.run, args=(vm,), name='chenab-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        stop sampling, waiting for the sampling thread to finish
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.vm is not None:
+            self.vm.instrumented -= 1
+            self.vm = None
+
+    def run(self, vm):
+        """
+        body of the sampling thread
+        :param vm:
+        """
+        while not self.stopping.wait(self.interval):
+            self.sample(vm)
+
+    def sample(self, vm):
+        """
+        record the current guest call stack of `vm`
+        :param vm:
+        """
+        stack = []
+        for frame in list(vm.frames):
+            code = frame.code_obj
+            if code is None:
+                continue
+            stack.append((code.co_filename, code.co_name, self.line_of(vm, frame, code)))
+        if stack:
+            self.stacks[tuple(stack)] += 1
+
+    def line_of(self, vm, frame, code):
+        """
+        the line `frame` is running, from the instruction before `last_instruction`
+        :param vm:
+        :param frame:
+        :param code:
+        """
+        table = self.line_tables.get(code)
+        if table is None:
+            table = self.line_tables[code] = LineTable(code)
+        instructions = vm.instruction_cache.decoded.get(code)
+        if not instructions:
+            return None
+        index = min(max(frame.last_instruction - 1, 0), len(instructions) - 1)
+        return table.line_of(instructions[index].offset)
+
+    def collapsed_stacks(self):
+        """
+        the samples as "collapsed stack" lines, as read by flamegraph.pl and speedscope:
+        frames outermost first separated by ';', then the number of samples
+        :return: list of lines
+        """
+        lines = []
+        for stack, count in sorted(self.stacks.items()):
+            frames = ';'.join('%s (%s:%s)' % (name, filename, line) for filename, name, line in stack)
+            lines.append('%s %d' % (frames, count))
+        return lines
+
+    def dump_stacks(self, filename):
+        """
+        write the collapsed stacks to a file
+        :param filename:
+        """
+        with open(filename, 'w') as f:
+            for line in self.collapsed_stacks():
+                f.write(line + '\n')
@@ -0,0 +1,234 @@
+# coding=utf-8
+import collections
+import imp
+import sys
+import threading
+import time
+
+from modules.__main__ import read_source
+from modules.batch import TIMEOUT_STATUS
+from modules.guest_traceback import format_exception
+from modules.inline_cache import Namespace
+from modules.virtual_machine import VirtualMachine
+
+POLICIES = ('round-robin', 'weighted-fair')
+
+# instructions a program runs before the next one gets its turn, by default
+QUOTA = 10000
+
+
+class InstructionLimitExceeded(BaseException):
+    """
+    raised in a guest program that used up its hard limit of instructions;
+    like KeyboardInterrupt, `except Exception` in the guest does not stop it
+    """
+
+
+class Program(object):
+    """
+    A guest program run by a Scheduler, on a VirtualMachine of its own.
+    Native code calling back into guest functions nests run loops in the
+    host stack, so a program keeps a host thread to be suspended in, but
+    only runs while the scheduler waits for it: when its slice of
+    instructions is used up it hands control back, and it is resumed once
+    the scheduler picks it again.
+    """
+
+    def __init__(self, scheduler, filename, code, weight, quota, limit, stdout, vm_options):
+        """
+        :param scheduler:
+        :param filename:
+        :param code: compiled module code
+        :param weight: share of the instructions run under the weighted-fair policy
+        :param quota: instructions of each slice
+        :param limit: instructions after which the program is stopped, or None
+        :param stdout: file the program prints to, sys.stdout by default
+        :param vm_options: keyword arguments of its VirtualMachine
+        """
+        self.scheduler = scheduler
+        self.filename = filename
+        self.code = code
+        self.weight = weight
+        self.quota = quota
+        self.limit = limit
+        self.stdout = stdout
+        self.vm = VirtualMachine(budget=quota, preempt=self.preempted, **vm_options)
+
+        module = imp.new_module('__main__')
+        module.__builtins__ = sys.modules['builtins']
+        self.global_names = Namespace(module.__dict__)
+        self.global_names['__file__'] = filename
+
+        self.resume = threading.Semaphore(0)
+        self.thread = None
+        self.granted = 0  # instructions of the current slice
+        self.finished = False
+        self.limited = False
+        self.exit_status = 0
+        self.error = None
+        self.instructions = 0
+        self.slices = 0
+        self.run_time = 0.0
+        self.ready_since = time.perf_counter()
+        self.max_wait = 0.0  # longest time the program was ready without running
+
+    def main(self):
+        """
+        the host thread of the program
+        """
+        self.resume.acquire()
+        try:
+            self.vm.run_code(self.code, global_names=self.global_names)
+        except SystemExit as exit:
+            if exit.code is None or isinstance(exit.code, int):
+                self.exit_status = exit.code or 0
+            else:
+                self.exit_status = 1
+                self.error = str(exit.code)
+        except InstructionLimitExceeded as error:
+            self.exit_status = TIMEOUT_STATUS
+            self.error = str(error)
+        except BaseException as error:
+            self.exit_status = 1
+            self.error = ''.join(format_exception(error))
+        finally:
+            if not self.limited:
+                self.instructions += self.granted - self.vm.countdown
+            self.finished = True
+            self.scheduler.switched.release()
+
+    def preempted(self, vm):
+        """
+        the `preempt` of the virtual machine: hand control back to the scheduler
+        :param vm:
+        """
+        if not self.limited:
+            self.instructions += self.granted
+            if self.limit is None or self.instructions < self.limit:
+                self.scheduler.switched.release()
+                self.resume.acquire()
+                return
+            self.limited = True
+        # raised again at every instruction, until the program gives up
+        vm.countdown = 1
+        raise InstructionLimitExceeded("stopped after %d instructions" % self.instructions)
+
+    def report(self):
+        """
+        what became of the program, as in the report of batch.run_many
+        """
+        result = {
+            'file': self.filename,
+            'exit_status': self.exit_status,
+            'error': self.error,
+            'limited': self.limited,
+            'instructions': self.instructions,
+            'slices': self.slices,
+            'seconds': self.run_time,
+            'max_wait': self.max_wait,
+        }
+        if hasattr(self.stdout, 'getvalue'):
+            result['stdout'] = self.stdout.getvalue()
+        return result
+
+
+class Scheduler(object):
+    """
+    Time-slices many guest programs in one process, so none of them can
+    hold up the others for longer than a slice. A program runs `quota`
+    instructions at a time, then the policy picks the next one:
+    'round-robin' takes turns, 'weighted-fair' picks the program that ran
+    the fewest instructions for its weight. A program that reaches its
+    `limit` of instructions is stopped with InstructionLimitExceeded.
+    Only one program runs at any time.
+    """
+
+    def __init__(self, policy='round-robin', quota=QUOTA, limit=None, **vm_options):
+        """
+        :param policy: one of POLICIES
+        :param quota: default instructions of a slice
+        :param limit: default hard limit of instructions of a program, None for no limit
+        :param vm_options: keyword arguments of the VirtualMachine of each program
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown policy: %r" % (policy,))
+        self.policy = policy
+        self.quota = quota
+        self.limit = limit
+        self.vm_options = vm_options
+        self.programs = []
+        self.ready = collections.deque()
+        self.switched = threading.Semaphore(0)  # released when a program stops running
+
+    def submit(self, filename, source=None, weight=1, quota=None, limit=None, stdout=None):
+        """
+        add a python file to run
+        :param filename:
+        :param source: run instead of the contents of the file, when given
+        :param weight: share of the instructions run under the weighted-fair policy
+        :param quota: instructions of each slice, the scheduler's by default
+        :param limit: hard limit of instructions, the scheduler's by default
+        :param stdout: file the program prints to, sys.stdout by default
+        :return: the Program
+        """
+        if source is None:
+            source = read_source(filename)
+        code = compile(source, filename, "exec")
+        program = Program(self, filename, code, weight, quota or self.quota,
+                          self.limit if limit is None else limit, stdout, self.vm_options)
+        self.programs.append(program)
+        self.ready.append(program)
+        return program
+
+    def pick(self):
+        """
+        take the next program to run off the ready ones, or None when all finished
+        """
+        if not self.ready:
+            return None
+        if self.policy == 'round-robin':
+            return self.ready.popleft()
+        program = min(self.ready, key=lambda ready: ready.instructions / ready.weight)
+        self.ready.remove(program)
+        return program
+
+    def run_slice(self, program):
+        """
+        let `program` run until it used up its slice, or finished
+        :param program:
+        """
+        start = time.perf_counter()
+        program.max_wait = max(program.max_wait, start - program.ready_since)
+        program.granted = program.quota
+        if program.limit is not None:
+            program.granted = min(program.granted, program.limit - program.instructions)
+        program.vm.countdown = program.granted
+        program.slices += 1
+
+        stdout = sys.stdout
+        if program.stdout is not None:
+            sys.stdout = program.stdout
+        try:
+            if program.thread is None:
+                program.thread = threading.Thread(target=program.main, name=program.filename, daemon=True)
+                program.thread.start()
+            program.resume.release()
+            self.switched.acquire()
+        finally:
+            sys.stdout = stdout
+
+        program.ready_since = time.perf_counter()
+        program.run_time += program.ready_since - start
+        if not program.finished:
+            self.ready.append(program)
+
+    def run(self):
+        """
+        run the submitted programs until all of them finished
+        :return: list of their reports, in the order they were submitted
+        """
+        program = self.pick()
+        while program is not None:
+            self.run_slice(program)
+            program = self.pick()
+        return [program.report() for program in self.programs]
@@ -0,0 +1,213 @@
+# coding=utf-8
+import contextlib
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+
+from modules.__main__ import run_python_file
+from modules.code_cache import CodeCache
+from modules.guest_traceback import format_exception
+from modules.virtual_machine import VirtualMachine
+
+# Requests and replies are JSON objects, one per line.
+# A request is {"file": path, "argv": [...], "cwd": dir} or {"source": text, "filename": name, ...};
+# the server replies with {"stream": "stdout" or "stderr", "data": text} while the file runs,
+# then {"exit_status": n}.
+
+
+class StreamWriter(io.TextIOBase):
+    """
+    a text stream that sends what is written to it to the client
+    """
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            send(self.connection, {'stream': self.name, 'data': text})
+        return len(text)
+
+
+def send(connection, message):
+    """
+    write one message to a connection file
+    :param connection:
+    :param message:
+    """
+    connection.write(json.dumps(message).encode('utf-8') + b'\n')
+    connection.flush()
+
+
+def receive(connection):
+    """
+    read one message from a connection file, or None at the end of it
+    :param connection:
+    """
+    line = connection.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+class Worker(object):
+    """
+    A server process running one request at a time, on a VirtualMachine
+    and code cache it keeps warm between requests.
+    """
+
+    def __init__(self, optimize=False, cache_dir=None, cache_size=64 * 1024 * 1024):
+        self.vm = VirtualMachine(optimize=optimize)
+        self.code_cache = CodeCache(cache_dir, cache_size) if cache_dir else None
+
+    def serve(self, listener):
+        """
+        accept and handle connections on `listener` forever
+        :param listener: listening socket shared with the other workers
+        """
+        while True:
+            connection, _ = listener.accept()
+            with connection, connection.makefile('rwb') as stream:
+                try:
+                    request = receive(stream)
+                    if request is not None:
+                        send(stream, {'exit_status': self.handle(request, stream)})
+                except (OSError, ValueError):
+                    pass  # the client went away or spoke nonsense
+
+    def handle(self, request, stream):
+        """
+        run the file or source of a request, streaming its output to the client
+        :param request:
+        :param stream:
+        :return: exit status
+        """
+        vm = self.vm
+        vm.frames.clear()
+        vm.current_frame = None
+        stdout = StreamWriter(stream, 'stdout')
+        stderr = StreamWriter(stream, 'stderr')
+        old_argv, old_cwd = sys.argv, os.getcwd()
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    if request.get('cwd'):
+                        os.chdir(request['cwd'])
+                    filename = request.get('file') or request.get('filename', '<string>')
+                    sys.argv = [filename] + list(request.get('argv', []))
+                    run_python_file(filename, code_cache=self.code_cache, vm=vm, source=request.get('source'))
+                except SystemExit as exit:
+                    if exit.code is None or isinstance(exit.code, int):
+                        return exit.code or 0
+                    stderr.write('%s\n' % exit.code)
+                    return 1
+                except BaseException as error:
+                    # KeyboardInterrupt and the like raised by the guest end its run, not the worker
+                    stderr.write(''.join(format_exception(error)))
+                    return 1
+        finally:
+            sys.argv = old_argv
+            os.chdir(old_cwd)
+        return 0
+
+
+def run_worker(listener, optimize, cache_dir, cache_size):
+    """
+    body of a worker process
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGTERM])
+    Worker(optimize, cache_dir, cache_size).serve(listener)
+
+
+def stop_serving(signum, frame):
+    # once is enough: let the workers be stopped without another interruption
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(0)
+
+
+def serve(socket_path, workers=None, optimize=False, cache_dir=None, cache_size=64 * 1024 * 1024):
+    """
+    Serve run requests on a Unix socket with a pool of preloaded worker
+    processes, replacing any worker that dies, until interrupted.
+    Whoever connects runs code as the server's user, so the socket is
+    created with no permissions for group and others.
+    :param socket_path:
+    :param workers: number of worker processes, one per core by default
+    :param optimize:
+    :param cache_dir: directory of a CodeCache shared by the workers
+    :param cache_size:
+    """
+    # terminating the server stops its workers too
+    signal.signal(signal.SIGTERM, stop_serving)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # created with the right mode, not changed after it was already reachable
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(128)
+
+    def start():
+        # workers start with SIGTERM blocked, until they no longer have the server's handler
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGTERM])
+        try:
+            process = multiprocessing.Process(target=run_worker, args=(listener, optimize, cache_dir, cache_size))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGTERM])
+
+    processes = []
+    try:
+        for _ in range(workers or os.cpu_count() or 1):
+            start()
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+            for process in [process for process in processes if not process.is_alive()]:
+                processes.remove(process)
+                start()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        listener.close()
+        os.remove(socket_path)
+
+
+def run_client(socket_path, filename, argv=(), stdout=None, stderr=None):
+    """
+    have the server at `socket_path` run a file, copying its output here
+    :param socket_path:
+    :param filename:
+    :param argv: arguments of the file
+    :param stdout: defaults to sys.stdout
+    :param stderr: defaults to sys.stderr
+    :return: exit status of the file
+    """
+    streams = {'stdout': stdout or sys.stdout, 'stderr': stderr or sys.stderr}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    with client, client.makefile('rwb') as stream:
+        send(stream, {'file': os.path.abspath(filename), 'argv': list(argv), 'cwd': os.getcwd()})
+        while True:
+            message = receive(stream)
+            if message is None:
+                raise ConnectionError('the server closed the connection')
+            if 'exit_status' in message:
+                return message['exit_status']
+            streams[message['stream']].write(message['data'])
@@ -0,0 +1,403 @@
+# coding=utf-8
+import functools
+import sys
+import types
+
+from modules.frame import UNBOUND
+from modules.function import Function
+from modules.inline_cache import MISSING
+
+# returned by a step instead of the index of the next instruction when the
+# frame has to stop running instructions; the virtual machine's `why` says
+# why, and the frame's `last_instruction` is the index after the step's
+STOP = -1
+
+
+def threaded_step(make_step):
+    """
+    Decorate an opcode handler that has a specialized step for the threaded
+    engine. `make_step(vm, next_index, *arguments)` returns the step of one
+    instruction: a function of the frame returning the index of the
+    instruction to run next. A subclass overriding the handler without the
+    decorator gets the generic step, which calls its handler.
+    :param make_step:
+    """
+
+    def decorate(handler):
+        handler.make_step = make_step
+        return handler
+
+    return decorate
+
+
+def generic_step(vm, handler, arguments, next_index):
+    """
+    step calling an opcode handler the way the classic loop does
+    :param vm:
+    :param handler:
+    :param arguments: decoded arguments, bound once here
+    :param next_index:
+    """
+    call = functools.partial(handler, vm, *arguments)
+
+    def step(frame):
+        frame.last_instruction = next_index
+        why = call()
+        if why:
+            vm.why = why
+            return STOP
+        return frame.last_instruction
+
+    return step
+
+
+def step_of(vm, instruction, next_index):
+    """
+    make the step of one instruction
+    :param vm:
+    :param instruction:
+    :param next_index: index of the instruction after it
+    """
+    make_step = getattr(instruction.handler, 'make_step', None)
+    if make_step is None:
+        return generic_step(vm, instruction.handler, instruction.arguments, next_index)
+    return make_step(vm, next_index, *instruction.arguments)
+
+
+def thread(vm, instructions):
+    """
+    turn decoded instructions into the steps run by the threaded engine
+    :param vm:
+    :param instructions:
+    :return: list of steps, indexed like `instructions`
+    """
+    return [step_of(vm, instruction, index + 1) for index, instruction in enumerate(instructions)]
+
+
+def unbound_local(frame, index):
+    """
+    the error of reading the fast local `index` of `frame` before it was assigned
+    """
+    return UnboundLocalError(
+        "local variable '%s' referenced before assignment" % frame.code_obj.co_varnames[index]
+    )
+
+
+def unbound_cell(frame, index):
+    """
+    the error of reading the cell `index` of `frame` before it was assigned
+    """
+    code = frame.code_obj
+    cellvars = code.co_cellvars
+    if index < len(cellvars):
+        return UnboundLocalError("local variable '%s' referenced before assignment" % cellvars[index])
+    return NameError("free variable '%s' referenced before assignment in enclosing scope"
+                     % code.co_freevars[index - len(cellvars)])
+
+
+# Specialized steps
+
+def load_const_step(vm, next_index, const):
+    def step(frame):
+        frame.stack.append(const)
+        return next_index
+
+    return step
+
+
+def load_fast_step(vm, next_index, index):
+    def step(frame):
+        value = frame.fast_locals[index]
+        if value is UNBOUND:
+            raise unbound_local(frame, index)
+        frame.stack.append(value)
+        return next_index
+
+    return step
+
+
+def store_fast_step(vm, next_index, index):
+    def step(frame):
+        frame.fast_locals[index] = frame.stack.pop()
+        return next_index
+
+    return step
+
+
+def load_deref_step(vm, next_index, index):
+    def step(frame):
+        value = frame.cells[index].cell_contents
+        if value is UNBOUND:
+            raise unbound_cell(frame, index)
+        frame.stack.append(value)
+        return next_index
+
+    return step
+
+
+def store_deref_step(vm, next_index, index):
+    def step(frame):
+        frame.cells[index].cell_contents = frame.stack.pop()
+        return next_index
+
+    return step
+
+
+def pop_top_step(vm, next_index):
+    def step(frame):
+        frame.stack.pop()
+        return next_index
+
+    return step
+
+
+def load_global_step(vm, next_index, name, cache):
+    load = cache.load
+
+    def step(frame):
+        value = load(name, frame.global_names, frame.builtin_names)
+        if value is MISSING:
+            raise NameError("global name '%s' is not defined" % name)
+        frame.stack.append(value)
+        return next_index
+
+    return step
+
+
+def unary_step(fn):
+    """
+    make the step factory of a unary operator
+    :param fn:
+    """
+
+    def make_step(vm, next_index):
+        def step(frame):
+            stack = frame.stack
+            stack[-1] = fn(stack[-1])
+            return next_index
+
+        return step
+
+    return make_step
+
+
+def binary_step(fn):
+    """
+    make the step factory of a binary or in-place operator
+    :param fn:
+    """
+
+    def make_step(vm, next_index):
+        def step(frame):
+            stack = frame.stack
+            y = stack.pop()
+            stack[-1] = fn(stack[-1], y)
+            return next_index
+
+        return step
+
+    return make_step
+
+
+def compare_op_step(vm, next_index, opnum):
+    compare = vm.COMPARE_OPERATORS[opnum]
+
+    def step(frame):
+        stack = frame.stack
+        y = stack.pop()
+        stack[-1] = compare(stack[-1], y)
+        return next_index
+
+    return step
+
+
+def jump_step(vm, next_index, jump):
+    def step(frame):
+        return jump
+
+    return step
+
+
+def pop_jump_if_true_step(vm, next_index, jump):
+    def step(frame):
+        if frame.stack.pop():
+            return jump
+        return next_index
+
+    return step
+
+
+def pop_jump_if_false_step(vm, next_index, jump):
+    def step(frame):
+        if frame.stack.pop():
+            return next_index
+        return jump
+
+    return step
+
+
+def for_iter_step(vm, next_index, jump):
+    def step(frame):
+        stack = frame.stack
+        try:
+            stack.append(next(stack[-1]))
+        except StopIteration:
+            stack.pop()
+            return jump
+        return next_index
+
+    return step
+
+
+def setup_step(vm, next_index, handler):
+    index = next_index - 1
+
+    def step(frame):
+        frame.block_heights[index] = len(frame.stack)
+        return next_index
+
+    return step
+
+
+def pop_block_step(vm, next_index):
+    def step(frame):
+        return next_index
+
+    return step
+
+
+def call_function_step(vm, next_index, count):
+    call_function = vm.call_function
+
+    def step(frame):
+        stack = frame.stack
+        func = stack[-count - 1]
+        args = stack[-count:] if count else []
+        del stack[-count - 1:]
+        frame.last_instruction = next_index
+        if func.__class__ is Function or func.__class__ is types.MethodType:
+            if call_function(func, args, None):
+                vm.why = 'call'
+                return STOP
+            return next_index
+        if not count and (func is locals or func is super or func is sys.exc_info):
+            stack.append(vm.call_frame_builtin(func, frame))
+            return next_index
+        stack.append(func(*args))
+        return next_index
+
+    return step
+
+
+def call_method_step(vm, next_index, count):
+    call_function = vm.call_function
+
+    def step(frame):
+        stack = frame.stack
+        method = stack[-count - 2]
+        if method is MISSING:
+            method = stack[-count - 1]
+            args = stack[-count:] if count else []
+        else:
+            args = stack[-count - 1:]
+        del stack[-count - 2:]
+        frame.last_instruction = next_index
+        if method.__class__ is Function or method.__class__ is types.MethodType:
+            if call_function(method, args, None):
+                vm.why = 'call'
+                return STOP
+            return next_index
+        if not count and (method is locals or method is sys.exc_info):
+            stack.append(vm.call_frame_builtin(method, frame))
+            return next_index
+        stack.append(method(*args))
+        return next_index
+
+    return step
+
+
+def return_value_step(vm, next_index):
+    def step(frame):
+        vm.return_value = frame.stack.pop()
+        vm.why = 'return'
+        frame.last_instruction = next_index
+        return STOP
+
+    return step
+
+
+def load_fast__load_fast_step(vm, next_index, first, second):
+    def step(frame):
+        fast_locals = frame.fast_locals
+        x = fast_locals[first]
+        if x is UNBOUND:
+            raise unbound_local(frame, first)
+        y = fast_locals[second]
+        if y is UNBOUND:
+            frame.stack.append(x)
+            raise unbound_local(frame, second)
+        frame.stack += (x, y)
+        return next_index
+
+    return step
+
+
+def load_fast__load_const_step(vm, next_index, index, const):
+    def step(frame):
+        value = frame.fast_locals[index]
+        if value is UNBOUND:
+            raise unbound_local(frame, index)
+        frame.stack += (value, const)
+        return next_index
+
+    return step
+
+
+def store_fast__load_fast_step(vm, next_index, first, second):
+    def step(frame):
+        fast_locals = frame.fast_locals
+        stack = frame.stack
+        fast_locals[first] = stack.pop()
+        value = fast_locals[second]
+        if value is UNBOUND:
+            raise unbound_local(frame, second)
+        stack.append(value)
+        return next_index
+
+    return step
+
+
+def return_const_step(vm, next_index, const):
+    def step(frame):
+        vm.return_value = const
+        vm.why = 'return'
+        frame.last_instruction = next_index
+        return STOP
+
+    return step
+
+
+def compare_op__pop_jump_if_false_step(vm, next_index, opnum, jump):
+    compare = vm.COMPARE_OPERATORS[opnum]
+
+    def step(frame):
+        stack = frame.stack
+        y = stack.pop()
+        if compare(stack.pop(), y):
+            return next_index
+        return jump
+
+    return step
+
+
+def compare_op__pop_jump_if_true_step(vm, next_index, opnum, jump):
+    compare = vm.COMPARE_OPERATORS[opnum]
+
+    def step(frame):
+        stack = frame.stack
+        y = stack.pop()
+        if compare(stack.pop(), y):
+            return jump
+        return next_index
+
+    return step
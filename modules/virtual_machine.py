@@ -1,45 +1,235 @@
 # coding=utf-8
-import collections
 import dis
+import inspect
 import operator
 import sys
-
-from modules.frame import Frame
-from modules.function import Function
+import types
+
+from modules import quickening, threaded
+from modules.binder import ArgumentBinder
+from modules.block_table import block_table
+from modules.decoder import WORDCODE, InstructionCache
+from modules.frame import UNBOUND, Frame
+from modules.function import Function, writes_globals
+from modules.generator import GENERATOR_FLAGS, AsyncGeneratorValue, Generator, awaitable_iterator, make_generator
+from modules.inline_cache import MISSING, AttributeCache, NameCache, Namespace, inline_cache
+from modules.optimizer import optimize
+from modules.quickening import WARMUP, quicken, quickenable, thread_sites
+from modules.threaded import STOP, binary_step, thread, threaded_step, unary_step, unbound_cell
 from modules.virtual_machine_error import VirtualMachineError
 
-Block = collections.namedtuple("Block", "type, handler, stack_height")
+
+def unary_handler(fn):
+    """
+    make the handler of a unary operator opcode
+    :param fn: operator applied to the value on top of the stack
+    """
+
+    def handler(vm):
+        frame = vm.current_frame
+        frame.push(fn(frame.pop()))
+
+    handler.make_step = unary_step(fn)
+    return handler
+
+
+def binary_handler(fn):
+    """
+    make the handler of a binary or in-place operator opcode
+    :param fn: operator applied to the two values on top of the stack
+    """
+
+    @quickenable
+    def handler(vm):
+        stack = vm.current_frame.stack
+        y = stack.pop()
+        stack[-1] = fn(stack[-1], y)
+
+    handler.make_step = binary_step(fn)
+    return handler
+
+
+def run_budgeted(vm, handler, arguments):
+    """
+    Run an instruction once the budget is used up: the budget is renewed,
+    and `preempt` called first. It may set `countdown` to run a different
+    number of instructions until the next call, or raise an exception,
+    which the guest gets as if that instruction raised it.
+    """
+    vm.countdown = vm.budget
+    vm.preempt(vm)
+    return handler(vm, *arguments)
 
 
 class VirtualMachine(object):
-    def __init__(self):
+    ENGINES = ('classic', 'threaded')
+
+    def __init__(self, optimize=False, max_free_frames=32, engine='classic', hot_threshold=None,
+                 native_policy=None, quicken=False, quicken_warmup=WARMUP, budget=None, preempt=None,
+                 recursion_limit=None):
+        """
+        :param optimize: run code through the bytecode optimizer before executing it
+        :param max_free_frames: number of finished frames of each stack size kept for reuse
+        :param engine: 'classic' runs frames in the decode and dispatch loop of run_frame,
+        'threaded' in that of run_frame_threaded
+        :param hot_threshold: calls after which a guest function may run as a native
+        CPython function, see may_run_natively; never when None
+        :param native_policy: function of a guest Function returning whether it may run natively
+        :param quicken: specialize arithmetic and comparison instructions for the operand types
+        they run on, see quickening
+        :param quicken_warmup: runs of such an instruction before it is first specialized
+        :param budget: number of instructions run between two calls of `preempt`; when None,
+        instructions are not counted
+        :param preempt: function of the virtual machine, called when the budget is used up,
+        before the next instruction runs; see run_budgeted
+        :param recursion_limit: number of frames the call stack may hold, sys.getrecursionlimit()
+        by default
+        """
+        if engine not in self.ENGINES:
+            raise ValueError("unknown engine: %r" % (engine,))
         self.frames = []  # The call stack of frames.
+        self.recursion_limit = recursion_limit or sys.getrecursionlimit()
         self.current_frame = None  # The current frame.
         self.return_value = None
-        self.last_exception = None
+        self.last_exception = None  # the exception being raised, as (type, value, traceback)
+        self.binders = {}  # ArgumentBinder of each code object made into a function
+        self.block_tables = {}  # blocks around each instruction of each code object run
+        self.free_frames = {}  # finished frames kept for reuse, by co_stacksize
+        self.max_free_frames = max_free_frames
+        self.optimize = optimize
+        self.engine = engine
+        self.threaded_code = {}  # steps of each code object run by the threaded engine
+        self.why = None  # why the last step of the threaded engine stopped
+        self.hot_threshold = hot_threshold
+        self.native_policy = native_policy
+        self.native_safe = {}  # whether each code object may run natively
+        # profilers watching the guest code, or a budget counting its
+        # instructions; while any is, functions stay interpreted
+        self.instrumented = 0
+        self.quicken = quicken
+        self.quicken_warmup = quicken_warmup
+        self.quickened = {}  # adaptive instructions of each code object run, and their sites
+        self.budget = budget
+        self.preempt = preempt
+        self.countdown = budget  # instructions left to run before the next preemption
+        if budget is not None:
+            self.instrumented += 1
+        self.instruction_cache = InstructionCache(
+            self.dispatch_table(),
+            optimizer=self.optimize_instructions if optimize else None,
+        )
 
     # Frame manipulation
-    def make_frame(self, code, callargs={}, global_names=None, local_names=None):
+    def make_frame(self, code, callargs={}, global_names=None, local_names=None, fast_locals=None, closure=None):
         """
         make frame
+        `callargs` maps argument names to values; a call that already bound
+        its arguments passes the list of `fast_locals` instead. `closure` is
+        the tuple of cells of the free variables of a nested function.
         :rtype: object
         """
-        if global_names is not None and local_names is not None:
-            local_names = global_names
+        if global_names is not None:
+            if local_names is None:
+                local_names = global_names
         elif self.frames:
             global_names = self.current_frame.global_names
             local_names = {}
         else:
-            global_names = local_names = {
+            global_names = local_names = Namespace({
                 '__builtins__': __builtins__,
                 '__name__': '__main__',
                 '__doc__': None,
                 '__package__': None,
-            }
-        local_names.update(callargs)
-        frame = Frame(code, global_names, local_names, self.current_frame)
+            })
+        if callargs:
+            fast_locals = [UNBOUND] * code.co_nlocals
+            varnames = code.co_varnames
+            for name, value in callargs.items():
+                fast_locals[varnames.index(name)] = value
+        free_frames = self.free_frames.get(code.co_stacksize)
+        if free_frames:
+            frame = free_frames.pop()
+            frame.reset(code, global_names, local_names, self.current_frame, fast_locals, closure)
+        else:
+            frame = Frame(code, global_names, local_names, self.current_frame, fast_locals, closure)
         return frame
 
+    def binder(self, code):
+        """
+        get the argument binder of `code`, making it on first use
+        :param code:
+        """
+        try:
+            return self.binders[code]
+        except KeyError:
+            binder = self.binders[code] = ArgumentBinder(code)
+            return binder
+
+    def steps(self, code):
+        """
+        get the threaded steps of `code`, making them on first use
+        :param code:
+        """
+        try:
+            return self.threaded_code[code]
+        except KeyError:
+            steps = self.threaded_code[code] = thread(self, self.instructions_of(code))
+            if self.quicken:
+                thread_sites(self.quickened[code][1], steps)
+            return steps
+
+    def instructions_of(self, code):
+        """
+        get the instructions run for `code`: the decoded ones, or when
+        quickening, an adaptive copy made on first use
+        :param code:
+        """
+        if not self.quicken:
+            return self.instruction_cache[code]
+        try:
+            return self.quickened[code][0]
+        except KeyError:
+            quickened = self.quickened[code] = quicken(self, self.instruction_cache[code])
+            return quickened[0]
+
+    def may_run_natively(self, function):
+        """
+        Decide whether a guest function that got hot runs on its native function from now on.
+        Native code runs at CPython speed but out of sight of the virtual
+        machine, so this is refused while the virtual machine is instrumented,
+        and for generators and coroutines (which the virtual machine runs as
+        suspended frames), closures, and code assigning globals (which would
+        go stale in the inline caches). `native_policy` may opt more out;
+        subclasses may override this.
+        Native code calls guest functions through Function.__call__, so each
+        level of native calls takes host frames where interpreted calls take
+        none: code naming itself, like a recursive function, stays
+        interpreted. Functions recursing through one another may still run
+        natively, and then reach about half of sys.getrecursionlimit() levels.
+        :param function:
+        """
+        if self.instrumented or function.func_closure:
+            return False
+        code = function.func_code
+        safe = self.native_safe.get(code)
+        if safe is None:
+            safe = self.native_safe[code] = not (code.co_flags & GENERATOR_FLAGS or writes_globals(code) or
+                                                 code.co_name in code.co_names)
+        if not safe:
+            return False
+        return self.native_policy is None or bool(self.native_policy(function))
+
+    def release_frame(self, frame):
+        """
+        Give back a finished frame for reuse by make_frame.
+        Only the owner of a frame may release it, once nothing else refers to it.
+        :param frame:
+        """
+        free_frames = self.free_frames.setdefault(frame.code_obj.co_stacksize, [])
+        frame.clear()
+        if len(free_frames) < self.max_free_frames:
+            free_frames.append(frame)
+
     def push_frame(self, frame):
         """
         push frame to frame stack
@@ -61,7 +251,8 @@ class VirtualMachine(object):
     # Jumping through bytecode
     def jump(self, jump):
         """
-        Move the bytecode pointer to `jump`, so it will execute next.
+        Move the instruction pointer to `jump`, so it will execute next.
+        `jump` is an index into the frame's decoded instructions.
         """
         self.current_frame.last_instruction = jump
 
@@ -73,136 +264,470 @@ class VirtualMachine(object):
 
         self.run_frame(frame)
 
-    def parse_byte_and_args(self):
+    async def run_code_async(self, code, global_names=None, local_names=None, main='main'):
         """
-        parses arguments and groups them
-        :return:
+        An entry point to execute code on a running asyncio event loop.
+        The module code runs first; then the coroutine function it defines as
+        `main`, if any, is called and awaited on the loop, so many scripts can
+        be interleaved by running each of them as a task.
+        Code compiled with top level await runs as a coroutine by itself.
+        :return: the result of `main`
         """
-        frame = self.current_frame
-        opoffset = frame.last_instruction
-        byteCode = frame.code_obj.co_code[opoffset]
-        frame.last_instruction += 1
-        byte_name = dis.opname[byteCode]
-        if byteCode >= dis.HAVE_ARGUMENT:
-            argument = frame.code_obj.co_code[
-                       frame.last_instruction:frame.last_instruction + 2]  # index into the bytecode
-            frame.last_instruction += 2  # advance the instruction pointer
-            arg_val = argument[0] + (argument[1] << 8)
-            if byteCode in dis.hasconst:  # Look up a constant
-                argument = frame.code_obj.co_consts[arg_val]
-            elif byteCode in dis.hasname:  # Look up a name
-                argument = frame.code_obj.co_names[arg_val]
-            elif byteCode in dis.haslocal:  # Look up a local name
-                argument = frame.code_obj.co_varnames[arg_val]
-            elif byteCode in dis.hasjrel:  # Calculate a relative jump
-                argument = frame.last_instruction + arg_val
-            else:
-                argument = arg_val
-            argument = [argument]
-        else:
-            argument = []
+        frame = self.make_frame(code, global_names=global_names, local_names=local_names)
+        if code.co_flags & inspect.CO_COROUTINE:
+            return await make_generator(frame, self)
+
+        self.run_frame(frame)
+        entry = frame.global_names.get(main) if main else None
+        if entry is None:
+            return None
+        return await entry()
+
+    @classmethod
+    def dispatch_table(cls):
+        """
+        Opcode indexed table of handlers, built once per class.
+        Each entry is a plain function taking the virtual machine and the
+        decoded arguments, or None when the opcode is not supported.
+        """
+        table = cls.__dict__.get('_dispatch_table')
+        if table is not None:
+            return table
+
+        operator_tables = [
+            ('UNARY_', cls.UNARY_OPERATORS, unary_handler),
+            ('BINARY_', cls.BINARY_OPERATORS, binary_handler),
+            ('INPLACE_', cls.INPLACE_OPERATORS, binary_handler),
+        ]
+        table = [None] * 256
+        for opcode, byte_name in enumerate(dis.opname):
+            handler = getattr(cls, 'byte_%s' % byte_name, None)
+            if handler is None:
+                for prefix, operators, make_handler in operator_tables:
+                    if byte_name.startswith(prefix) and byte_name[len(prefix):] in operators:
+                        handler = make_handler(operators[byte_name[len(prefix):]])
+                        break
+            table[opcode] = handler
+
+        cls._dispatch_table = table
+        return table
+
+    @classmethod
+    def unsupported_opcodes(cls):
+        """
+        names of the opcodes of this interpreter that have no handler
+        """
+        table = cls.dispatch_table()
+        return sorted(name for name, opcode in dis.opmap.items() if table[opcode] is None)
+
+    # pairs of opcodes fused by the optimizer, and the name of the fused instruction
+    SUPERINSTRUCTIONS = {
+        ('LOAD_FAST', 'LOAD_FAST'): 'LOAD_FAST__LOAD_FAST',
+        ('LOAD_FAST', 'LOAD_CONST'): 'LOAD_FAST__LOAD_CONST',
+        ('STORE_FAST', 'LOAD_FAST'): 'STORE_FAST__LOAD_FAST',
+        ('LOAD_CONST', 'RETURN_VALUE'): 'RETURN_CONST',
+        ('COMPARE_OP', 'POP_JUMP_IF_FALSE'): 'COMPARE_OP__POP_JUMP_IF_FALSE',
+        ('COMPARE_OP', 'POP_JUMP_IF_TRUE'): 'COMPARE_OP__POP_JUMP_IF_TRUE',
+    }
+
+    @classmethod
+    def superinstruction_table(cls):
+        """
+        Map each pair in SUPERINSTRUCTIONS to the name and handler of the
+        fused instruction, built once per class.
+        """
+        table = cls.__dict__.get('_superinstruction_table')
+        if table is None:
+            table = {}
+            for pair, name in cls.SUPERINSTRUCTIONS.items():
+                table[pair] = (name, getattr(cls, 'byte_%s' % name))
+            cls._superinstruction_table = table
+        return table
 
-        return byte_name, argument
+    def optimize_instructions(self, instructions):
+        """
+        run decoded instructions through the optimizer
+        :param instructions:
+        """
+        return optimize(instructions, self.superinstruction_table())
 
-    def dispatch(self, byte_name, argument):
+    def inline_cache_stats(self):
+        """
+        hits and misses of the inline caches of every decoded instruction
+        :return: dict mapping opcode names to (hits, misses)
         """
-        Dispatch by bytename to the corresponding methods.
+        return self.instruction_cache.cache_stats()
+
+    def quickening_stats(self):
+        """
+        how the quickened instructions of every code object run so far fared
+        :return: dict mapping opcode names to quickening.QuickeningStats
+        """
+        return quickening.stats(sites for _, sites in self.quickened.values())
+
+    def dispatch(self, bytecode_fn, argument):
+        """
+        Run the handler of one instruction.
         Exceptions are caught and set on the virtual machine.
         """
 
-        # When later unwinding the block stack,
+        # When later unwinding the blocks,
         # we need to keep track of why we are doing it.
-        why = None
         try:
-            bytecode_fn = getattr(self, 'byte_%s' % byte_name, None)
-            if bytecode_fn is None:
-                if byte_name.startswith('UNARY_'):
-                    self.unaryOperator(byte_name[6:])
-                elif byte_name.startswith('BINARY_'):
-                    self.binaryOperator(byte_name[7:])
-                else:
-                    raise VirtualMachineError(
-                        "unsupported bytecode type: %s" % byte_name
-                    )
-            else:
-                why = bytecode_fn(*argument)
+            why = bytecode_fn(self, *argument)
         except:
             # deal with exceptions encountered while executing the op.
-            self.last_exception = sys.exc_info()[:2] + (None,)
+            exctype, value = sys.exc_info()[:2]
+            self.last_exception = exctype, value, None
+            frame = self.current_frame
+            self.add_traceback(value, frame, frame.last_instruction - 1)
             why = 'exception'
 
         return why
 
-    def manage_block_stack(self, why):
+    def block_table(self, code):
         """
-        manage block stack and send to appropriate jump calls
-        depending on the type of code block we're processing
-        :param why:
-        :return:
+        get the blocks around each instruction of `code`, finding them on first use
+        :param code:
+        :return: see block_table.block_table
         """
-        block = self.current_frame.block_stack[-1]
+        try:
+            return self.block_tables[code]
+        except KeyError:
+            table = self.block_tables[code] = block_table(self.instruction_cache[code])
+            return table
 
-        if block.type == 'loop' and why == 'continue':
-            self.jump(self.return_value)
-            why = None
-            return why
+    def add_traceback(self, exception, frame, index):
+        """
+        record that `exception` went through instruction `index` of `frame`
+        The guest traceback is kept on the exception, innermost frame first,
+        as (code object, bytecode offset) pairs; see guest_traceback.
+        :param exception:
+        :param frame:
+        :param index:
+        """
+        entry = frame.code_obj, self.instruction_cache[frame.code_obj][index].offset
+        try:
+            exception.__guest_traceback__.append(entry)
+        except AttributeError:
+            # the first frame is where it was raised: chain it to the exception handled there
+            exception.__guest_traceback__ = [entry]
+            if exception.__context__ is None:
+                self.chain_context(exception, frame)
 
-        self.current_frame.pop_block()
-        current_exc = self.current_frame.unwind_block(block)
-        if current_exc is not None:
-            self.last_exception = current_exc
+    def handled_exception(self, frame):
+        """
+        the exception being handled where `frame` runs: the one its innermost
+        running except handler handles, else the one its caller handles, and so on
+        :param frame:
+        :return: (type, value, traceback), or None
+        """
+        while frame is not None:
+            handled = frame.handled_exception
+            if handled is not None and handled[1] is not None:
+                return handled
+            frame = frame.prev_frame
+        return None
 
-        if block.type == 'loop' and why == 'break':
-            self.jump(block.handler)
-            why = None
+    def chain_context(self, exception, frame):
+        """
+        make the exception handled where `frame` runs the `__context__` of
+        `exception`, raised there, cutting the cycle that may close
+        :param exception:
+        :param frame:
+        """
+        handled = self.handled_exception(frame)
+        if handled is None or handled[1] is exception:
+            return
+        context = link = handled[1]
+        while link.__context__ is not None:
+            if link.__context__ is exception:
+                link.__context__ = None
+                break
+            link = link.__context__
+        exception.__context__ = context
 
-        elif block.type in ['setup-except', 'finally'] and why == 'exception':
-            self.current_frame.push_block('except-handler')
-            exctype, value, tb = self.last_exception
-            self.current_frame.push(tb, value, exctype)
-            self.current_frame.push(tb, value, exctype)  # yes, twice
-            self.jump(block.handler)
-            why = None
+    def unwind(self, frame, why, index):
+        """
+        Unwind the blocks around instruction `index` of `frame`, innermost
+        first, until one of them handles `why`. The blocks come from the
+        block table of the code, the except handlers running from the frame.
+        :param frame:
+        :param why:
+        :param index:
+        :return: `why` if no block handled it, else None
+        """
+        chain = self.block_table(frame.code_obj)
+        chain = chain[index] if chain is not None else ()
+        level = len(chain)
+        handlers = frame.block_stack
+        stack = frame.stack
+        while True:
+            if handlers and handlers[-1].level >= level:
+                # leaving an except handler restores the exception handled before it
+                frame.handled_exception = frame.unwind_handler(handlers.pop())
+                continue
+            if not level:
+                return why
+            level -= 1
+            block = chain[level]
+
+            if block.type == 'loop' and why == 'continue':
+                frame.last_instruction = self.return_value
+                return None
+
+            del stack[frame.block_heights[block.setup]:]
+            if block.type == 'loop':
+                if why == 'break':
+                    frame.last_instruction = block.handler
+                    return None
+
+            elif why == 'exception':
+                frame.push_handler(level)
+                exctype, value, tb = frame.handled_exception or (None, None, None)
+                stack += (tb, value, exctype)
+                exctype, value, tb = frame.handled_exception = self.last_exception
+                stack += (tb, value, exctype)
+                frame.last_instruction = block.handler
+                return None
+
+            elif block.type == 'finally':
+                if why in ('return', 'continue'):
+                    stack.append(self.return_value)
+                stack.append(why)
+                frame.last_instruction = block.handler
+                return None
+
+    def run_frame(self, frame, exception=None):
+        """
+        Run a frame until it returns (somehow), or yields.
+        Exceptions are raised, the return value is returned.
+        A frame that yields is left suspended and can be run again later;
+        `exception` is then raised in it before anything else runs.
+        The guest functions it calls run in the same loop, see call_function.
+        The loop is picked here on every call, so that subclasses only have
+        to override this method: the classic decode and dispatch loop below,
+        run_frame_threaded for the threaded engine, or one of them counting
+        instructions when there is a budget. Most steps of the threaded
+        engine leave `last_instruction` behind, so while profilers watch the
+        virtual machine, frames run in the classic loop instead.
+        """
+        if self.budget is not None:
+            if self.engine == 'threaded':
+                return self.run_frame_threaded_budgeted(frame, exception)
+            return self.run_frame_budgeted(frame, exception)
+        if self.engine == 'threaded' and not self.instrumented:
+            return self.run_frame_threaded(frame, exception)
+
+        why = self.enter_frame(frame, exception)
+        instructions = self.instructions_of(frame.code_obj)
+        blocks = self.block_table(frame.code_obj)
+        callers = []  # instructions and blocks of the frames waiting for a call to return
 
-        elif block.type == 'finally':
-            if why in ('return', 'continue'):
-                self.current_frame.push(self.return_value)
-            self.current_frame.push(why)
-            self.jump(block.handler)
-            why = None
+        while True:
+            while not why:
+                index = frame.last_instruction
+                instruction = instructions[index]
+                frame.last_instruction = index + 1
+
+                why = self.dispatch(instruction.handler, instruction.arguments)
+
+                # Deal with any blocks around the instruction, except when
+                # yielding or calling: the frame resumes where it was
+                if why and why != 'yield' and why != 'call' and (blocks is not None or frame.block_stack):
+                    why = self.unwind(frame, why, index)
+
+            if why == 'call':
+                callers.append((instructions, blocks))
+                frame = self.current_frame
+                instructions = self.instructions_of(frame.code_obj)
+                blocks = self.block_table(frame.code_obj)
+                why = None
+            elif not callers:
+                return self.leave_frame(frame, why)
+            else:
+                why = self.finish_call(frame, why)
+                frame = self.current_frame
+                instructions, blocks = callers.pop()
 
-        return why
+    def run_frame_threaded(self, frame, exception=None):
+        """
+        run_frame, on the steps of the threaded engine
+        Each instruction is a closure with its arguments already bound, which
+        returns the index of the next one; only when it returns STOP or raises
+        does the loop deal with blocks and `why`.
+        """
+        why = self.enter_frame(frame, exception)
+        steps = self.steps(frame.code_obj)
+        blocks = self.block_table(frame.code_obj)
+        callers = []  # steps and blocks of the frames waiting for a call to return
+
+        while True:
+            while not why:
+                index = frame.last_instruction
+                try:
+                    while index != STOP:
+                        index = steps[index](frame)
+                    why = self.why
+                    index = frame.last_instruction - 1
+                except:
+                    # `index` is still that of the instruction that raised
+                    exctype, value = sys.exc_info()[:2]
+                    self.last_exception = exctype, value, None
+                    self.add_traceback(value, frame, index)
+                    why = 'exception'
+
+                if why != 'yield' and why != 'call' and (blocks is not None or frame.block_stack):
+                    why = self.unwind(frame, why, index)
+
+            if why == 'call':
+                callers.append((steps, blocks))
+                frame = self.current_frame
+                steps = self.steps(frame.code_obj)
+                blocks = self.block_table(frame.code_obj)
+                why = None
+            elif not callers:
+                return self.leave_frame(frame, why)
+            else:
+                why = self.finish_call(frame, why)
+                frame = self.current_frame
+                steps, blocks = callers.pop()
 
-    def run_frame(self, frame):
+    def run_frame_budgeted(self, frame, exception=None):
         """
-        Run a frame until it returns (somehow).
-        Exceptions are raised, the return value is returned.
+        the classic loop of run_frame, counting down the budget of instructions
         """
-        self.push_frame(frame)
+        why = self.enter_frame(frame, exception)
+        instructions = self.instructions_of(frame.code_obj)
+        blocks = self.block_table(frame.code_obj)
+        callers = []  # instructions and blocks of the frames waiting for a call to return
+
         while True:
-            byte_name, argument = self.parse_byte_and_args()
+            while not why:
+                index = frame.last_instruction
+                instruction = instructions[index]
+                frame.last_instruction = index + 1
+
+                self.countdown -= 1
+                if self.countdown:
+                    why = self.dispatch(instruction.handler, instruction.arguments)
+                else:
+                    why = self.dispatch(run_budgeted, (instruction.handler, instruction.arguments))
+
+                if why and why != 'yield' and why != 'call' and (blocks is not None or frame.block_stack):
+                    why = self.unwind(frame, why, index)
+
+            if why == 'call':
+                callers.append((instructions, blocks))
+                frame = self.current_frame
+                instructions = self.instructions_of(frame.code_obj)
+                blocks = self.block_table(frame.code_obj)
+                why = None
+            elif not callers:
+                return self.leave_frame(frame, why)
+            else:
+                why = self.finish_call(frame, why)
+                frame = self.current_frame
+                instructions, blocks = callers.pop()
 
-            why = self.dispatch(byte_name, argument)
+    def run_frame_threaded_budgeted(self, frame, exception=None):
+        """
+        run_frame_threaded, counting down the budget of instructions
+        """
+        why = self.enter_frame(frame, exception)
+        steps = self.steps(frame.code_obj)
+        blocks = self.block_table(frame.code_obj)
+        callers = []  # steps and blocks of the frames waiting for a call to return
+
+        while True:
+            while not why:
+                index = frame.last_instruction
+                try:
+                    while index != STOP:
+                        self.countdown -= 1
+                        if not self.countdown:
+                            self.countdown = self.budget
+                            self.preempt(self)
+                        index = steps[index](frame)
+                    why = self.why
+                    index = frame.last_instruction - 1
+                except:
+                    exctype, value = sys.exc_info()[:2]
+                    self.last_exception = exctype, value, None
+                    self.add_traceback(value, frame, index)
+                    why = 'exception'
+
+                if why != 'yield' and why != 'call' and (blocks is not None or frame.block_stack):
+                    why = self.unwind(frame, why, index)
+
+            if why == 'call':
+                callers.append((steps, blocks))
+                frame = self.current_frame
+                steps = self.steps(frame.code_obj)
+                blocks = self.block_table(frame.code_obj)
+                why = None
+            elif not callers:
+                return self.leave_frame(frame, why)
+            else:
+                why = self.finish_call(frame, why)
+                frame = self.current_frame
+                steps, blocks = callers.pop()
 
-            # Deal with any block management we need to do
-            while why and frame.block_stack:
-                why = self.manage_block_stack(why)
+    def enter_frame(self, frame, exception=None):
+        """
+        make `frame` the current frame, raising `exception` in it if given
+        :return: why the frame stops before running anything, or None
+        """
+        self.push_frame(frame)
+        why = None
+        if exception is not None:
+            # raised where the frame is suspended
+            index = max(frame.last_instruction - 1, 0)
+            self.last_exception = type(exception), exception, None
+            self.add_traceback(exception, frame, index)
+            why = self.unwind(frame, 'exception', index)
+        return why
 
-            if why:
-                break
+    def finish_call(self, frame, why):
+        """
+        Pop `frame`, pushed by call_function, once it returned or raised,
+        and go back to its caller: the return value is pushed on its stack,
+        an exception raised at the call.
+        :param frame:
+        :param why: 'return' or 'exception'
+        :return: why the caller stops, or None when it goes on
+        """
+        frames = self.frames
+        frames.pop()
+        caller = self.current_frame = frames[-1]
+        if why == 'return':
+            caller.stack.append(self.return_value)
+            why = None
+        else:
+            index = caller.last_instruction - 1
+            self.add_traceback(self.last_exception[1], caller, index)
+            if self.block_table(caller.code_obj) is not None or caller.block_stack:
+                why = self.unwind(caller, why, index)
+        self.release_frame(frame)
+        return why
 
+    def leave_frame(self, frame, why):
+        """
+        pop `frame` once it stopped running
+        :return: its return or yielded value; an exception it ended with is raised
+        """
+        frame.suspended = why == 'yield'
         self.pop_frame()
 
         if why == 'exception':
-            exc, val, tb = self.last_exception
-            e = exc(val)
-            e.__traceback__ = tb
-            raise e
+            # the very exception raised in the guest, without the frames of the interpreter
+            raise self.last_exception[1].with_traceback(None)
 
         return self.return_value
 
     ## Stack manipulation
 
+    @threaded_step(threaded.load_const_step)
     def byte_LOAD_CONST(self, const):
         """
         load constant into current frame
@@ -210,6 +735,7 @@ class VirtualMachine(object):
         """
         self.current_frame.push(const)
 
+    @threaded_step(threaded.pop_top_step)
     def byte_POP_TOP(self):
         """
         pop top from frame
@@ -222,22 +748,49 @@ class VirtualMachine(object):
         """
         self.current_frame.push(self.current_frame.top())
 
+    def byte_DUP_TOP_TWO(self):
+        """
+        duplicate the two values on top of the stack
+        """
+        frame = self.current_frame
+        frame.stack.extend(frame.stack[-2:])
+
+    def byte_ROT_TWO(self):
+        """
+        swap the two values on top of the stack
+        """
+        stack = self.current_frame.stack
+        stack[-1], stack[-2] = stack[-2], stack[-1]
+
+    def byte_ROT_THREE(self):
+        """
+        move the value on top of the stack below the next two
+        """
+        stack = self.current_frame.stack
+        stack.insert(-2, stack.pop())
+
+    def byte_NOP(self):
+        """
+        do nothing
+        """
+
     ## Names
-    def byte_LOAD_NAME(self, name):
+    @inline_cache(NameCache)
+    def byte_LOAD_NAME(self, name, cache):
         """
-        load a name into local_names of current frame
+        load a name from the locals, globals or builtins of current frame
         :param name:
+        :param cache:
         """
         frame = self.current_frame
-        if name in frame.local_names:
-            val = frame.local_names[name]
-        elif name in frame.global_names:
-            val = frame.global_names[name]
-        elif name in frame.builtin_names:
-            val = frame.builtin_names[name]
-        else:
-            raise NameError("name '%s' is not defined" % name)
-        self.current_frame.push(val)
+        val = MISSING
+        if frame.local_names is not frame.global_names:
+            val = frame.local_names.get(name, MISSING)
+        if val is MISSING:
+            val = cache.load(name, frame.global_names, frame.builtin_names)
+            if val is MISSING:
+                raise NameError("name '%s' is not defined" % name)
+        frame.push(val)
 
     def byte_STORE_NAME(self, name):
         """
@@ -253,40 +806,125 @@ class VirtualMachine(object):
         """
         del self.current_frame.local_names[name]
 
-    def byte_LOAD_FAST(self, name):
+    @threaded_step(threaded.load_fast_step)
+    def byte_LOAD_FAST(self, index):
         """
-        load variable value from current frame
-        :param name:
+        load variable value from the fast locals of current frame
+        :param index:
         """
-        if name in self.current_frame.local_names:
-            val = self.current_frame.local_names[name]
-        else:
+        frame = self.current_frame
+        val = frame.fast_locals[index]
+        if val is UNBOUND:
             raise UnboundLocalError(
-                "local variable '%s' referenced before assignment" % name
+                "local variable '%s' referenced before assignment" % frame.code_obj.co_varnames[index]
             )
-        self.current_frame.push(val)
+        frame.push(val)
 
-    def byte_STORE_FAST(self, name):
+    @threaded_step(threaded.store_fast_step)
+    def byte_STORE_FAST(self, index):
         """
-        store value of local variable in current frame
-        :param name:
+        store value of local variable in the fast locals of current frame
+        :param index:
         """
-        self.current_frame.local_names[name] = self.current_frame.pop()
+        frame = self.current_frame
+        frame.fast_locals[index] = frame.pop()
 
-    def byte_LOAD_GLOBAL(self, name):
+    def byte_DELETE_FAST(self, index):
+        """
+        delete local variable from the fast locals of current frame
+        :param index:
+        """
+        frame = self.current_frame
+        if frame.fast_locals[index] is UNBOUND:
+            raise UnboundLocalError(
+                "local variable '%s' referenced before assignment" % frame.code_obj.co_varnames[index]
+            )
+        frame.fast_locals[index] = UNBOUND
+
+    @inline_cache(NameCache)
+    @threaded_step(threaded.load_global_step)
+    def byte_LOAD_GLOBAL(self, name, cache):
         """
         load global variable value from global names list or builtins
         :param name:
+        :param cache:
         """
         f = self.current_frame
-        if name in f.global_names:
-            val = f.global_names[name]
-        elif name in f.builtin_names:
-            val = f.builtin_names[name]
-        else:
+        val = cache.load(name, f.global_names, f.builtin_names)
+        if val is MISSING:
             raise NameError("global name '%s' is not defined" % name)
         f.push(val)
 
+    def byte_STORE_GLOBAL(self, name):
+        """
+        store value of a global variable
+        :param name:
+        """
+        self.current_frame.global_names[name] = self.current_frame.pop()
+
+    def byte_DELETE_GLOBAL(self, name):
+        """
+        delete a global variable
+        :param name:
+        """
+        del self.current_frame.global_names[name]
+
+    ## Cells, the variables shared with nested functions
+
+    def byte_LOAD_CLOSURE(self, index):
+        """
+        push a cell of the current frame, for a nested function to close over
+        :param index: index into the cells of the frame
+        """
+        frame = self.current_frame
+        frame.push(frame.cells[index])
+
+    @threaded_step(threaded.load_deref_step)
+    def byte_LOAD_DEREF(self, index):
+        """
+        load the value of a cell of the current frame
+        :param index:
+        """
+        frame = self.current_frame
+        value = frame.cells[index].cell_contents
+        if value is UNBOUND:
+            raise unbound_cell(frame, index)
+        frame.push(value)
+
+    @threaded_step(threaded.store_deref_step)
+    def byte_STORE_DEREF(self, index):
+        """
+        store a value in a cell of the current frame
+        :param index:
+        """
+        frame = self.current_frame
+        frame.cells[index].cell_contents = frame.pop()
+
+    def byte_DELETE_DEREF(self, index):
+        """
+        empty a cell of the current frame
+        :param index:
+        """
+        frame = self.current_frame
+        cell = frame.cells[index]
+        if cell.cell_contents is UNBOUND:
+            raise unbound_cell(frame, index)
+        cell.cell_contents = UNBOUND
+
+    def byte_LOAD_CLASSDEREF(self, index):
+        """
+        load a free variable in a class body: from the class namespace if
+        it was assigned there, else from its cell
+        :param index:
+        """
+        frame = self.current_frame
+        code = frame.code_obj
+        name = code.co_freevars[index - len(code.co_cellvars)]
+        if name in frame.local_names:
+            frame.push(frame.local_names[name])
+        else:
+            self.byte_LOAD_DEREF(index)
+
     ## Operators
 
     UNARY_OPERATORS = {
@@ -296,17 +934,10 @@ class VirtualMachine(object):
         'INVERT': operator.invert,
     }
 
-    def unaryOperator(self, op):
-        """
-        apply unary operator to value from top of stack and push back
-        :param op:
-        """
-        x = self.current_frame.pop()
-        self.current_frame.push(self.UNARY_OPERATORS[op](x))
-
     BINARY_OPERATORS = {
         'POWER': pow,
         'MULTIPLY': operator.mul,
+        'MATRIX_MULTIPLY': operator.matmul,
         'FLOOR_DIVIDE': operator.floordiv,
         'TRUE_DIVIDE': operator.truediv,
         'MODULO': operator.mod,
@@ -320,13 +951,21 @@ class VirtualMachine(object):
         'OR': operator.or_,
     }
 
-    def binaryOperator(self, op):
-        """
-        apply binary operator to value from top of stack and push back
-        :param op:
-        """
-        x, y = self.current_frame.pop_n(2)
-        self.current_frame.push(self.BINARY_OPERATORS[op](x, y))
+    INPLACE_OPERATORS = {
+        'POWER': operator.ipow,
+        'MULTIPLY': operator.imul,
+        'MATRIX_MULTIPLY': operator.imatmul,
+        'FLOOR_DIVIDE': operator.ifloordiv,
+        'TRUE_DIVIDE': operator.itruediv,
+        'MODULO': operator.imod,
+        'ADD': operator.iadd,
+        'SUBTRACT': operator.isub,
+        'LSHIFT': operator.ilshift,
+        'RSHIFT': operator.irshift,
+        'AND': operator.iand,
+        'XOR': operator.ixor,
+        'OR': operator.ior,
+    }
 
     COMPARE_OPERATORS = [
         operator.lt,
@@ -339,16 +978,19 @@ class VirtualMachine(object):
         lambda x, y: x not in y,
         lambda x, y: x is y,
         lambda x, y: x is not y,
-        lambda x, y: issubclass(x, Exception) and issubclass(x, y),
+        lambda x, y: issubclass(x, y),
     ]
 
+    @quickenable
+    @threaded_step(threaded.compare_op_step)
     def byte_COMPARE_OP(self, opnum):
         """
         apply comparison operator to value from top of stack and push back
         :param opnum:
         """
-        x, y = self.current_frame.pop_n(2)
-        self.current_frame.push(self.COMPARE_OPERATORS[opnum](x, y))
+        stack = self.current_frame.stack
+        y = stack.pop()
+        stack[-1] = self.COMPARE_OPERATORS[opnum](stack[-1], y)
 
     ## Attributes and indexing
 
@@ -361,21 +1003,51 @@ class VirtualMachine(object):
         val = getattr(obj, attr)
         self.current_frame.push(val)
 
+    @inline_cache(AttributeCache)
+    def byte_LOAD_METHOD(self, name, cache):
+        """
+        load a method without binding it when possible:
+        pushes the function and its receiver, or MISSING and the attribute
+        :param name:
+        :param cache:
+        """
+        frame = self.current_frame
+        obj = frame.pop()
+        method = cache.find_method(obj, name)
+        if method is None:
+            frame.stack += (MISSING, getattr(obj, name))
+        else:
+            frame.stack += (method, obj)
+
     def byte_STORE_ATTR(self, name):
         """
         store an attributes
         :param name:
         """
-        val, obj = self.current_frame.pop_n(2)
+        val, obj = self.current_frame.pop_two()
         setattr(obj, name, val)
 
+    def byte_DELETE_ATTR(self, name):
+        """
+        delete an attribute
+        :param name:
+        """
+        delattr(self.current_frame.pop(), name)
+
     def byte_STORE_SUBSCR(self):
         """
         store subscr
         """
-        val, obj, subscr = self.current_frame.pop_n(3)
+        val, obj, subscr = self.current_frame.pop_three()
         obj[subscr] = val
 
+    def byte_DELETE_SUBSCR(self):
+        """
+        delete subscr
+        """
+        obj, subscr = self.current_frame.pop_two()
+        del obj[subscr]
+
     ## Building
 
     def byte_BUILD_TUPLE(self, count):
@@ -394,20 +1066,105 @@ class VirtualMachine(object):
         elts = self.current_frame.pop_n(count)
         self.current_frame.push(elts)
 
+    def byte_BUILD_SET(self, count):
+        """
+        build a set from `count` values in stack
+        :param count:
+        """
+        elts = self.current_frame.pop_n(count)
+        self.current_frame.push(set(elts))
+
+    def byte_BUILD_STRING(self, count):
+        """
+        concatenate `count` strings in stack
+        :param count:
+        """
+        frame = self.current_frame
+        frame.push(''.join(frame.pop_n(count)))
+
+    def byte_FORMAT_VALUE(self, flags):
+        """
+        format the value of an f-string field
+        :param flags: conversion in the low two bits, whether a format spec is on the stack in the third
+        """
+        frame = self.current_frame
+        spec = frame.pop() if flags & 0x04 else ''
+        value = frame.pop()
+        conversion = flags & 0x03
+        if conversion == 1:
+            value = str(value)
+        elif conversion == 2:
+            value = repr(value)
+        elif conversion == 3:
+            value = ascii(value)
+        frame.push(format(value, spec))
+
+    def byte_BUILD_TUPLE_UNPACK(self, count):
+        """
+        build a tuple from `count` iterables in stack
+        :param count:
+        """
+        frame = self.current_frame
+        frame.push(tuple(item for iterable in frame.pop_n(count) for item in iterable))
+
+    byte_BUILD_TUPLE_UNPACK_WITH_CALL = byte_BUILD_TUPLE_UNPACK
+
+    def byte_BUILD_LIST_UNPACK(self, count):
+        """
+        build a list from `count` iterables in stack
+        :param count:
+        """
+        frame = self.current_frame
+        frame.push([item for iterable in frame.pop_n(count) for item in iterable])
+
+    def byte_BUILD_MAP_UNPACK(self, count):
+        """
+        merge `count` mappings in stack into a new dict
+        :param count:
+        """
+        frame = self.current_frame
+        merged = {}
+        for mapping in frame.pop_n(count):
+            merged.update(mapping)
+        frame.push(merged)
+
+    def byte_BUILD_MAP_UNPACK_WITH_CALL(self, count):
+        """
+        merge `count` mappings of keyword arguments, rejecting repeated keywords
+        :param count:
+        """
+        frame = self.current_frame
+        merged = {}
+        for mapping in frame.pop_n(count):
+            for key in mapping:
+                if key in merged:
+                    raise TypeError("got multiple values for keyword argument '%s'" % key)
+                merged[key] = mapping[key]
+        frame.push(merged)
+
+    def byte_BUILD_CONST_KEY_MAP(self, count):
+        """
+        build a dict from `count` values and the tuple of keys on top of the stack
+        :param count:
+        """
+        frame = self.current_frame
+        keys = frame.pop()
+        frame.push(dict(zip(keys, frame.pop_n(count))))
+
     def byte_BUILD_MAP(self, size):
         """
-        build a map. size is not needed here
+        build a map from `size` key and value pairs in stack
         :param size:
         """
-        self.current_frame.push({})
+        items = self.current_frame.pop_n(2 * size)
+        self.current_frame.push(dict(zip(items[::2], items[1::2])))
 
     def byte_STORE_MAP(self):
         """
         store map into current frame
         """
-        the_map, val, key = self.current_frame.pop_n(3)
-        the_map[key] = val
-        self.current_frame.push(the_map)
+        val, key = self.current_frame.pop_two()
+        self.current_frame.top()[key] = val
 
     def byte_UNPACK_SEQUENCE(self, count):
         """
@@ -424,10 +1181,10 @@ class VirtualMachine(object):
         :param count:
         """
         if count == 2:
-            x, y = self.current_frame.pop_n(2)
+            x, y = self.current_frame.pop_two()
             self.current_frame.push(slice(x, y))
         elif count == 3:
-            x, y, z = self.current_frame.pop_n(3)
+            x, y, z = self.current_frame.pop_three()
             self.current_frame.push(slice(x, y, z))
         else:  # pragma: no cover
             raise VirtualMachineError("Strange BUILD_SLICE count: %r" % count)
@@ -441,8 +1198,30 @@ class VirtualMachine(object):
         the_list = self.current_frame.stack[-count]  # peek
         the_list.append(val)
 
+    def byte_SET_ADD(self, count):
+        """
+        add to the set of a set comprehension
+        :param count:
+        """
+        val = self.current_frame.pop()
+        the_set = self.current_frame.stack[-count]  # peek
+        the_set.add(val)
+
+    def byte_MAP_ADD(self, count):
+        """
+        add to the dict of a dict comprehension
+        :param count:
+        """
+        if sys.version_info >= (3, 8):
+            key, val = self.current_frame.pop_two()
+        else:
+            val, key = self.current_frame.pop_two()
+        the_map = self.current_frame.stack[-count]  # peek
+        the_map[key] = val
+
     ## Jumps
 
+    @threaded_step(threaded.jump_step)
     def byte_JUMP_FORWARD(self, jump):
         """
         jump forward
@@ -450,6 +1229,7 @@ class VirtualMachine(object):
         """
         self.jump(jump)
 
+    @threaded_step(threaded.jump_step)
     def byte_JUMP_ABSOLUTE(self, jump):
         """
         jump absolute
@@ -457,6 +1237,7 @@ class VirtualMachine(object):
         """
         self.jump(jump)
 
+    @threaded_step(threaded.pop_jump_if_true_step)
     def byte_POP_JUMP_IF_TRUE(self, jump):
         """
         jump if popped value is true
@@ -466,6 +1247,7 @@ class VirtualMachine(object):
         if val:
             self.jump(jump)
 
+    @threaded_step(threaded.pop_jump_if_false_step)
     def byte_POP_JUMP_IF_FALSE(self, jump):
         """
         jump if popped value is false
@@ -499,12 +1281,20 @@ class VirtualMachine(object):
 
     ## Blocks
 
+    def enter_block(self):
+        """
+        record the height of the data stack at the block the current instruction sets up
+        """
+        frame = self.current_frame
+        frame.block_heights[frame.last_instruction - 1] = len(frame.stack)
+
+    @threaded_step(threaded.setup_step)
     def byte_SETUP_LOOP(self, dest):
         """
         setup a loop
         :param dest:
         """
-        self.current_frame.push_block('loop', dest)
+        self.enter_block()
 
     def byte_GET_ITER(self):
         """
@@ -512,6 +1302,7 @@ class VirtualMachine(object):
         """
         self.current_frame.push(iter(self.current_frame.pop()))
 
+    @threaded_step(threaded.for_iter_step)
     def byte_FOR_ITER(self, jump):
         """
         byte for iterator
@@ -547,25 +1338,27 @@ class VirtualMachine(object):
         self.return_value = destination
         return 'continue'
 
+    @threaded_step(threaded.setup_step)
     def byte_SETUP_EXCEPT(self, dest):
         """
         `except` setup
         :param dest:
         """
-        self.current_frame.push_block('setup-except', dest)
+        self.enter_block()
 
+    @threaded_step(threaded.setup_step)
     def byte_SETUP_FINALLY(self, dest):
         """
         `finally` setup
         :param dest:
         """
-        self.current_frame.push_block('finally', dest)
+        self.enter_block()
 
+    @threaded_step(threaded.pop_block_step)
     def byte_POP_BLOCK(self):
         """
-        pop a block
+        leave a block: the block table already knows the instructions after it are outside of it
         """
-        self.current_frame.pop_block()
 
     def byte_RAISE_VARARGS(self, argc):
         """
@@ -573,7 +1366,8 @@ class VirtualMachine(object):
         :param argc:
         :return:
         """
-        cause = exc = None
+        exc = None
+        cause = MISSING
         if argc == 2:
             cause = self.current_frame.pop()
             exc = self.current_frame.pop()
@@ -585,62 +1379,397 @@ class VirtualMachine(object):
         """
         raise helper method
         :param exc:
-        :param cause:
+        :param cause: what follows `from`, or MISSING
         :return:
         """
-        if exc is None:  # reraise
-            exc_type, val, tb = self.last_exception
-
-        elif type(exc) == type:  # As in `raise ValueError`
-            exc_type = exc
+        frame = self.current_frame
+        if exc is None:  # reraise, adding nothing to the traceback
+            handled = self.handled_exception(frame)
+            if handled is None:
+                raise RuntimeError("No active exception to reraise")
+            self.last_exception = handled
+            return 'exception'
+
+        if isinstance(exc, type) and issubclass(exc, BaseException):  # As in `raise ValueError`
             val = exc()  # Make an instance.
         elif isinstance(exc, BaseException):
             # As in `raise ValueError('foo')`
-            exc_type = type(exc)
             val = exc
         else:
-            return 'exception'  # failure
-
-        self.last_exception = exc_type, val, val.__traceback__
+            raise TypeError("exceptions must derive from BaseException")
+
+        if cause is not MISSING:  # As in `raise ValueError('foo') from error`
+            if isinstance(cause, type) and issubclass(cause, BaseException):
+                cause = cause()
+            elif cause is not None and not isinstance(cause, BaseException):
+                raise TypeError("exception causes must derive from BaseException")
+            val.__cause__ = cause  # which sets __suppress_context__ too
+        if hasattr(val, '__guest_traceback__'):
+            # raised before: add_traceback only chains exceptions in the frame they start in
+            self.chain_context(val, frame)
+
+        self.last_exception = type(val), val, None
+        self.add_traceback(val, frame, frame.last_instruction - 1)
         return 'exception'
 
     def byte_POP_EXCEPT(self):
         """
         pop except
         """
-        block = self.current_frame.pop_block()
-        if block.type != 'except-handler':
-            raise Exception("popped block is not an except handler")
-        current_exc = self.current_frame.unwind_block(block)
-        if current_exc is not None:
-            self.last_exception = current_exc
+        frame = self.current_frame
+        if not frame.block_stack:
+            raise VirtualMachineError("POP_EXCEPT outside of an except handler")
+        frame.handled_exception = frame.unwind_handler(frame.block_stack.pop())
+
+    def byte_END_FINALLY(self):
+        """
+        end a finally block or an except clause, carrying on with whatever
+        was going on before it: nothing, a return, a loop jump or an exception
+        :return:
+        """
+        frame = self.current_frame
+        v = frame.pop()
+        if v is None:
+            return None
+        if isinstance(v, str):
+            why = v
+            if why in ('return', 'continue'):
+                self.return_value = frame.pop()
+            if why == 'silenced':
+                if not frame.block_stack:
+                    raise VirtualMachineError("silenced exception outside of an except handler")
+                frame.handled_exception = frame.unwind_handler(frame.block_stack.pop())
+                return None
+            return why
+        if isinstance(v, type) and issubclass(v, BaseException):
+            tb, val = frame.pop_two()
+            self.last_exception = v, val, tb
+            return 'exception'
+        raise VirtualMachineError("Confused END_FINALLY: %r" % (v,))
+
+    ## Context managers
+
+    def byte_SETUP_WITH(self, dest):
+        """
+        enter a context manager, keeping its __exit__ on the stack below a finally block
+        :param dest:
+        """
+        frame = self.current_frame
+        manager = frame.pop()
+        exit_method = type(manager).__exit__.__get__(manager, type(manager))
+        result = type(manager).__enter__(manager)
+        frame.push(exit_method)
+        self.enter_block()
+        frame.push(result)
+
+    def byte_BEFORE_ASYNC_WITH(self):
+        """
+        start entering an asynchronous context manager:
+        pushes its bound __aexit__ and the awaitable of __aenter__
+        """
+        frame = self.current_frame
+        manager = frame.pop()
+        exit_method = type(manager).__aexit__.__get__(manager, type(manager))
+        frame.push(exit_method)
+        frame.push(type(manager).__aenter__(manager))
+
+    def byte_SETUP_ASYNC_WITH(self, dest):
+        """
+        push the finally block of an `async with`, below the result of __aenter__
+        :param dest:
+        """
+        frame = self.current_frame
+        result = frame.pop()
+        self.enter_block()
+        frame.push(result)
+
+    def byte_WITH_CLEANUP_START(self):
+        """
+        call the __exit__ (or __aexit__) of a context manager,
+        with the exception that ended the block if there is one
+        """
+        frame = self.current_frame
+        stack = frame.stack
+        u = frame.top()
+        v = w = None
+        if u is None:
+            exit_method = stack.pop(-2)
+        elif isinstance(u, str):
+            if u in ('return', 'continue'):
+                exit_method = stack.pop(-3)
+            else:
+                exit_method = stack.pop(-2)
+            u = None
+        else:
+            w, v, u = frame.pop_three()
+            tp, exc, tb = frame.pop_three()
+            exit_method = frame.pop()
+            stack += (tp, exc, tb, None, w, v, u)
+            if not frame.block_stack:
+                raise VirtualMachineError("context manager exception outside of an except handler")
+            handler = frame.block_stack[-1]
+            frame.block_stack[-1] = handler._replace(stack_height=handler.stack_height - 1)
+
+        frame.push(u)
+        frame.push(exit_method(u, v, w))
+
+    def byte_WITH_CLEANUP_FINISH(self):
+        """
+        silence the exception that ended a with block if __exit__ returned true
+        """
+        frame = self.current_frame
+        result = frame.pop()
+        u = frame.pop()
+        if isinstance(u, type) and issubclass(u, BaseException) and result:
+            frame.push("silenced")
+
+    ## Coroutines
+
+    def byte_GET_AWAITABLE(self):
+        """
+        replace the object on top of the stack by the iterator awaiting it runs
+        """
+        frame = self.current_frame
+        frame.push(awaitable_iterator(frame.pop()))
+
+    def byte_GET_AITER(self):
+        """
+        replace the object on top of the stack by its asynchronous iterator
+        """
+        frame = self.current_frame
+        obj = frame.pop()
+        aiter = getattr(type(obj), '__aiter__', None)
+        if aiter is None:
+            raise TypeError("'async for' requires an object with __aiter__ method, got %s" % type(obj).__name__)
+        frame.push(aiter(obj))
+
+    def byte_GET_ANEXT(self):
+        """
+        push the awaitable of the next item of the asynchronous iterator on top of the stack
+        """
+        frame = self.current_frame
+        aiter = frame.top()
+        anext = getattr(type(aiter), '__anext__', None)
+        if anext is None:
+            raise TypeError("'async for' requires an iterator with __anext__ method, got %s" % type(aiter).__name__)
+        frame.push(awaitable_iterator(anext(aiter)))
 
     ## Functions
 
     def byte_MAKE_FUNCTION(self, argc):
         """
         make a function
-        :param argc:
+        :param argc: flags saying which of defaults, keyword only defaults,
+            annotations and closure are on the stack (a count of defaults before Python 3.6)
         """
-        name = self.current_frame.pop()
-        code = self.current_frame.pop()
-        defaults = self.current_frame.pop_n(argc)
-        globs = self.current_frame.global_names
-        fn = Function(name, code, globs, defaults, None, self)
-        self.current_frame.push(fn)
-
+        frame = self.current_frame
+        name = frame.pop()
+        code = frame.pop()
+        closure = kwdefaults = annotations = None
+        if WORDCODE:
+            if argc & 0x08:
+                closure = frame.pop()
+            if argc & 0x04:
+                annotations = frame.pop()
+            if argc & 0x02:
+                kwdefaults = frame.pop()
+            defaults = frame.pop() if argc & 0x01 else ()
+        else:
+            kwdefaults_count, defaults_count = divmod(argc & 0xFFFF, 256)
+            if argc >> 16:
+                annotation_names = frame.pop()
+                annotations = dict(zip(annotation_names, frame.pop_n(len(annotation_names))))
+            if kwdefaults_count:
+                kwdefaults = dict(zip(*[iter(frame.pop_n(2 * kwdefaults_count))] * 2))
+            defaults = frame.pop_n(defaults_count)
+        fn = Function(name, code, frame.global_names, defaults, closure, self, kwdefaults, annotations)
+        frame.push(fn)
+
+    @threaded_step(threaded.call_function_step if WORDCODE else None)
     def byte_CALL_FUNCTION(self, arg):
         """
         call a function
-        :param arg:
+        :param arg: number of positional arguments (before Python 3.6, plus
+            256 times the number of keyword argument pairs)
+        """
+        frame = self.current_frame
+        if WORDCODE:
+            posargs = frame.pop_n(arg)
+            func = frame.pop()
+            if func.__class__ is Function or func.__class__ is types.MethodType:
+                return self.call_function(func, posargs, None)
+            if not arg and (func is locals or func is super or func is sys.exc_info):
+                frame.push(self.call_frame_builtin(func, frame))
+                return
+            frame.push(func(*posargs))
+            return
+
+        lenKw, lenPos = divmod(arg, 256)
+        pairs = frame.pop_n(2 * lenKw)
+        kwargs = dict(zip(pairs[::2], pairs[1::2]))
+        posargs = frame.pop_n(lenPos)
+        return self.call_function(frame.pop(), posargs, kwargs)
+
+    def byte_CALL_FUNCTION_KW(self, arg):
+        """
+        call a function with keyword arguments, named by the tuple on top of the stack
+        :param arg: number of arguments, positional and keyword
+        """
+        frame = self.current_frame
+        names = frame.pop()
+        args = frame.pop_n(arg)
+        func = frame.pop()
+        split = len(args) - len(names)
+        kwargs = dict(zip(names, args[split:]))
+        return self.call_function(func, args[:split], kwargs)
+
+    def byte_CALL_FUNCTION_EX(self, flags):
+        """
+        call a function with an iterable of positional arguments and,
+        when bit 0 of `flags` is set, a mapping of keyword arguments
+        :param flags:
+        """
+        frame = self.current_frame
+        kwargs = frame.pop() if flags & 0x01 else None
+        args = frame.pop()
+        return self.call_function(frame.pop(), args, kwargs)
+
+    @threaded_step(threaded.call_method_step)
+    def byte_CALL_METHOD(self, count):
+        """
+        call what LOAD_METHOD pushed with `count` positional arguments
+        :param count:
+        """
+        frame = self.current_frame
+        posargs = frame.pop_n(count)
+        method, obj = frame.pop_two()
+        if method is MISSING:
+            method = obj
+        else:
+            posargs.insert(0, obj)
+        if method.__class__ is Function or method.__class__ is types.MethodType:
+            return self.call_function(method, posargs, None)
+        if not count and (method is locals or method is sys.exc_info):
+            frame.push(self.call_frame_builtin(method, frame))
+            return
+        frame.push(method(*posargs))
+
+    def call_function(self, func, args, kwargs):
+        """
+        Call `func` from the current frame, pushing what it returns.
+        A guest function of this virtual machine is not run by a nested
+        run_frame: its frame is pushed on the call stack and 'call' returned,
+        for the loop running the current frame to go on in it, and for
+        finish_call to push its return value. Only native code calling back
+        into guest functions nests run loops in the host stack.
+        :param func:
+        :param args: positional arguments, as a tuple or list
+        :param kwargs: keyword arguments, as a dict or None
+        """
+        if func.__class__ is types.MethodType and func.__func__.__class__ is Function:
+            args = (func.__self__, *args)
+            func = func.__func__
+        if func.__class__ is not Function or func._vm is not self:
+            self.current_frame.push(func(*args, **kwargs) if kwargs else func(*args))
+            return None
+        if len(self.frames) >= self.recursion_limit:
+            raise RecursionError("maximum recursion depth exceeded")
+
+        frame = func.call_frame(args, kwargs)
+        if frame is None:
+            value = func._native(*args, **kwargs) if kwargs else func._native(*args)
+        elif func.func_code.co_flags & GENERATOR_FLAGS:
+            # the generator owns the frame, and runs it when asked for values
+            value = make_generator(frame, self)
+        else:
+            self.push_frame(frame)
+            return 'call'
+        self.current_frame.push(value)
+        return None
+
+    def call_frame_builtin(self, func, frame):
+        """
+        Call `locals`, `super` or `sys.exc_info` without arguments from
+        `frame`. The builtins would look at the frames of the interpreter
+        instead: locals returns the local variables of `frame`, super gets
+        the class and the instance of the method running in it, exc_info
+        returns the exception handled there.
+        :param func: locals, super or sys.exc_info
+        :param frame:
         """
-        lenKw, lenPos = divmod(arg, 256)  # KWargs not supported in byterun
-        posargs = self.current_frame.pop_n(lenPos)
+        if func is locals:
+            return frame.f_locals
+        if func is super:
+            return super(*self.super_arguments(frame))
+        return self.handled_exception(frame) or (None, None, None)
 
-        func = self.current_frame.pop()
-        return_value = func(*posargs)
-        self.current_frame.push(return_value)
+    def super_arguments(self, frame):
+        """
+        What `super()` called without arguments in `frame` stands for: the
+        class the method was defined in, from its `__class__` cell, and the
+        first argument of the method.
+        :param frame:
+        :return: arguments for super
+        """
+        code = frame.code_obj
+        if not code.co_argcount:
+            raise RuntimeError("super(): no arguments")
+        if '__class__' not in code.co_freevars:
+            raise RuntimeError("super(): __class__ cell not found")
+        cellvars = code.co_cellvars
+        cls = frame.cells[len(cellvars) + code.co_freevars.index('__class__')].cell_contents
+        if cls is UNBOUND:
+            raise RuntimeError("super(): empty __class__ cell")
+        first = code.co_varnames[0]
+        if first in cellvars:
+            return cls, frame.cells[cellvars.index(first)].cell_contents
+        return cls, frame.fast_locals[0]
+
+    def byte_YIELD_VALUE(self):
+        """
+        suspend the frame, yielding the value on top of the stack
+        :return:
+        """
+        frame = self.current_frame
+        value = frame.pop()
+        if frame.code_obj.co_flags & inspect.CO_ASYNC_GENERATOR:
+            value = AsyncGeneratorValue(value)
+        self.return_value = value
+        return "yield"
 
+    def byte_YIELD_FROM(self):
+        """
+        send the value on top of the stack into the iterator below it,
+        yielding what it yields until it is exhausted
+        :return:
+        """
+        frame = self.current_frame
+        value = frame.pop()
+        iterator = frame.top()
+        try:
+            if value is None and hasattr(type(iterator), '__next__'):
+                result = next(iterator)
+            else:
+                # native coroutines can only be driven by send
+                result = iterator.send(value)
+        except StopIteration as stop:
+            frame.pop()
+            frame.push(stop.value)
+            return None
+        self.return_value = result
+        # run YIELD_FROM again when resumed, with the next value sent in
+        self.jump(frame.last_instruction - 1)
+        return "yield"
+
+    def byte_GET_YIELD_FROM_ITER(self):
+        """
+        get the iterator of a `yield from`; generators are used as they are
+        """
+        frame = self.current_frame
+        if not isinstance(frame.top(), (Generator, types.GeneratorType)):
+            frame.push(iter(frame.pop()))
+
+    @threaded_step(threaded.return_value_step)
     def byte_RETURN_VALUE(self):
         """
         return value
@@ -649,6 +1778,76 @@ class VirtualMachine(object):
         self.return_value = self.current_frame.pop()
         return "return"
 
+    ## Superinstructions, made by the optimizer from pairs of instructions
+
+    @threaded_step(threaded.load_fast__load_fast_step)
+    def byte_LOAD_FAST__LOAD_FAST(self, first, second):
+        """
+        LOAD_FAST first, LOAD_FAST second
+        :param first:
+        :param second:
+        """
+        frame = self.current_frame
+        x = frame.fast_locals[first]
+        y = frame.fast_locals[second]
+        if x is UNBOUND or y is UNBOUND:
+            self.byte_LOAD_FAST(first)
+            self.byte_LOAD_FAST(second)
+        else:
+            frame.stack += (x, y)
+
+    @threaded_step(threaded.load_fast__load_const_step)
+    def byte_LOAD_FAST__LOAD_CONST(self, index, const):
+        """
+        LOAD_FAST index, LOAD_CONST const
+        :param index:
+        :param const:
+        """
+        self.byte_LOAD_FAST(index)
+        self.current_frame.push(const)
+
+    @threaded_step(threaded.store_fast__load_fast_step)
+    def byte_STORE_FAST__LOAD_FAST(self, first, second):
+        """
+        STORE_FAST first, LOAD_FAST second
+        :param first:
+        :param second:
+        """
+        frame = self.current_frame
+        frame.fast_locals[first] = frame.pop()
+        self.byte_LOAD_FAST(second)
+
+    @threaded_step(threaded.return_const_step)
+    def byte_RETURN_CONST(self, const):
+        """
+        LOAD_CONST const, RETURN_VALUE
+        :param const:
+        """
+        self.return_value = const
+        return "return"
+
+    @threaded_step(threaded.compare_op__pop_jump_if_false_step)
+    def byte_COMPARE_OP__POP_JUMP_IF_FALSE(self, opnum, jump):
+        """
+        COMPARE_OP opnum, POP_JUMP_IF_FALSE jump
+        :param opnum:
+        :param jump:
+        """
+        x, y = self.current_frame.pop_two()
+        if not self.COMPARE_OPERATORS[opnum](x, y):
+            self.jump(jump)
+
+    @threaded_step(threaded.compare_op__pop_jump_if_true_step)
+    def byte_COMPARE_OP__POP_JUMP_IF_TRUE(self, opnum, jump):
+        """
+        COMPARE_OP opnum, POP_JUMP_IF_TRUE jump
+        :param opnum:
+        :param jump:
+        """
+        x, y = self.current_frame.pop_two()
+        if self.COMPARE_OPERATORS[opnum](x, y):
+            self.jump(jump)
+
     ## Importing
 
     def byte_IMPORT_NAME(self, name):
@@ -656,7 +1855,7 @@ class VirtualMachine(object):
         import name
         :param name:
         """
-        level, fromlist = self.current_frame.pop_n(2)
+        level, fromlist = self.current_frame.pop_two()
         frame = self.current_frame
         self.current_frame.push(__import__(name, frame.global_names, frame.local_names, fromlist, level))
 
@@ -673,7 +1872,42 @@ class VirtualMachine(object):
         """
         build a class
         """
-        self.current_frame.push(__build_class__)
+        self.current_frame.push(self.build_class)
+
+    def build_class(self, func, name, *bases, **kwds):
+        """
+        Interpreted counterpart of `builtins.__build_class__`:
+        runs the class body `func` in a new namespace and creates the class.
+        :param func: function made from the class body
+        :param name: name of the class
+        :param bases:
+        :param kwds: class keywords, including `metaclass`
+        """
+        metaclass = kwds.pop('metaclass', None)
+        if metaclass is None:
+            metaclass = type(bases[0]) if bases else type
+        if isinstance(metaclass, type):
+            for base in bases:
+                base_meta = type(base)
+                if issubclass(base_meta, metaclass):
+                    metaclass = base_meta
+                elif not issubclass(metaclass, base_meta):
+                    raise TypeError("metaclass conflict: the metaclass of a derived class must be "
+                                    "a (non-strict) subclass of the metaclasses of all its bases")
+
+        prepare = getattr(metaclass, '__prepare__', None)
+        namespace = prepare(name, bases, **kwds) if prepare is not None else {}
+        frame = self.make_frame(func.func_code, global_names=func.func_globals, local_names=namespace,
+                                closure=func.func_closure)
+        self.run_frame(frame)
+        self.release_frame(frame)
+        # type() only takes cells of its own in `__classcell__`: the class is
+        # put in the cell the methods using super() and __class__ share here
+        cell = namespace.pop('__classcell__', None)
+        cls = metaclass(name, bases, namespace, **kwds)
+        if cell is not None:
+            cell.cell_contents = cls
+        return cls
 
     def byte_STORE_LOCALS(self):
         """
@@ -0,0 +1,24 @@
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def describe(name, greeting='Hello', *rest, punctuation='!', **extra):
+    text = greeting + ', ' + name + punctuation
+    for word in rest:
+        text = text + ' ' + word
+    for key in sorted(extra):
+        text = text + ' ' + key + '=' + str(extra[key])
+    return text
+
+
+print(fib(15))
+print(describe('world'))
+print(describe('you', 'Hi', 'and', 'more', punctuation='?', a=1, b=2))
+args = ('there', 'Hey')
+options = {'punctuation': '.', 'c': 3}
+print(describe(*args, **options))
+print(describe(greeting='Yo', name='kw'))
+print([x * x for x in range(5)])
+print(sorted([3, 1, 2], key=lambda v: -v))
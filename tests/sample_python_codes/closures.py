@@ -0,0 +1,75 @@
+import functools
+
+
+def counter(start=0):
+    count = start
+
+    def increment(by=1):
+        nonlocal count
+        count += by
+        return count
+
+    return increment
+
+
+def logged(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        result = function(*args, **kwargs)
+        print('called', function.__name__, args, '->', result)
+        return result
+
+    return wrapper
+
+
+@logged
+def area(width, height=1):
+    return width * height
+
+
+def scaled(factor):
+    return [x * factor for x in range(4)], {name: factor for name in 'ab'}
+
+
+def make_class(value):
+    class Holder:
+        kept = value
+
+        def get(self):
+            return value
+
+    return Holder
+
+
+class Shape:
+    def describe(self):
+        return 'shape'
+
+
+class Square(Shape):
+    def describe(self):
+        return 'square, a ' + super().describe() + ' of ' + __class__.__name__
+
+
+def unbound():
+    def read():
+        return later
+
+    try:
+        read()
+    except NameError as error:
+        print(type(error).__name__, error)
+    later = 1
+    return read()
+
+
+increment = counter(10)
+increment()
+print(increment(5))
+print(area(3, 4), area.__name__)
+print([function() for function in [lambda: i for i in range(3)]])
+print(scaled(3))
+Holder = make_class(7)
+print(Holder.kept, Holder().get())
+print(Square().describe())
+print(unbound())
@@ -0,0 +1,46 @@
+import asyncio
+
+
+class Connection:
+    def __init__(self, log):
+        self.log = log
+
+    async def __aenter__(self):
+        await asyncio.sleep(0)
+        self.log.append('open')
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.sleep(0)
+        self.log.append('close')
+        return exc_type is KeyError
+
+
+async def ticks(n):
+    for i in range(n):
+        await asyncio.sleep(0.001)
+        yield i
+
+
+async def fetch(log, key):
+    async with Connection(log):
+        if key is None:
+            raise KeyError(key)
+        await asyncio.sleep(0.05)
+        return key * 2
+
+
+async def main():
+    log = []
+    total = 0
+    async for i in ticks(5):
+        total += i
+    values = await asyncio.gather(fetch(log, 1), fetch(log, 2))
+    await fetch(log, None)
+    try:
+        await asyncio.wait_for(asyncio.sleep(10), 0.001)
+    except asyncio.TimeoutError:
+        log.append('timeout')
+    finally:
+        log.append('finally')
+    return total, values, log
@@ -0,0 +1,152 @@
+out = []
+
+class CM:
+    def __init__(self, name, swallow=False):
+        self.name, self.swallow = name, swallow
+    def __enter__(self):
+        out.append('enter ' + self.name)
+        return self
+    def __exit__(self, t, v, tb):
+        out.append('exit %s %s' % (self.name, t.__name__ if t else None))
+        return self.swallow
+
+def f1(n):
+    total = 0
+    for i in range(n):
+        try:
+            if i % 2:
+                continue
+            if i == 7:
+                break
+            try:
+                total += 10 // (i - 4)
+            except ZeroDivisionError as e:
+                out.append('zde %s' % e)
+                continue
+            finally:
+                out.append('inner finally %d' % i)
+        except Exception:
+            out.append('never')
+        finally:
+            out.append('outer finally %d' % i)
+    return total
+
+def f2():
+    try:
+        return 'try'
+    finally:
+        out.append('f2 finally')
+
+def f3():
+    for i in range(3):
+        try:
+            return i
+        finally:
+            out.append('f3 finally')
+
+def f4():
+    with CM('a'):
+        with CM('b', swallow=True):
+            raise KeyError('k')
+        out.append('after b')
+        try:
+            with CM('c'):
+                raise ValueError('v')
+        except ValueError as e:
+            out.append('caught %r' % e)
+    return 'f4'
+
+def f5():
+    try:
+        try:
+            raise ValueError(1)
+        except ValueError:
+            raise
+    except ValueError as e:
+        return e.args
+
+def f6():
+    def g():
+        try:
+            yield 1
+            yield 2
+        except KeyError:
+            out.append('g caught')
+            yield 3
+        finally:
+            out.append('g finally')
+    it = g()
+    r = [next(it), it.throw(KeyError)]
+    it.close()
+    return r
+
+def f7():
+    try:
+        raise 5
+    except TypeError as e:
+        return str(e)
+
+def f8():
+    try:
+        raise
+    except RuntimeError as e:
+        return str(e)
+
+def f9():
+    err = None
+    try:
+        try:
+            {}['x']
+        except KeyError as e:
+            err = e
+            raise ValueError('inner')
+    except ValueError as e:
+        return (type(err).__name__, str(e))
+
+def f10():
+    for i in range(3):
+        try:
+            pass
+        except Exception:
+            pass
+        else:
+            out.append('else %d' % i)
+        while True:
+            try:
+                break
+            finally:
+                out.append('while finally')
+    return 'f10'
+
+def f11():
+    try:
+        with CM('d'):
+            return 'ret in with'
+    finally:
+        out.append('f11 finally')
+
+def f12():
+    x = []
+    for i in range(4):
+        try:
+            try:
+                if i == 2:
+                    raise IndexError(i)
+                x.append(i)
+            finally:
+                if i == 3:
+                    x.append('f3')
+        except IndexError as e:
+            x.append('ie%s' % e)
+    return x
+
+def f13():
+    e1 = ValueError('same')
+    try:
+        raise e1
+    except ValueError as e:
+        return e is e1
+
+result = [f1(10), f2(), f3(), f4(), f5(), f6(), f7(), f8(), f9(), f10(), f11(), f12(), f13()]
+print(result)
+print(out)
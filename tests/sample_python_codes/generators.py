@@ -0,0 +1,50 @@
+def count_up(limit):
+    n = 0
+    while n < limit:
+        yield n
+        n += 1
+
+
+def squares(numbers):
+    for n in numbers:
+        yield n * n
+
+
+def chain(*iterables):
+    for iterable in iterables:
+        result = yield from iterable
+    return result
+
+
+def inner():
+    yield 1
+    yield 2
+    return 'inner done'
+
+
+def outer():
+    result = yield from inner()
+    yield result
+
+
+def accumulator():
+    total = 0
+    while True:
+        value = yield total
+        if value is None:
+            break
+        total += value
+
+
+print(list(count_up(5)))
+print(sum(squares(count_up(1000))))
+print(list(chain('ab', [1, 2], count_up(2))))
+print(list(outer()))
+print(sum(x * 2 for x in range(10) if x % 3))
+acc = accumulator()
+next(acc)
+print(acc.send(5), acc.send(10))
+total = 0
+for value in squares(count_up(20000)):
+    total += value
+print(total)
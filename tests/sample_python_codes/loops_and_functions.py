@@ -0,0 +1,50 @@
+def classify(n):
+    if n < 0:
+        return 'negative'
+    elif n == 0:
+        return 'zero'
+    return 'positive'
+
+
+def collatz_steps(n):
+    steps = 0
+    while n != 1:
+        if n % 2 == 0:
+            n = n // 2
+        else:
+            n = 3 * n + 1
+        steps += 1
+    return steps
+
+
+def first_multiple(items, k):
+    for item in items:
+        if item % k == 0:
+            break
+    else:
+        item = None
+    return item
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, n):
+        self.count = self.count + n
+        return self.count
+
+
+counter = Counter()
+for i in range(-2, 3):
+    print(classify(i), counter.add(i))
+steps = []
+for n in range(1, 10):
+    steps.append(collatz_steps(n))
+print(steps)
+print(first_multiple([3, 5, 7, 10], 5), first_multiple([1, 2], 7))
+while True:
+    i -= 1
+    if i < -3:
+        break
+print(i)
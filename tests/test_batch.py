@@ -0,0 +1,56 @@
+# coding=utf-8
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.batch import TIMEOUT_STATUS, expand_paths, run_many
+
+SCRIPTS = {
+    'a_print.py': "print('a')\n",
+    'b_exit.py': "import sys\nprint('b')\nsys.exit(3)\n",
+    'c_loop.py': "while True:\n    pass\n",
+    'd_raise.py': "raise ValueError('bad')\n",
+    'e_swallow.py': "while True:\n    try:\n        while True:\n            sorted(range(100000))\n    except:\n        pass\n",
+}
+
+
+class TestRunMany(TestCase):
+    """
+        Running many files on a pool of workers
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, source in SCRIPTS.items():
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_expand_paths(self):
+        pattern = os.path.join(self.directory, '*.py')
+        files = expand_paths(['first.py', pattern])
+        self.assertEqual(['first.py'] + [os.path.join(self.directory, name) for name in sorted(SCRIPTS)], files)
+
+    def test_run_many(self):
+        files = expand_paths([os.path.join(self.directory, '*.py')]) * 2
+        results = run_many(files, workers=2, timeout=0.3)
+        self.assertEqual(files, [result['file'] for result in results])
+        self.assertEqual([0, 3, TIMEOUT_STATUS, 1, TIMEOUT_STATUS] * 2, [result['exit_status'] for result in results])
+        self.assertEqual(['a\n', 'b\n', '', '', ''] * 2, [result['stdout'] for result in results])
+        self.assertTrue(results[2]['timed_out'] and results[4]['timed_out'])
+        self.assertIn('ValueError: bad', results[3]['error'])
+
+    def test_cli(self):
+        report = os.path.join(self.directory, 'report.json')
+        result = CliRunner().invoke(cli, ['run-many', '--workers', '1', '--report', report,
+                                          os.path.join(self.directory, 'a_*.py')])
+        self.assertEqual(0, result.exit_code)
+        with open(report) as f:
+            self.assertEqual(['a\n'], [entry['stdout'] for entry in json.load(f)])
@@ -0,0 +1,30 @@
+# coding=utf-8
+from unittest import TestCase
+
+from benchmarks.suite import ENGINES, CountingVirtualMachine, execute, find_regressions, programs
+
+
+class TestBenchmarkSuite(TestCase):
+    """
+        Benchmark runner and regression check
+    """
+
+    def test_programs(self):
+        self.assertIn('recursion', programs())
+        self.assertEqual(['dicts', 'objects'], programs(['objects', 'dicts', 'missing']))
+
+    def test_engines_agree(self):
+        code = compile("def f(n):\n    return n * 2\n\nresult = [f(i) for i in range(3)]\n", "<bench>", "exec")
+        results = [execute(engine, code)[0]['result'] for engine in ENGINES]
+        self.assertEqual([[0, 2, 4]] * 3, results)
+
+        _, vm = execute('chenab', code, CountingVirtualMachine)
+        self.assertGreater(vm.instructions, 20)
+
+    def test_find_regressions(self):
+        baseline = {'a': {'ratio': 100.0, 'threaded_ratio': 50.0}, 'b': {'ratio': 50.0}}
+        results = {'a': {'ratio': 109.0, 'threaded_ratio': 60.0}, 'b': {'ratio': 70.0, 'threaded_ratio': 90.0},
+                   'new': {'ratio': 500.0, 'threaded_ratio': 300.0}}
+        self.assertEqual([('a', 'threaded', 50.0, 60.0), ('b', 'classic', 50.0, 70.0)],
+                         find_regressions(results, baseline, 0.1))
+        self.assertEqual([], find_regressions(results, baseline, 0.5))
@@ -0,0 +1,47 @@
+# coding=utf-8
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.binder import ArgumentBinder
+from modules.frame import UNBOUND
+
+
+def binder_of(source):
+    """
+    binder of the first function defined in `source`
+    """
+    consts = compile(source, "<test>", "exec").co_consts
+    return ArgumentBinder(next(const for const in consts if hasattr(const, 'co_code')))
+
+
+class TestArgumentBinder(TestCase):
+    """
+        Binding call arguments into fast locals
+    """
+
+    def test_positional(self):
+        binder = binder_of("def f(a, b):\n    c = a\n")
+        self.assertEqual([1, 2, UNBOUND], binder.bind((1, 2), None, (), None))
+
+    def test_defaults_star_args_and_keywords(self):
+        binder = binder_of("def f(a, b=2, *rest, c, d=4, **extra):\n    pass\n")
+        self.assertEqual([1, 2, 3, 4, (), {}], binder.bind((1,), {'c': 3}, (2,), {'d': 4}))
+        self.assertEqual([1, 5, 3, 6, (7, 8), {'e': 9}],
+                         binder.bind((1, 5, 7, 8), {'c': 3, 'd': 6, 'e': 9}, (2,), {'d': 4}))
+
+    def test_errors(self):
+        binder = binder_of("def f(a, b, *, c):\n    pass\n")
+        for args, kwargs in [((1,), {'c': 3}), ((1, 2), {}), ((1, 2, 3), {'c': 3}),
+                             ((1, 2), {'a': 1, 'c': 3}), ((1, 2), {'c': 3, 'z': 0})]:
+            with self.assertRaises(TypeError):
+                binder.bind(args, kwargs, (), None)
+
+    def test_calls_sample(self):
+        path = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'calls.py')
+        result = CliRunner().invoke(cli, [path])
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(['610', 'Hello, world!', 'Hi, you? and more a=1 b=2', 'Hey, there. c=3', 'Yo, kw!',
+                          '[0, 1, 4, 9, 16]', '[3, 2, 1]'], result.output.splitlines())
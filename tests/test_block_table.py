@@ -0,0 +1,114 @@
+# coding=utf-8
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.block_table import block_table
+from modules.guest_traceback import CONTEXT_MESSAGE, extract, format_exception
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'exceptions.py')
+
+
+def decoded(source, name):
+    code = compile(source, "<test>", "exec")
+    code = next(const for const in code.co_consts if getattr(const, 'co_name', None) == name)
+    return VirtualMachine().instruction_cache[code]
+
+
+class TestBlockTable(TestCase):
+    """
+        Blocks found once per code object, and exceptions raised through them
+    """
+
+    def test_blocks_of_instructions(self):
+        instructions = decoded("def f(xs):\n    for x in xs:\n        try:\n            g(x)\n"
+                               "        except KeyError:\n            pass\n    return 1\n", 'f')
+        table = block_table(instructions)
+        call = next(index for index, i in enumerate(instructions) if i.name == 'CALL_FUNCTION')
+        self.assertEqual(['loop', 'setup-except'], [block.type for block in table[call]])
+        self.assertEqual('SETUP_EXCEPT', instructions[table[call][-1].setup].name)
+        # the handler runs outside of the block it handles
+        self.assertEqual(['loop'], [block.type for block in table[table[call][-1].handler]])
+        self.assertEqual((), table[-1])
+        self.assertIsNone(block_table(decoded("def f():\n    return 1\n", 'f')))
+
+    def test_same_output_as_python(self):
+        expected = subprocess.check_output([sys.executable, SAMPLE]).decode()
+        runner = CliRunner()
+        for options in ([], ['--optimize'], ['--engine', 'threaded'], ['--engine', 'threaded', '--optimize']):
+            result = runner.invoke(cli, options + [SAMPLE])
+            self.assertEqual((0, expected), (result.exit_code, result.output), options)
+
+    def test_exception_is_preserved(self):
+        source = "class E(Exception):\n    pass\n\nerr = E('x')\n\ndef f():\n    raise err\n\ndef g():\n    f()\n\n"
+        with self.assertRaises(Exception) as caught:
+            run(source + "g()\n")
+        self.assertEqual('E', type(caught.exception).__name__)
+        self.assertEqual(('x',), caught.exception.args)
+        names = run(source + "try:\n    g()\nexcept E as e:\n    same = e is err\n")
+        self.assertTrue(names['same'])
+
+    def test_guest_traceback(self):
+        source = "def parse(s):\n    return int(s)\n\ndef outer(items):\n    return [parse(x) for x in items]\n\n" \
+                 "outer(['1', 'x'])\n"
+        for engine in VirtualMachine.ENGINES:
+            with self.assertRaises(ValueError) as caught:
+                run(source, VirtualMachine(engine=engine))
+            frames = extract(caught.exception)
+            self.assertEqual([('<module>', 7), ('outer', 5), ('<listcomp>', 5), ('parse', 2)],
+                             [(frame.name, frame.lineno) for frame in frames])
+            lines = format_exception(caught.exception)
+            self.assertEqual('Traceback (most recent call last):\n', lines[0])
+            self.assertIn("ValueError: invalid literal", lines[-1])
+
+    def test_reraise_adds_no_frame(self):
+        source = "def f():\n    try:\n        1 / 0\n    except ZeroDivisionError:\n        raise\n\nf()\n"
+        with self.assertRaises(ZeroDivisionError) as caught:
+            run(source)
+        self.assertEqual([('<module>', 7), ('f', 3)], [(frame.name, frame.lineno) for frame in extract(caught.exception)])
+
+    def test_handled_exception_per_frame(self):
+        source = "import sys\n\ndef gen(name):\n    try:\n        raise ValueError(name)\n    except ValueError:\n" \
+                 "        yield sys.exc_info()[1].args[0]\n        try:\n            raise\n" \
+                 "        except ValueError as error:\n            yield str(error)\n\n" \
+                 "def inner():\n    return sys.exc_info()[0]\n\n" \
+                 "a, b = gen('a'), gen('b')\nr = [next(a), next(b), sys.exc_info(), next(a), next(b)]\n" \
+                 "try:\n    raise OSError\nexcept OSError:\n    r.append(inner())\nr.append(sys.exc_info())\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual(['a', 'b', (None, None, None), 'a', 'b', OSError, (None, None, None)], names['r'])
+
+    def test_exception_chaining(self):
+        source = "def f():\n    try:\n        1 / 0\n    except ZeroDivisionError as e:\n" \
+                 "        raise TypeError('bad') from e\n\n" \
+                 "def g():\n    try:\n        {}['k']\n    except KeyError:\n        raise ValueError('v') from None\n\n" \
+                 "def h():\n    try:\n        g()\n    except ValueError:\n        return [][0]\n\n"
+        for engine in VirtualMachine.ENGINES:
+            for call, kind, cause, context, suppressed in (('f', TypeError, ZeroDivisionError, ZeroDivisionError, True),
+                                                           ('g', ValueError, None, KeyError, True),
+                                                           ('h', IndexError, None, ValueError, False)):
+                with self.assertRaises(kind) as caught:
+                    run(source + call + "()\n", VirtualMachine(engine=engine))
+                error = caught.exception
+                self.assertEqual((cause, context, suppressed),
+                                 (type(error.__cause__) if error.__cause__ else None, type(error.__context__),
+                                  error.__suppress_context__))
+            lines = format_exception(error)
+            self.assertEqual('ValueError: v\n', lines[lines.index(CONTEXT_MESSAGE) - 1])
+
+    def test_cli_prints_guest_traceback(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fails.py')
+            with open(path, 'w') as f:
+                f.write("def f():\n    return {}['key']\n\nf()\n")
+            result = CliRunner(mix_stderr=False).invoke(cli, [path])
+        self.assertEqual(1, result.exit_code)
+        self.assertIn('File "%s", line 2, in f\n' % path, result.stderr)
+        self.assertTrue(result.stderr.endswith("KeyError: 'key'\n"))
@@ -0,0 +1,81 @@
+# coding=utf-8
+import builtins
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from modules.code_cache import SUFFIX, CodeCache, code_objects
+from modules.inline_cache import Namespace
+from modules.virtual_machine import VirtualMachine
+
+SOURCE = ("def outer(n):\n    def inner(m):\n        return m + 1\n    return inner(n) * 2\n\n"
+          "result = [outer(i) for i in range(3)]\n")
+
+
+def execute(vm, code):
+    names = Namespace({'__builtins__': builtins, '__name__': '__main__'})
+    vm.run_code(code, global_names=names)
+    return names['result']
+
+
+class TestCodeCache(TestCase):
+    """
+        On-disk cache of compiled and decoded code
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+
+    def test_warm_start(self):
+        cache = CodeCache(self.directory)
+        vm = VirtualMachine(optimize=True)
+        self.assertEqual([2, 4, 6], execute(vm, cache.load(SOURCE, 'a.py', vm)))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        self.assertEqual(1, len(self.files()))
+
+        vm = VirtualMachine(optimize=True)
+        code = cache.load(SOURCE, 'a.py', vm)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # every code object arrives decoded, nested ones included
+        self.assertEqual(4, len(vm.instruction_cache))
+        self.assertEqual(set(map(id, code_objects(code))), set(map(id, vm.instruction_cache.decoded)))
+        fresh = VirtualMachine(optimize=True).instruction_cache[code]
+        self.assertEqual([(i.name, i.handler) for i in fresh], [(i.name, i.handler) for i in vm.instruction_cache[code]])
+        self.assertEqual([2, 4, 6], execute(vm, code))
+
+        # another source, file name or virtual machine setup is another entry
+        cache.load(SOURCE + '\n', 'a.py', vm)
+        cache.load(SOURCE, 'b.py', vm)
+        cache.load(SOURCE, 'a.py', VirtualMachine())
+        self.assertEqual(4, len(self.files()))
+
+    def test_corrupt_file(self):
+        cache = CodeCache(self.directory)
+        cache.load(SOURCE, 'a.py', VirtualMachine())
+        with open(os.path.join(self.directory, self.files()[0]), 'wb') as f:
+            f.write(b'not marshal data')
+        vm = VirtualMachine()
+        code = cache.load(SOURCE, 'a.py', vm)
+        self.assertEqual(2, cache.misses)
+        self.assertEqual([2, 4, 6], execute(vm, code))
+
+    def test_eviction(self):
+        cache = CodeCache(self.directory)
+        for i in range(3):
+            cache.load('result = %d\n' % i, 'a.py', VirtualMachine())
+        size = os.path.getsize(os.path.join(self.directory, self.files()[0]))
+        oldest = os.path.join(self.directory, cache.key('result = 0\n', 'a.py', VirtualMachine()))
+        os.utime(oldest, (1, 1))
+
+        cache.max_bytes = size * 3
+        cache.load('result = 3\n', 'a.py', VirtualMachine())
+        self.assertEqual(3, len(self.files()))
+        self.assertFalse(os.path.exists(oldest))
+        self.assertEqual([], [name for name in os.listdir(self.directory) if name.endswith('.tmp')])
@@ -0,0 +1,67 @@
+# coding=utf-8
+import asyncio
+import os
+import time
+from unittest import TestCase
+
+from modules.__main__ import run_python_file_async
+from modules.generator import AsyncGenerator, Coroutine
+from tests.test_virtual_machine import run
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'coroutines.py')
+
+
+def run_until_complete(awaitable):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        loop.close()
+
+
+class TestCoroutine(TestCase):
+    """
+        Interpreted coroutines on a host event loop
+    """
+
+    def test_coroutines_sample(self):
+        result = run_until_complete(run_python_file_async(SAMPLE))
+        self.assertEqual((10, [2, 4], ['open', 'open', 'close', 'close', 'open', 'close', 'timeout', 'finally']),
+                         result)
+
+    def test_scripts_interleave(self):
+        # every run sleeps for about 0.06s; one after the other they would take 3s
+        async def run_all():
+            return await asyncio.gather(*[run_python_file_async(SAMPLE) for _ in range(50)])
+
+        start = time.time()
+        results = run_until_complete(run_all())
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(50, len(results))
+        self.assertTrue(all(result[:2] == (10, [2, 4]) for result in results))
+
+    def test_async_generator_protocol(self):
+        names = run("async def agen():\n    received = yield 1\n    yield received\n\n"
+                    "async def double(x):\n    return x * 2\n")
+        gen = names['agen']()
+        self.assertIsInstance(gen, AsyncGenerator)
+        self.assertIsInstance(names['double'](1), Coroutine)
+
+        async def drive():
+            first = await gen.__anext__()
+            second = await gen.asend('sent')
+            with self.assertRaises(StopAsyncIteration):
+                await gen.__anext__()
+            return first, second, await names['double'](21)
+
+        self.assertEqual((1, 'sent', 42), run_until_complete(drive()))
+
+    def test_with_and_finally(self):
+        names = run("class Manager:\n"
+                    "    def __enter__(self):\n        log.append('enter')\n        return 'value'\n"
+                    "    def __exit__(self, *exc_info):\n        log.append(exc_info[0])\n        return True\n\n"
+                    "log = []\n"
+                    "with Manager() as value:\n    log.append(value)\n    raise KeyError\n"
+                    "try:\n    try:\n        {}['missing']\n    finally:\n        log.append('finally')\n"
+                    "except KeyError:\n    log.append('caught')\n")
+        self.assertEqual(['enter', 'value', KeyError, 'finally', 'caught'], names['log'])
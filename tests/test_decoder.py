@@ -0,0 +1,55 @@
+# coding=utf-8
+import dis
+from types import SimpleNamespace
+from unittest import TestCase
+
+from modules.decoder import InstructionCache, decode
+
+
+def fake_code(code_bytes, consts=(), names=(), varnames=()):
+    """
+    a stand-in for a code object compiled by an older interpreter
+    """
+    return SimpleNamespace(co_code=bytes(code_bytes), co_consts=consts,
+                           co_names=names, co_varnames=varnames)
+
+
+class TestDecoder(TestCase):
+    """
+        Decoding code objects into instruction arrays
+    """
+
+    def test_compiled_code(self):
+        code = compile("x = 1\nwhile x:\n    x = 0\n", "<test>", "exec")
+        instructions = decode(code)
+        self.assertEqual([i.opname for i in dis.get_instructions(code)],
+                         [i.name for i in instructions])
+        self.assertEqual(('x',), instructions[1].arguments)
+        for instruction in instructions:
+            if instruction.opcode in dis.hasjrel + dis.hasjabs:
+                target = instruction.arguments[0]
+                self.assertTrue(0 <= target <= len(instructions))
+
+    def test_three_byte_format(self):
+        op = dis.opmap
+        code = fake_code([
+            op['LOAD_CONST'], 0, 0,
+            op['JUMP_FORWARD'], 1, 0,
+            op['POP_TOP'],
+            op['STORE_NAME'], 0, 0,
+            op['EXTENDED_ARG'], 1, 0,
+            op['LOAD_CONST'], 1, 0,
+            op['RETURN_VALUE'],
+        ], consts=['a'] * 65538, names=('x',))
+        instructions = decode(code, wordcode=False)
+        self.assertEqual(['LOAD_CONST', 'JUMP_FORWARD', 'POP_TOP', 'STORE_NAME', 'LOAD_CONST', 'RETURN_VALUE'],
+                         [i.name for i in instructions])
+        self.assertEqual((3,), instructions[1].arguments)
+        self.assertEqual(('x',), instructions[3].arguments)
+        self.assertEqual(10, instructions[4].offset)
+
+    def test_cache(self):
+        code = compile("y = 2\n", "<test>", "exec")
+        cache = InstructionCache()
+        self.assertIs(cache[code], cache[code])
+        self.assertEqual(1, len(cache))
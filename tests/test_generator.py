@@ -0,0 +1,96 @@
+# coding=utf-8
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+
+def native_counter():
+    """
+    a host generator that restarts its count when ValueError is thrown in
+    """
+    n = 0
+    while True:
+        try:
+            yield n
+            n += 1
+        except ValueError:
+            n = 100
+
+
+class TestGenerator(TestCase):
+    """
+        Interpreted generators
+    """
+
+    def test_generators_sample(self):
+        path = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'generators.py')
+        result = CliRunner().invoke(cli, [path])
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(['[0, 1, 2, 3, 4]', '332833500', "['a', 'b', 1, 2, 0, 1]", "[1, 2, 'inner done']",
+                          '54', '5 15', '2666466670000'], result.output.splitlines())
+
+    def test_send_throw_close(self):
+        gen = run("def g():\n    x = yield 1\n    yield x * 2\n\nr = g()\n")['r']
+        self.assertEqual(1, next(gen))
+        self.assertEqual(42, gen.send(21))
+        with self.assertRaises(KeyError):
+            gen.throw(KeyError)
+        with self.assertRaises(StopIteration):
+            next(gen)
+
+        gen = run("def g():\n    yield 1\n    yield 2\n\nr = g()\n")['r']
+        with self.assertRaises(TypeError):
+            gen.send('too early')
+        self.assertEqual(1, next(gen))
+        gen.close()
+        self.assertTrue(gen.finished)
+        self.assertIsNone(gen.gi_frame)
+        self.assertEqual([], list(gen))
+
+    def test_throw_into_yield_from(self):
+        names = run("def g(inner):\n    result = yield from inner\n    yield 'after'\n\n")
+        gen = names['g'](native_counter())
+        self.assertEqual([0, 1], [next(gen), next(gen)])
+        self.assertEqual(100, gen.throw(ValueError))
+        self.assertEqual(101, next(gen))
+        gen.close()
+        self.assertTrue(gen.finished)
+
+    def test_dropped_generator_is_closed(self):
+        source = "def g():\n    try:\n        yield 1\n        yield 2\n    finally:\n        log.append('closed')\n\n" \
+                 "def drop():\n    gen = g()\n    next(gen)\n\n" \
+                 "def unstarted():\n    gen = g()\n\n" \
+                 "log = []\ndrop()\nafter_drop = list(log)\nunstarted()\n" \
+                 "for x in g():\n    break\nafter_break = list(log)\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual((['closed'], ['closed', 'closed']), (names['after_drop'], names['after_break']))
+
+    def test_generator_dropped_while_unwinding(self):
+        source = "def g():\n    try:\n        yield 1\n    finally:\n        log.append('closed')\n\n" \
+                 "def f():\n    gen = g()\n    next(gen)\n    raise ValueError('boom')\n\n" \
+                 "def outer():\n    f()\n\n" \
+                 "log = []\ntry:\n    outer()\nexcept ValueError as e:\n    log.append(str(e))\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual(['closed', 'boom'], names['log'])
+
+    def test_except_generator_exit(self):
+        source = "def g():\n    try:\n        yield 1\n    except GeneratorExit:\n        log.append('closing')\n        raise\n\n" \
+                 "log = []\ngen = g()\nnext(gen)\ngen.close()\n" \
+                 "it = g()\nnext(it)\ntry:\n    it.throw(GeneratorExit)\nexcept BaseException as e:\n" \
+                 "    log.append(type(e).__name__)\n" \
+                 "try:\n    raise KeyboardInterrupt\nexcept KeyboardInterrupt:\n    log.append('interrupted')\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual(['closing', 'closing', 'GeneratorExit', 'interrupted'], names['log'])
+
+    def test_stop_iteration_inside_generator(self):
+        gen = run("def g():\n    yield next(iter([]))\n\nr = g()\n")['r']
+        with self.assertRaises(RuntimeError):
+            next(gen)
@@ -0,0 +1,57 @@
+# coding=utf-8
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.decoder import decode
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+SAMPLES = os.path.join(os.path.dirname(__file__), 'sample_python_codes')
+
+
+def optimized(source, name=None):
+    """
+    decode and optimize `source`, or the function called `name` in it
+    """
+    code = compile(source, "<test>", "exec")
+    if name is not None:
+        code = next(const for const in code.co_consts if getattr(const, 'co_name', None) == name)
+    return VirtualMachine(optimize=True).instruction_cache[code]
+
+
+class TestOptimizer(TestCase):
+    """
+        Superinstructions, jump threading and dead code removal
+    """
+
+    def test_superinstructions(self):
+        names = [i.name for i in optimized("def f(a, b):\n    if a < b:\n        return a + b\n    return 0\n", 'f')]
+        self.assertIn('LOAD_FAST__LOAD_FAST', names)
+        self.assertIn('COMPARE_OP__POP_JUMP_IF_FALSE', names)
+        self.assertIn('RETURN_CONST', names)
+
+    def test_jump_threading_and_dead_code(self):
+        source = "def f(x):\n    while x:\n        if x > 5:\n            x -= 2\n        else:\n            x -= 1\n    return x\n"
+        code = compile(source, "<test>", "exec").co_consts[0]
+        plain = decode(code, handlers=VirtualMachine.dispatch_table())
+        instructions = optimized(source, 'f')
+        self.assertLess(len(instructions), len(plain))
+        for instruction in instructions:
+            if instruction.name in ('JUMP_FORWARD', 'JUMP_ABSOLUTE', 'POP_JUMP_IF_FALSE'):
+                self.assertNotIn(instructions[instruction.arguments[0]].name, ('JUMP_FORWARD', 'JUMP_ABSOLUTE'))
+        self.assertEqual([0, 0], [run(source + "r = f(13)\n", VirtualMachine(optimize=flag))['r'] for flag in (False, True)])
+
+    def test_same_results_as_unoptimized(self):
+        """
+        every sample program prints the same with and without --optimize
+        """
+        runner = CliRunner()
+        for sample in sorted(name for name in os.listdir(SAMPLES) if name.endswith('.py')):
+            path = os.path.join(SAMPLES, sample)
+            plain = runner.invoke(cli, [path])
+            fused = runner.invoke(cli, ['--optimize', path])
+            self.assertEqual(0, plain.exit_code, sample)
+            self.assertEqual((plain.exit_code, plain.output), (fused.exit_code, fused.output), sample)
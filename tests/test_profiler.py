@@ -0,0 +1,86 @@
+# coding=utf-8
+import io
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.profiler import Profiler, ProfilingVirtualMachine
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+SOURCE = ("def fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)\n\n"
+          "def gen():\n    yield 1\n    yield 2\n\n"
+          "result = fib(10)\ntotal = sum(gen())\n")
+
+
+class TestProfiler(TestCase):
+    """
+        Deterministic profiling of opcodes and guest functions
+    """
+
+    def profile(self):
+        profiler = Profiler()
+        names = run(SOURCE, ProfilingVirtualMachine(profiler))
+        self.assertEqual(55, names['result'])
+        self.assertEqual(3, names['total'])
+        return profiler
+
+    def test_function_stats(self):
+        profiler = self.profile()
+        functions = dict((code.co_name, stats) for code, stats in profiler.functions.items())
+        fib = functions['fib']
+        self.assertEqual(177, fib.calls)
+        self.assertEqual(1, fib.primitive_calls)
+        self.assertLessEqual(fib.cumulative_time, functions['<module>'].cumulative_time)
+        self.assertLessEqual(fib.self_time, fib.cumulative_time * 1.01)
+        # resuming a generator is not another call
+        self.assertEqual(1, functions['gen'].calls)
+        self.assertEqual([], profiler.running)
+        self.assertEqual({0}, set(profiler.depth.values()))
+
+    def test_opcode_stats(self):
+        profiler = self.profile()
+        count, total = profiler.opcodes['RETURN_VALUE']
+        self.assertEqual(177 + 1 + 1, count)
+        self.assertGreater(total, 0)
+        self.assertEqual(2, profiler.opcodes['YIELD_VALUE'][0])
+
+        stream = io.StringIO()
+        profiler.print_stats(stream)
+        self.assertIn('RETURN_VALUE', stream.getvalue())
+        self.assertIn('177/1', stream.getvalue())
+
+    def test_budget(self):
+        for engine in VirtualMachine.ENGINES:
+            profiler = Profiler()
+            preempted = []
+            vm = ProfilingVirtualMachine(profiler, engine=engine, budget=100, preempt=preempted.append)
+            names = run(SOURCE, vm)
+            self.assertEqual(55, names['result'])
+            self.assertEqual(177, dict((code.co_name, stats) for code, stats in profiler.functions.items())['fib'].calls)
+            instructions = sum(count for count, total in profiler.opcodes.values())
+            self.assertEqual(instructions // 100, len(preempted))
+
+    def test_pstats_file(self):
+        profiler = self.profile()
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            profiler.dump_stats(path)
+            stats = pstats.Stats(path).stats
+        finally:
+            os.remove(path)
+        entry = [value for key, value in stats.items() if key[2] == 'fib'][0]
+        self.assertEqual((1, 177), entry[:2])
+        self.assertEqual(2, len(entry[4]))  # called from <module> and from fib
+
+    def test_cli(self):
+        path = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'hello_world.py')
+        result = CliRunner().invoke(cli, ['--profile', path])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('opcode', result.output)
+        self.assertIn('hello_world.py:1(<module>)', result.output)
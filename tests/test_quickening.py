@@ -0,0 +1,97 @@
+# coding=utf-8
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.quickening import MAX_WARMUP, QuickeningStats, adaptive_handler
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+SAMPLES = os.path.join(os.path.dirname(__file__), 'sample_python_codes')
+
+
+def quickened(engine='classic', warmup=4):
+    return VirtualMachine(engine=engine, quicken=True, quicken_warmup=warmup)
+
+
+def sites(vm, name):
+    code, = [code for code in vm.quickened if code.co_name == name]
+    return vm.quickened[code][1]
+
+
+class TestQuickening(TestCase):
+    """
+        Arithmetic and comparisons specialized for the types they run on
+    """
+
+    def test_specialized_after_warmup(self):
+        source = "def f(n):\n    total = 0\n    for i in range(n):\n        if i < n:\n" \
+                 "            total += i * 2\n    return total\n\nr = f(3), f(20)\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = quickened(engine)
+            self.assertEqual((6, 380), run(source, vm)['r'])
+            self.assertEqual([int, int, int], [site.kind for site in sites(vm, 'f')])
+            stats = vm.quickening_stats()
+            self.assertEqual(QuickeningStats(1, 1, 0, 1, 0), stats['BINARY_MULTIPLY'])
+            self.assertEqual(QuickeningStats(1, 1, 0, 1, 0), stats['COMPARE_OP'])
+
+    def test_deoptimized_when_types_change(self):
+        source = "def add(a, b):\n    return a + b\n\n" \
+                 "r = [add(1, 2) for _ in range(5)] + [add('a', 'b'), add(1.5, 1), add([1], [2])]\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = quickened(engine)
+            self.assertEqual([3] * 5 + ['ab', 2.5, [1, 2]], run(source, vm)['r'])
+            site, = sites(vm, 'add')
+            self.assertIsNone(site.kind)
+            self.assertEqual((1, 1), (site.specializations, site.deoptimizations))
+            self.assertIs(adaptive_handler, site.instructions[site.index].handler)
+
+    def test_unstable_site_goes_generic(self):
+        source = "def add(a, b):\n    return a + b\n\nr = [add(x, x) for _ in range(600) for x in (1, 'a')]\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = quickened(engine, warmup=MAX_WARMUP)
+            self.assertEqual([2, 'aa'] * 600, run(source, vm)['r'])
+            site, = sites(vm, 'add')
+            self.assertIs(site.generic, site.instructions[site.index])
+            self.assertEqual(QuickeningStats(1, 0, 1, 0, 0), vm.quickening_stats()['BINARY_ADD'])
+
+    def test_semantics_kept(self):
+        source = "xs = []\nys = xs\nfor i in range(10):\n    ys += [i]\n    s = 'ab'[i % 2] + str(i)\n" \
+                 "t = (1, 2)[0] - 0.5 * 2\nbig = 10 ** 30\nfor _ in range(10):\n    big = big * big % 97\n" \
+                 "try:\n    for i in range(10):\n        [1, 2][i]\nexcept IndexError:\n    caught = i\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, quickened(engine))
+            self.assertIs(names['xs'], names['ys'])
+            self.assertEqual(list(range(10)), names['xs'])
+            self.assertEqual(('b9', 0.0, 2), (names['s'], names['t'], names['caught']))
+            self.assertEqual(run(source)['big'], names['big'])
+
+    def test_overridden_handler_is_kept(self):
+        class Counting(VirtualMachine):
+            compares = 0
+
+            def byte_COMPARE_OP(self, opnum):
+                Counting.compares += 1
+                super(Counting, self).byte_COMPARE_OP(opnum)
+
+        vm = Counting(quicken=True, quicken_warmup=2)
+        self.assertTrue(run("r = [i < 3 for i in range(6)]\n", vm)['r'][2])
+        self.assertEqual(6, Counting.compares)
+        self.assertNotIn('COMPARE_OP', vm.quickening_stats())
+
+    def test_same_results_as_generic(self):
+        runner = CliRunner()
+        for sample in sorted(name for name in os.listdir(SAMPLES) if name.endswith('.py')):
+            path = os.path.join(SAMPLES, sample)
+            generic = runner.invoke(cli, [path])
+            for options in (['--quicken'], ['--quicken', '--engine', 'threaded', '--optimize']):
+                result = runner.invoke(cli, options + [path])
+                self.assertEqual((generic.exit_code, generic.output), (result.exit_code, result.output), sample)
+
+    def test_cli_prints_stats(self):
+        path = os.path.join(SAMPLES, 'loops_and_functions.py')
+        result = CliRunner(mix_stderr=False).invoke(cli, ['--quicken-stats', path])
+        self.assertEqual(0, result.exit_code)
+        self.assertTrue(result.stderr.startswith('opcode'))
@@ -0,0 +1,99 @@
+# coding=utf-8
+import builtins
+import os
+import tempfile
+from unittest import TestCase
+
+from modules.inline_cache import Namespace
+from modules.sampler import SamplingProfiler
+from modules.virtual_machine import VirtualMachine
+
+
+class TestSamplingProfiler(TestCase):
+    """
+        Sampling the guest call stack
+    """
+
+    def test_sample_lines(self):
+        sampler = SamplingProfiler()
+        source = ("def outer():\n"
+                  "    x = 1\n"
+                  "    return inner(x)\n"
+                  "\n"
+                  "def inner(x):\n"
+                  "    take_sample()\n"
+                  "    return x\n"
+                  "\n"
+                  "outer()\n")
+        vm = None
+
+        def take_sample():
+            sampler.sample(vm)
+
+        vm = VirtualMachine()
+        global_names = Namespace({'__builtins__': builtins, '__name__': '__main__', 'take_sample': take_sample})
+        vm.run_code(compile(source, "<sampled>", "exec"), global_names=global_names)
+
+        self.assertEqual(
+            ['<module> (<sampled>:9);outer (<sampled>:3);inner (<sampled>:6) 1'],
+            sampler.collapsed_stacks(),
+        )
+
+    def test_threaded_engine_lines(self):
+        # the steps of the threaded engine leave `last_instruction` behind,
+        # so a sampled virtual machine runs frames in the classic loop
+        sampler = SamplingProfiler(interval=60)
+        source = ("def spin(n):\n"
+                  "    total = 0\n"
+                  "    for i in range(n):\n"
+                  "        total += probe\n"
+                  "    return total\n"
+                  "\n"
+                  "spin(3)\n")
+        vm = VirtualMachine(engine='threaded')
+
+        class Probe(object):
+            def __radd__(self, other):
+                sampler.sample(vm)
+                return other
+
+        sampler.start(vm)
+        try:
+            global_names = Namespace({'__builtins__': builtins, '__name__': '__main__', 'probe': Probe()})
+            vm.run_code(compile(source, "<threaded>", "exec"), global_names=global_names)
+        finally:
+            sampler.stop()
+
+        self.assertEqual(['<module> (<threaded>:7);spin (<threaded>:4) 3'], sampler.collapsed_stacks())
+
+    def test_background_sampling(self):
+        sampler = SamplingProfiler(interval=0.001)
+        source = ("def spin(n):\n"
+                  "    total = 0\n"
+                  "    for i in range(n):\n"
+                  "        total += i\n"
+                  "    return total\n"
+                  "\n"
+                  "spin(100000)\n")
+        vm = VirtualMachine()
+        sampler.start(vm)
+        try:
+            global_names = Namespace({'__builtins__': builtins, '__name__': '__main__'})
+            vm.run_code(compile(source, "<spin>", "exec"), global_names=global_names)
+        finally:
+            sampler.stop()
+
+        self.assertGreater(sum(sampler.stacks.values()), 0)
+        for stack in sampler.stacks:
+            self.assertEqual(('<spin>', '<module>', 7), stack[0])
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            sampler.dump_stacks(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(path)
+        self.assertEqual(sampler.collapsed_stacks(), lines)
+        self.assertTrue(all(line.startswith('<module> (<spin>:7)') for line in lines))
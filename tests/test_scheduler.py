@@ -0,0 +1,112 @@
+# coding=utf-8
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.batch import TIMEOUT_STATUS
+from modules.scheduler import Scheduler
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+COUNTER = "for i in range(%d):\n    print(%r, i)\n"
+SPIN = "n = 0\nwhile True:\n    n += 1\n"
+
+
+def scheduled(policy='round-robin', quota=50, limit=None, **programs):
+    """
+    run `programs`, sources by name, and return their reports and outputs
+    """
+    scheduler = Scheduler(policy, quota, limit)
+    for name, source in sorted(programs.items()):
+        scheduler.submit(name, source=source, stdout=io.StringIO())
+    return scheduler.run()
+
+
+class TestBudget(TestCase):
+    """
+        Instructions counted down, and preempt called when they are used up
+    """
+
+    def test_preempt_called_per_budget(self):
+        source = "def f(n):\n    total = 0\n    for i in range(n):\n        total += i\n    return total\n\nr = f(100)\n"
+        for engine in VirtualMachine.ENGINES:
+            calls = []
+            vm = VirtualMachine(engine=engine, budget=10, preempt=lambda vm: calls.append(vm.countdown))
+            self.assertEqual(4950, run(source, vm)['r'])
+            self.assertGreater(len(calls), 50)
+            self.assertEqual({10}, set(calls))
+
+    def test_preempt_may_raise(self):
+        def preempt(vm):
+            raise KeyboardInterrupt()
+
+        source = "caught = False\ntry:\n    while True:\n        pass\nexcept Exception:\n    caught = True\n"
+        for engine in VirtualMachine.ENGINES:
+            with self.assertRaises(KeyboardInterrupt):
+                run(source, VirtualMachine(engine=engine, budget=100, preempt=preempt))
+
+
+class TestScheduler(TestCase):
+    """
+        Guest programs time-sliced in one process
+    """
+
+    def test_round_robin_interleaves(self):
+        results = scheduled(a=COUNTER % (200, 'a'), b=COUNTER % (200, 'b'))
+        self.assertEqual([0, 0], [result['exit_status'] for result in results])
+        for result, name in zip(results, 'ab'):
+            self.assertEqual(''.join('%s %d\n' % (name, i) for i in range(200)), result['stdout'])
+            self.assertGreater(result['slices'], 10)
+        self.assertLessEqual(abs(results[0]['slices'] - results[1]['slices']), 1)
+
+    def test_weighted_fair_shares(self):
+        scheduler = Scheduler('weighted-fair', quota=100)
+        heavy = scheduler.submit('heavy', source=SPIN, weight=3, limit=90000)
+        light = scheduler.submit('light', source=SPIN, weight=1, limit=30000)
+        shares = []
+        original = light.preempted
+
+        def preempted(vm):
+            original(vm)
+            shares.append(heavy.instructions / light.instructions)
+
+        light.preempted = light.vm.preempt = preempted
+        scheduler.run()
+        # while both ran, the heavy one got three times the instructions
+        self.assertAlmostEqual(3, shares[len(shares) // 2], delta=0.1)
+
+    def test_limit_stops_program(self):
+        source = "n = 0\nwhile True:\n    try:\n        n += 1\n    except:\n        pass\n"
+        results = scheduled(limit=1000, spin=source, done="print('done')\n")
+        done, spin = results
+        self.assertEqual((0, 'done\n'), (done['exit_status'], done['stdout']))
+        self.assertEqual(TIMEOUT_STATUS, spin['exit_status'])
+        self.assertTrue(spin['limited'])
+        self.assertEqual(1000, spin['instructions'])
+
+    def test_errors_are_reported(self):
+        results = scheduled(fails="def f():\n    return 1 / 0\n\nf()\n", exits="import sys\nsys.exit(3)\n")
+        exits, fails = results
+        self.assertEqual((3, None), (exits['exit_status'], exits['error']))
+        self.assertEqual(1, fails['exit_status'])
+        self.assertIn('line 2, in f', fails['error'])
+        self.assertTrue(fails['error'].endswith('ZeroDivisionError: division by zero\n'))
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, source in (('a.py', COUNTER % (50, 'a')), ('spin.py', SPIN)):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], 'w') as f:
+                    f.write(source)
+            result = CliRunner().invoke(cli, ['--engine', 'threaded', 'schedule', '--policy', 'weighted-fair',
+                                              '--quota', '20', '--limit', '5000'] + paths)
+        self.assertEqual(1, result.exit_code)
+        a, spin = json.loads(result.output)
+        self.assertEqual((paths[0], 0, 'a 49\n'), (a['file'], a['exit_status'], a['stdout'][-5:]))
+        self.assertEqual((TIMEOUT_STATUS, 5000), (spin['exit_status'], spin['instructions']))
@@ -0,0 +1,66 @@
+# coding=utf-8
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from modules.server import run_client, serve
+
+SCRIPT = "import sys\nprint('args', sys.argv[1:])\nprint('to stderr', file=sys.stderr)\nsys.exit(len(sys.argv))\n"
+
+
+class TestServer(TestCase):
+    """
+        Running files on a warm server
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'chenab.sock')
+        self.server = multiprocessing.Process(target=serve, args=(self.socket_path, 2))
+        self.server.start()
+        deadline = time.time() + 10
+        while not os.path.exists(self.socket_path) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.join()
+        shutil.rmtree(self.directory)
+
+    def run_file(self, source, *argv):
+        path = os.path.join(self.directory, 'script.py')
+        with open(path, 'w') as f:
+            f.write(source)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = run_client(self.socket_path, path, argv, stdout, stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_run(self):
+        self.assertEqual((3, "args ['a', 'b']\n", 'to stderr\n'), self.run_file(SCRIPT, 'a', 'b'))
+        # the workers carry on after a file failed
+        status, stdout, stderr = self.run_file("print('before')\nraise ValueError('bad')\n")
+        self.assertEqual((1, 'before\n'), (status, stdout))
+        self.assertIn('ValueError: bad', stderr)
+        status, stdout, stderr = self.run_file("raise KeyboardInterrupt('stop')\n")
+        self.assertEqual((1, ''), (status, stdout))
+        self.assertIn('KeyboardInterrupt: stop', stderr)
+        for _ in range(4):
+            self.assertEqual((0, 'hello\n', ''), self.run_file("print('hello')\n"))
+
+    def test_socket_private(self):
+        self.assertEqual(0, os.stat(self.socket_path).st_mode & 0o077)
+
+    def test_worker_replaced(self):
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                self.run_file("import os\nos._exit(0)\n")
+        self.assertEqual((0, 'alive\n', ''), self.run_file("print('alive')\n"))
+
+    def test_server_cleans_up(self):
+        self.server.terminate()
+        self.server.join()
+        self.assertFalse(os.path.exists(self.socket_path))
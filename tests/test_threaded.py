@@ -0,0 +1,84 @@
+# coding=utf-8
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.threaded import STOP
+from modules.virtual_machine import VirtualMachine
+from tests.test_virtual_machine import run
+
+SAMPLES = os.path.join(os.path.dirname(__file__), 'sample_python_codes')
+
+
+def threaded(optimize=False):
+    return VirtualMachine(optimize=optimize, engine='threaded')
+
+
+class TestThreadedEngine(TestCase):
+    """
+        Instructions run as pre-bound closures
+    """
+
+    def test_same_results_as_classic(self):
+        """
+        every sample program prints the same on both engines
+        """
+        runner = CliRunner()
+        for sample in sorted(name for name in os.listdir(SAMPLES) if name.endswith('.py')):
+            path = os.path.join(SAMPLES, sample)
+            classic = runner.invoke(cli, [path])
+            for options in (['--engine', 'threaded'], ['--engine', 'threaded', '--optimize']):
+                result = runner.invoke(cli, options + [path])
+                self.assertEqual((classic.exit_code, classic.output), (result.exit_code, result.output), sample)
+
+    def test_control_flow(self):
+        source = ("def f(n):\n    total = 0\n    for i in range(n):\n        if i % 3 == 0:\n            continue\n"
+                  "        if i > 10:\n            break\n        total += i\n    return total\n\n"
+                  "def g(n):\n    try:\n        return 1 // n\n    except ZeroDivisionError:\n        return -1\n"
+                  "    finally:\n        log.append(n)\n\n"
+                  "log = []\nr = [f(20), g(1), g(0), -f(5), not f(2)]\n")
+        for optimize in (False, True):
+            self.assertEqual([37, 1, -1, -7, False], run(source, threaded(optimize))['r'])
+            self.assertEqual([1, 0], run(source, threaded(optimize))['log'])
+
+    def test_errors(self):
+        with self.assertRaises(UnboundLocalError):
+            run("def f():\n    y = x\n    x = 1\n\nf()\n", threaded())
+        with self.assertRaises(NameError):
+            run("def f():\n    return missing\n\nf()\n", threaded(True))
+        with self.assertRaises(ValueError):
+            VirtualMachine(engine='jit')
+
+    def test_steps_made_once(self):
+        vm = threaded()
+        names = run("def f(n):\n    return n if n < 2 else f(n - 1) + f(n - 2)\n\nr = f(10)\n", vm)
+        self.assertEqual(55, names['r'])
+        code, = [code for code in vm.threaded_code if code.co_name == 'f']
+        steps = vm.steps(code)
+        self.assertIs(steps, vm.steps(code))
+        self.assertEqual(len(vm.instruction_cache[code]), len(steps))
+
+    def test_overridden_handler_is_called(self):
+        class Counting(VirtualMachine):
+            loads = 0
+
+            def byte_LOAD_FAST(self, index):
+                Counting.loads += 1
+                super(Counting, self).byte_LOAD_FAST(index)
+
+        names = run("def f(a):\n    return a + a\n\nr = f(2)\n", Counting(engine='threaded'))
+        self.assertEqual(4, names['r'])
+        self.assertEqual(2, Counting.loads)
+
+    def test_return_stops(self):
+        vm = threaded()
+        code = compile("x = 1\n", "<test>", "exec")
+        steps = vm.steps(code)
+        frame = vm.make_frame(code)
+        vm.push_frame(frame)
+        index = 0
+        while index != STOP:
+            index = steps[index](frame)
+        self.assertEqual('return', vm.why)
@@ -0,0 +1,396 @@
+# coding=utf-8
+import builtins
+import dis
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from chenab import cli
+from modules.__main__ import run_python_file
+from modules.decoder import decode
+from modules.frame import UNBOUND
+from modules.inline_cache import Namespace
+from modules.virtual_machine import VirtualMachine
+from modules.virtual_machine_error import VirtualMachineError
+
+CLOSURES = os.path.join(os.path.dirname(__file__), 'sample_python_codes', 'closures.py')
+
+
+def run(source, vm=None):
+    """
+    run `source` on a virtual machine and return its namespace
+    """
+    names = Namespace({'__builtins__': builtins, '__name__': '__main__'})
+    code = compile(source, "<test>", "exec")
+    (vm or VirtualMachine()).run_code(code, global_names=names, local_names=names)
+    return names
+
+
+class TestDispatch(TestCase):
+    """
+        Opcode dispatch table
+    """
+
+    def test_table_built_once_per_class(self):
+        self.assertIs(VirtualMachine.dispatch_table(), VirtualMachine().dispatch_table())
+
+        class Subclass(VirtualMachine):
+            def byte_NOP(self):
+                pass
+
+        self.assertIsNot(VirtualMachine.dispatch_table(), Subclass.dispatch_table())
+        self.assertIsNotNone(Subclass.dispatch_table()[dis.opmap['NOP']])
+
+    def test_operators(self):
+        names = run("a = 7\nb = 2\nc = a * b - a // b\nc += 1\nd = -c\ne = ~a\nf = a ** b % 10\n")
+        self.assertEqual(12, names['c'])
+        self.assertEqual(-12, names['d'])
+        self.assertEqual(-8, names['e'])
+        self.assertEqual(9, names['f'])
+
+    def test_stack_and_building(self):
+        names = run("a, b = 1, 2\na, b = b, a\nd = {'k': 1, 'gone': 0}\nd['k'] += 1\ndel d['gone']\n"
+                    "s = {a, b, a}\nsq = {n: n * n for n in s}\nodd = {n for n in sq if n % 2}\n"
+                    "f = f'{a}-{b!r:>3}-{1.5:.2f}'\n")
+        self.assertEqual((2, 1), (names['a'], names['b']))
+        self.assertEqual({'k': 2}, names['d'])
+        self.assertEqual({1: 1, 2: 4}, names['sq'])
+        self.assertEqual({1}, names['odd'])
+        self.assertEqual('2-  1-1.50', names['f'])
+
+    def test_unsupported_opcode_reported_on_decode(self):
+        self.assertNotIn('LOAD_CONST', VirtualMachine.unsupported_opcodes())
+        unknown = next(op for op in range(256) if VirtualMachine.dispatch_table()[op] is None)
+        code = SimpleNamespace(co_code=bytes([unknown, 0]), co_consts=(), co_names=(), co_varnames=())
+        with self.assertRaises(VirtualMachineError):
+            decode(code, handlers=VirtualMachine.dispatch_table())
+
+    def test_stack_primitives(self):
+        frame = VirtualMachine().make_frame(compile("pass\n", "<test>", "exec"))
+        frame.stack += (1, 2, 3, 4, 5)
+        self.assertEqual((4, 5), frame.pop_two())
+        self.assertEqual((1, 2, 3), frame.pop_three())
+        self.assertEqual([], frame.pop_n(0))
+        names = run("a, b, c = 1, 2, 3\na, b, c = c, a, b\nd = {}\nd[a], d[b] = b, c\n")
+        self.assertEqual((3, 1, 2), (names['a'], names['b'], names['c']))
+        self.assertEqual({3: 1, 1: 2}, names['d'])
+
+
+class TestFastLocals(TestCase):
+    """
+        Array backed local variables
+    """
+
+    def test_function_locals(self):
+        names = run("def f(a, b):\n    c = a + b\n    a = c * 2\n    return a - b\n\nx = f(1, 2)\ny = f(10, 20)\n")
+        self.assertEqual(4, names['x'])
+        self.assertEqual(40, names['y'])
+        self.assertNotIn('a', names)
+
+    def test_unbound_local(self):
+        with self.assertRaises(UnboundLocalError):
+            run("def f():\n    y = x\n    x = 1\n\nf()\n")
+
+    def test_f_locals_view(self):
+        code = compile("def f(a, b):\n    c = a\n", "<test>", "exec").co_consts[0]
+        vm = VirtualMachine()
+        frame = vm.make_frame(code, {'a': 1, 'b': 2}, {'__builtins__': builtins}, {})
+        self.assertEqual([1, 2, UNBOUND], frame.fast_locals)
+        self.assertEqual({'a': 1, 'b': 2}, frame.f_locals)
+
+    def test_locals_builtin(self):
+        source = "import builtins\n\ndef f(a):\n    b = a + 1\n    return locals()\n\n" \
+                 "def g(a):\n    def inner():\n        return a\n    before = set(locals())\n    x = 1\n" \
+                 "    return before, set(builtins.locals())\n\n" \
+                 "def h():\n    n = 5\n    def inner():\n        return n, locals()\n    return inner()\n\n" \
+                 "r = [f(1), g(2), h()]\nm = 'r' in locals()\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            f, g, h = names['r']
+            self.assertEqual({'a': 1, 'b': 2}, f)
+            self.assertEqual(({'a', 'inner'}, {'a', 'inner', 'before', 'x'}), g)
+            self.assertEqual((5, {'n': 5}), h)
+            self.assertTrue(names['m'])
+
+
+class TestNameCache(TestCase):
+    """
+        Inline caches of LOAD_GLOBAL and LOAD_NAME
+    """
+
+    def test_hits_and_invalidation(self):
+        vm = VirtualMachine()
+        names = run("def f(x):\n    return len(x) + k\n\n"
+                    "k = 1\ntotal = 0\nfor s in ['a', 'bb', 'ccc', 'dddd']:\n    total += f(s)\n"
+                    "k = 10\nc = f('')\nlen = lambda x: 100\nd = f('')\n", vm)
+        self.assertEqual([14, 10, 110], [names['total'], names['c'], names['d']])
+        hits, misses = vm.inline_cache_stats()['LOAD_GLOBAL']
+        self.assertEqual(4, hits)
+        self.assertEqual(8, misses)
+
+    def test_builtins_change(self):
+        names = run("import builtins\n"
+                    "def f():\n    return spam\n\n"
+                    "builtins.spam = 1\na = f()\nbuiltins.spam = 2\nb = f()\ndel builtins.spam\n")
+        self.assertEqual((1, 2), (names['a'], names['b']))
+
+    def test_global_statement(self):
+        names = run("def f():\n    global g\n    g = 5\n\nf()\nh = g\n")
+        self.assertEqual(5, names['h'])
+        with self.assertRaises(NameError):
+            run("def f():\n    return missing\n\nf()\n")
+
+    def test_namespace_version(self):
+        namespace = Namespace(a=1)
+        version = namespace.version
+        namespace['b'] = 2
+        namespace.update(c=3)
+        del namespace['a']
+        namespace.pop('b')
+        self.assertEqual(version + 4, namespace.version)
+
+    def test_main_module_is_the_namespace(self):
+        source = "import __main__\nimport pickle\n\nclass Point:\n    def __init__(self, x):\n" \
+                 "        self.x = x\n\ndef f():\n    return y\n\n" \
+                 "x = 1\nr = [__main__.x, pickle.loads(pickle.dumps(Point(2))).x]\n" \
+                 "__main__.y = 3\nr.append(f())\n__main__.y = 4\nr.append(f())\n"
+        main = sys.modules['__main__']
+        try:
+            run_python_file('<test>', source=source)
+            self.assertEqual([1, 2, 3, 4], sys.modules['__main__'].r)
+        finally:
+            sys.modules['__main__'] = main
+
+
+class TestAttributeCache(TestCase):
+    """
+        LOAD_METHOD / CALL_METHOD and the attribute cache
+    """
+
+    def test_methods(self):
+        vm = VirtualMachine()
+        names = run("class Base:\n    def value(self):\n        return 1\n\n"
+                    "class Child(Base):\n    def double(self):\n        return self.value() * 2\n\n"
+                    "c = Child()\ntotal = 0\nfor i in range(5):\n    total += c.double()\n"
+                    "items = []\nitems.append(total)\n", vm)
+        self.assertEqual(10, names['total'])
+        self.assertEqual([10], names['items'])
+        hits, misses = vm.inline_cache_stats()['LOAD_METHOD']
+        self.assertGreaterEqual(hits, 8)
+
+    def test_shadowing(self):
+        names = run("class A:\n    def f(self):\n        return 'class'\n\n"
+                    "a = A()\nr = []\nfor i in range(4):\n"
+                    "    if i == 1:\n        a.f = lambda: 'instance'\n"
+                    "    if i == 2:\n        del a.f\n        A.f = lambda self: 'patched'\n"
+                    "    r.append(a.f())\n")
+        self.assertEqual(['class', 'instance', 'patched', 'patched'], names['r'])
+
+    def test_descriptors_and_getattr(self):
+        names = run("class A:\n    @property\n    def f(self):\n        return lambda: 'property'\n\n"
+                    "class B:\n    def __getattr__(self, name):\n        return name.upper\n\n"
+                    "class C(A):\n    pass\n\n"
+                    "r = [A().f(), B().g(), C().f()]\nC.f = lambda self: 'override'\nr.append(C().f())\n")
+        self.assertEqual(['property', 'G', 'property', 'override'], names['r'])
+
+
+class TestFrameFreeList(TestCase):
+    """
+        Recycling finished frames
+    """
+
+    def test_frames_are_reused(self):
+        vm = VirtualMachine()
+        names = run("def f(n):\n    return n if n < 2 else f(n - 1) + f(n - 2)\n\nr = f(10)\n", vm)
+        self.assertEqual(55, names['r'])
+        free = sum(len(frames) for frames in vm.free_frames.values())
+        self.assertTrue(0 < free <= 11)
+        for frames in vm.free_frames.values():
+            for frame in frames:
+                self.assertIsNone(frame.fast_locals)
+                self.assertEqual([], frame.stack)
+
+    def test_free_list_disabled(self):
+        vm = VirtualMachine(max_free_frames=0)
+        run("def f():\n    return 1\n\nr = f()\n", vm)
+        self.assertEqual(0, sum(len(frames) for frames in vm.free_frames.values()))
+
+
+class TestCalls(TestCase):
+    """
+        Guest functions called in the loop of their caller
+    """
+
+    def test_deep_recursion(self):
+        source = "def depth(n):\n    return 0 if n == 0 else depth(n - 1) + 1\n\nr = depth(5000)\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = VirtualMachine(engine=engine, recursion_limit=6000)
+            self.assertEqual(5000, run(source, vm)['r'])
+            self.assertEqual([], vm.frames)
+
+    def test_recursion_limit(self):
+        source = "def forever(n):\n    return forever(n + 1)\n\n" \
+                 "try:\n    forever(0)\nexcept RecursionError as e:\n    error = str(e)\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = VirtualMachine(engine=engine, recursion_limit=100)
+            self.assertEqual("maximum recursion depth exceeded", run(source, vm)['error'])
+            self.assertEqual([], vm.frames)
+
+    def test_calls_of_every_kind(self):
+        source = "class A:\n    def __init__(self, x):\n        self.x = x\n\n" \
+                 "    def get(self, y=0, *rest, **kw):\n        return (self.x, y, rest, kw)\n\n" \
+                 "def gen(n):\n    yield from range(n)\n\ndef double(x):\n    return x * 2\n\n" \
+                 "a = A(1)\nbound = a.get\n" \
+                 "r = [a.get(), bound(2), a.get(3, 4, k=5), A.get(a, *[6], **{'k': 7}), list(gen(3)),\n" \
+                 "     sorted([3, 1, 2], key=double), list(map(double, [1, 2]))]\n"
+        expected = [(1, 0, (), {}), (1, 2, (), {}), (1, 3, (4,), {'k': 5}), (1, 6, (), {'k': 7}), [0, 1, 2],
+                    [1, 2, 3], [2, 4]]
+        for engine in VirtualMachine.ENGINES:
+            self.assertEqual(expected, run(source, VirtualMachine(engine=engine))['r'])
+
+    def test_exceptions_through_calls(self):
+        source = "def inner(x):\n    return 1 / x\n\ndef middle(x):\n    return inner(x)\n\n" \
+                 "def outer(x):\n    try:\n        return middle(x)\n    except ZeroDivisionError:\n        return 'caught'\n" \
+                 "    finally:\n        log.append(x)\n\nlog = []\nr = [outer(1), outer(0)]\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = VirtualMachine(engine=engine)
+            names = run(source, vm)
+            self.assertEqual(([1.0, 'caught'], [1, 0]), (names['r'], names['log']))
+            with self.assertRaises(TypeError):
+                run("def f(x):\n    return x\n\nf(1, 2)\n", vm)
+            self.assertEqual([], vm.frames)
+
+    def test_callbacks_from_native_code(self):
+        source = "import functools\n\ndef key(x):\n    return -x\n\ndef scope(x, y=1):\n    return x, y\n\n" \
+                 "def nested(xs):\n    return sorted(xs, key=lambda x: sorted([x, -x], key=key)[0])\n\n" \
+                 "def fails(x):\n    return 1 // x\n\n" \
+                 "r = [sorted([1, 3, 2], key=key), list(map(key, [1, 2])), max([1, 3, 2], key=key),\n" \
+                 "     functools.reduce(lambda a, b: a * b, [1, 2, 3, 4]), list(map(scope, [1, 2])),\n" \
+                 "     scope(3, y=4), nested([2, -3, 1])]\n" \
+                 "try:\n    list(map(fails, [1, 0]))\nexcept ZeroDivisionError:\n    r.append(list(map(fails, [1, 2])))\n"
+        for engine in VirtualMachine.ENGINES:
+            vm = VirtualMachine(engine=engine)
+            names = run(source, vm)
+            self.assertEqual([[3, 2, 1], [-1, -2], 1, 24, [(1, 1), (2, 1)], (3, 4), [1, 2, -3], [1, 0]], names['r'])
+            # the frame of the last call is kept for the next one, without its arguments
+            frame = names['key']._frame
+            self.assertIsNotNone(frame)
+            self.assertIsNone(frame.fast_locals)
+            self.assertEqual([], vm.frames)
+
+
+class TestClosures(TestCase):
+    """
+        Cells shared between functions and the functions nested in them
+    """
+
+    def test_cells_only_for_shared_names(self):
+        vm = VirtualMachine()
+        names = run("def plain(x):\n    return x\n\n"
+                    "def outer(x, y):\n    def inner():\n        return x\n    return inner\n\n"
+                    "inner = outer(1, 2)\nr = plain(3), inner()\n", vm)
+        self.assertEqual((3, 1), names['r'])
+        frame = vm.make_frame(names['outer'].func_code, {'x': 1, 'y': 2})
+        self.assertEqual([1], [cell.cell_contents for cell in frame.cells])
+        self.assertEqual([1, 2, UNBOUND], frame.fast_locals)
+        self.assertIsNone(vm.make_frame(names['plain'].func_code, {'x': 1}).cells)
+        self.assertEqual(1, len(names['inner'].func_closure))
+
+    def test_nonlocal_and_late_binding(self):
+        source = "def counter():\n    n = 0\n    def inc():\n        nonlocal n\n        n += 1\n        return n\n" \
+                 "    return inc\n\nc = counter()\nc()\n" \
+                 "r = [c(), [f() for f in [lambda: i for i in range(3)]], [x + c() for x in range(2)]]\n"
+        for engine in VirtualMachine.ENGINES:
+            self.assertEqual([2, [2, 2, 2], [3, 5]], run(source, VirtualMachine(engine=engine))['r'])
+
+    def test_unbound_cells(self):
+        source = "def f():\n    def g():\n        return v\n    try:\n        g()\n    except NameError as e:\n" \
+                 "        errors.append(str(e))\n    try:\n        v\n    except UnboundLocalError as e:\n" \
+                 "        errors.append(str(e))\n    v = 1\n    del v\n\nerrors = []\nf()\n"
+        for engine in VirtualMachine.ENGINES:
+            self.assertEqual(["free variable 'v' referenced before assignment in enclosing scope",
+                              "local variable 'v' referenced before assignment"],
+                             run(source, VirtualMachine(engine=engine))['errors'])
+
+    def test_class_bodies_and_super(self):
+        source = "def make(v):\n    class C:\n        w = v * 2\n        def get(self):\n" \
+                 "            return v\n    return C\n\n" \
+                 "class A:\n    def f(self):\n        return 'A'\n\n" \
+                 "class B(A):\n    def f(self):\n        return 'B' + super().f()\n\n" \
+                 "    def g(self):\n        return __class__, super().f\n\n" \
+                 "C = make(3)\nr = [C.w, C().get(), B().f(), B().g()[0] is B]\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual([6, 3, 'BA', True], names['r'])
+            with self.assertRaises(RuntimeError):
+                run("def f():\n    return super()\n\nf()\n", VirtualMachine(engine=engine))
+
+    def test_same_output_as_python(self):
+        expected = subprocess.check_output([sys.executable, CLOSURES]).decode()
+        runner = CliRunner()
+        for options in ([], ['--engine', 'threaded', '--optimize'], ['--quicken'], ['--hot-threshold', '1']):
+            result = runner.invoke(cli, options + [CLOSURES])
+            self.assertEqual((0, expected), (result.exit_code, result.output), options)
+
+
+class TestTiering(TestCase):
+    """
+        Hot functions running as native functions
+    """
+
+    def test_hot_function_goes_native(self):
+        vm = VirtualMachine(hot_threshold=3)
+        names = run("def f(n):\n    return n * 2\n\nr = [f(i) for i in range(10)]\n", vm)
+        self.assertEqual([i * 2 for i in range(10)], names['r'])
+        self.assertEqual(3, names['f']._calls)
+        self.assertIsNotNone(names['f']._native)
+
+    def test_cold_and_unsafe_functions_stay_interpreted(self):
+        vm = VirtualMachine(hot_threshold=3)
+        names = run("def cold():\n    return 1\n\n"
+                    "def setter(i):\n    global g\n    g = i\n\n"
+                    "def gen():\n    yield 1\n\n"
+                    "cold()\nfor i in range(5):\n    setter(i)\n    list(gen())\n"
+                    "def reader():\n    return g\n\nr = [reader() for i in range(5)]\n", vm)
+        self.assertEqual([4] * 5, names['r'])
+        for name, calls in (('cold', 1), ('setter', 5), ('gen', 5)):
+            self.assertEqual(calls, names[name]._calls)
+            self.assertIsNone(names[name]._native, name)
+        self.assertIsNotNone(names['reader']._native)
+
+    def test_recursive_function_stays_interpreted(self):
+        source = "def depth(n):\n    return 0 if n == 0 else depth(n - 1) + 1\n\n" \
+                 "r = [depth(3) for i in range(5)] + [depth(3000)]\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine, hot_threshold=2, recursion_limit=4000))
+            self.assertEqual([3] * 5 + [3000], names['r'])
+            self.assertIsNone(names['depth']._native)
+
+    def test_guest_calls_attribute(self):
+        source = "def counted(func):\n    def wrapper(*args):\n        wrapper.calls += 1\n        return func(*args)\n" \
+                 "    wrapper.calls = 0\n    return wrapper\n\n" \
+                 "@counted\ndef f(n):\n    return n\n\nf(1)\nf(2)\n"
+        for engine in VirtualMachine.ENGINES:
+            names = run(source, VirtualMachine(engine=engine))
+            self.assertEqual(2, names['f'].calls)
+            self.assertIn('calls', names['f'].__dict__)
+
+    def test_opting_out(self):
+        source = "def f():\n    return 1\n\ndef g():\n    return 2\n\nr = [f() + g() for i in range(5)]\n"
+        names = run(source, VirtualMachine(hot_threshold=2, native_policy=lambda function: function.__name__ != 'g'))
+        self.assertIsNotNone(names['f']._native)
+        self.assertIsNone(names['g']._native)
+
+        vm = VirtualMachine(hot_threshold=2)
+        vm.instrumented += 1
+        names = run(source, vm)
+        self.assertEqual([3] * 5, names['r'])
+        self.assertIsNone(names['f']._native)
+        self.assertEqual(5, names['f']._calls)
+
+        names = run(source)
+        self.assertIsNone(names['f']._native)